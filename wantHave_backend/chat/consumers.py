@@ -1,6 +1,6 @@
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from market import json_backend
 from market.models import Conversation, Message
 from django.contrib.auth import get_user_model
 from django.conf import settings
@@ -30,7 +30,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     # Receive message from WebSocket
     async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+        text_data_json = json_backend.loads(text_data)
         msg_type = text_data_json.get('type', 'message')
 
         if msg_type == 'offer':
@@ -72,7 +72,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         timestamp = event.get('timestamp', '')
 
         # Send message to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=json_backend.dumps({
             'type': 'message',
             'message': message,
             'sender_id': sender_id,
@@ -80,18 +80,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'sender_profile_picture': sender_profile_picture,
             'timestamp': timestamp,
             'conversation': self.room_name
-        }))
+        }).decode())
 
     # Receive offer event from room group
     async def offer_event(self, event):
         offer = event['offer']
 
         # Send offer to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send(text_data=json_backend.dumps({
             'type': 'offer',
             'offer': offer,
             'conversation': self.room_name
-        }))
+        }).decode())
 
     @database_sync_to_async
     def save_message(self, sender_id, message):
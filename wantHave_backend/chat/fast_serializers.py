@@ -0,0 +1,82 @@
+"""
+Fast read path for the conversation list.
+ConversationSerializer runs several queries per conversation (participants and
+their profiles, last message, product, seller); this builds the same output
+from four queries in total, whatever the number of conversations.
+"""
+from collections import defaultdict
+from django.contrib.auth import get_user_model
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from rest_framework import serializers
+
+from market.fast_serializers import datetime_converter
+from market.models import Conversation, Message, UserProfile
+
+User = get_user_model()
+
+
+def _user_data(row, storage, request):
+    picture = row['profile__profile_picture']
+    if picture:
+        picture = storage.url(picture)
+        if request is not None:
+            picture = request.build_absolute_uri(picture)
+    return {'id': row['id'], 'username': row['username'], 'email': row['email'], 'profile_picture': picture or None}
+
+
+def conversation_list_data(queryset, request=None):
+    """
+    List data for a conversation queryset, equal to ConversationSerializer(many=True)
+    with the request in its context.
+    """
+    conversations = list(queryset.values(
+        'id', 'created_at', 'product_id', 'product__title', 'product__price', 'product__seller_id'
+    ))
+    ids = [conversation['id'] for conversation in conversations]
+
+    participants = defaultdict(list)
+    for conversation_id, user_id in Conversation.participants.through.objects.filter(
+        conversation_id__in=ids
+    ).order_by('conversation_id', 'user_id').values_list('conversation_id', 'user_id'):
+        participants[conversation_id].append(user_id)
+
+    last_messages = {
+        message['conversation_id']: message
+        for message in Message.objects.filter(conversation_id__in=ids).annotate(
+            rank=Window(RowNumber(), partition_by=[F('conversation_id')], order_by=[F('timestamp').desc(), F('id').desc()])
+        ).filter(rank=1).values('id', 'conversation_id', 'sender_id', 'content', 'timestamp')
+    }
+
+    user_ids = {user_id for users in participants.values() for user_id in users}
+    user_ids.update(message['sender_id'] for message in last_messages.values())
+    storage = UserProfile._meta.get_field('profile_picture').storage
+    users = {}
+    senders = {}  # The last message is serialized without the request, so its URLs stay relative
+    for row in User.objects.filter(id__in=user_ids).values('id', 'username', 'email', 'profile__profile_picture'):
+        users[row['id']] = _user_data(row, storage, request)
+        senders[row['id']] = _user_data(row, storage, None)
+    to_datetime = datetime_converter(serializers.DateTimeField())
+
+    data = []
+    for conversation in conversations:
+        message = last_messages.get(conversation['id'])
+        data.append({
+            'id': conversation['id'],
+            'participants': [users[user_id] for user_id in participants[conversation['id']]],
+            'product': {
+                'id': conversation['product_id'],
+                'title': conversation['product__title'],
+                'price': str(conversation['product__price']),
+                'seller_id': conversation['product__seller_id'],
+            } if conversation['product_id'] is not None else None,
+            'last_message': {
+                'id': message['id'],
+                'conversation': message['conversation_id'],
+                'sender': senders[message['sender_id']],
+                'content': message['content'],
+                'timestamp': to_datetime(message['timestamp']),
+            } if message else None,
+            'created_at': to_datetime(conversation['created_at']),
+        })
+    return data
@@ -5,12 +5,18 @@ from django.db.models import Q
 from django.utils import timezone
 from django.conf import settings
 from market.models import Conversation, Product, Offer, Order
+from market.fast_serializers import FastListMixin
+from market.price_stats import record_accepted_offer
+from .fast_serializers import conversation_list_data
 from .serializers import ConversationSerializer, MessageSerializer, OfferSerializer
 
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(FastListMixin, viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def fast_list_data(self, queryset):
+        return conversation_list_data(queryset, self.request)
+
     def get_queryset(self):
         from django.db.models import Max
         return Conversation.objects.filter(participants=self.request.user).annotate(
@@ -86,19 +92,11 @@ class ConversationViewSet(viewsets.ModelViewSet):
         if conversations.exists():
             return Response(ConversationSerializer(conversations.first()).data)
 
-        # Create new conversation
-        conversation = Conversation.objects.create()
+        # Create new conversation, linked to the product if it exists
+        product = Product.objects.filter(id=product_id).first() if product_id else None
+        conversation = Conversation.objects.create(product=product)
         conversation.participants.add(request.user, other_user_id)
 
-        # Link to product if provided
-        if product_id:
-            try:
-                product = Product.objects.get(id=product_id)
-                conversation.product = product
-                conversation.save()
-            except Product.DoesNotExist:
-                pass
-
         return Response(ConversationSerializer(conversation).data, status=status.HTTP_201_CREATED)
 
 
@@ -222,6 +220,8 @@ class OfferViewSet(viewsets.ModelViewSet):
             offer.status = new_status
             offer.responded_at = timezone.now()
             offer.save()
+            if new_status == 'ACCEPTED':
+                record_accepted_offer(offer)
 
             serializer = OfferSerializer(offer)
             return Response(serializer.data)
@@ -297,7 +297,9 @@ class OfferViewSet(viewsets.ModelViewSet):
                 success_url=success_url,
                 cancel_url=cancel_url
             )
-            return Response(session_data, status=status.HTTP_201_CREATED)
+            # A still-open session for the same offer is handed out again
+            response_status = status.HTTP_200_OK if session_data['reused'] else status.HTTP_201_CREATED
+            return Response(session_data, status=response_status)
 
         except stripe.error.StripeError as e:
             return Response(
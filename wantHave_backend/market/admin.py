@@ -1,10 +1,60 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Product, UserProfile, Conversation, Message, Category, Order, Payment, StripeWebhookEvent
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.html import format_html_join
+from . import image_hashing
+from .duplicate_images import duplicate_image_index
+from .models import (
+    Product, UserProfile, Conversation, Message, Category, Order, Payment, StripeWebhookEvent,
+    AutofillCacheEntry
+)
+from .price_stats import record_sale
+from .product_search import product_search_index
+
+class PossibleDuplicateFilter(admin.SimpleListFilter):
+    """Report of available listings whose photo matches another available listing's"""
+    title = 'possible duplicates'
+    parameter_name = 'duplicates'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Same photo as another listing'),)
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(id__in=list(duplicate_image_index.duplicates()))
+        return queryset
 
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('title', 'seller', 'price', 'status', 'created_at')
-    list_filter = ('status', 'created_at')
+    list_display = ('title', 'seller', 'price', 'status', 'created_at', 'duplicate_photos')
+    list_filter = ('status', PossibleDuplicateFilter, 'created_at')
     search_fields = ('title', 'description', 'seller__username')
+    search_help_text = 'Title and description (typos tolerated) or exact seller username'
+
+    def get_search_results(self, request, queryset, search_term):
+        """Match titles and descriptions through the trigram index instead of LIKE scans"""
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        matches = product_search_index.search(
+            search_term, limit=settings.SEARCH_RESULT_LIMIT * 10, available_only=False
+        )
+        return queryset.filter(
+            Q(id__in=[product_id for product_id, _ in matches]) | Q(seller__username__iexact=search_term)
+        ), False
+
+    @admin.display(description='Same photo as')
+    def duplicate_photos(self, obj):
+        """Links to the available listings with a near-identical photo and how many hash bits differ"""
+        if obj.image_hash is None or obj.status != 'AVAILABLE':
+            return '-'
+        matches = duplicate_image_index.find(image_hashing.from_signed(obj.image_hash), exclude=obj.pk)
+        if not matches:
+            return '-'
+        return format_html_join(', ', '<a href="{}">#{}</a> ({} bits)', (
+            (reverse('admin:market_product_change', args=[product_id]), product_id, distance)
+            for product_id, distance in matches
+        ))
 
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'latitude', 'longitude')
@@ -36,7 +86,7 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ['id', 'product_title', 'buyer', 'seller', 'price', 'status', 'created_at', 'paid_at']
     list_filter = ['status', 'created_at']
     search_fields = ['product__title', 'buyer__username', 'seller__username']
-    readonly_fields = ['created_at', 'updated_at', 'stripe_checkout_session_id', 'paid_at']
+    readonly_fields = ['created_at', 'updated_at', 'stripe_checkout_session_id', 'stripe_checkout_url', 'checkout_expires_at', 'paid_at']
     actions = ['mark_as_paid', 'mark_as_failed']
 
     fieldsets = (
@@ -47,7 +97,7 @@ class OrderAdmin(admin.ModelAdmin):
             'fields': ('price', 'platform_fee', 'seller_amount')
         }),
         ('Stripe Details', {
-            'fields': ('stripe_checkout_session_id',)
+            'fields': ('stripe_checkout_session_id', 'stripe_checkout_url', 'checkout_expires_at')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at', 'paid_at')
@@ -74,6 +124,7 @@ class OrderAdmin(admin.ModelAdmin):
                 # Mark product as SOLD
                 order.product.status = 'SOLD'
                 order.product.save()
+                record_sale(order)
 
                 updated += 1
 
@@ -100,3 +151,11 @@ class StripeWebhookEventAdmin(admin.ModelAdmin):
     list_filter = ['event_type', 'processed', 'created_at']
     search_fields = ['event_id', 'event_type']
     readonly_fields = ['event_data', 'created_at']
+
+
+@admin.register(AutofillCacheEntry)
+class AutofillCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'content_hash', 'hit_count', 'created_at']
+    search_fields = ['content_hash']
+    readonly_fields = ['content_hash', 'perceptual_hash', 'result', 'hit_count', 'created_at']
+    exclude = ['phash_band_0', 'phash_band_1', 'phash_band_2', 'phash_band_3']
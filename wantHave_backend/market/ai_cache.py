@@ -0,0 +1,100 @@
+"""
+Content-addressed cache for AI autofill results.
+Repeat uploads of the same photo (exact hash) or a re-encoded/resized copy
+(perceptual hash within AI_AUTOFILL_CACHE_MAX_DISTANCE bits) are answered
+without spending Gemini quota.
+"""
+import io
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image
+
+from . import image_hashing
+from .models import AutofillCacheEntry
+
+logger = logging.getLogger('market.ai_autofill')
+
+
+class ImageFingerprint:
+    """Exact and perceptual hashes of one uploaded image"""
+
+    def __init__(self, image_bytes):
+        self.content_hash = image_hashing.content_hash(image_bytes)
+        try:
+            self.perceptual_hash = image_hashing.dhash(Image.open(io.BytesIO(image_bytes)))
+        except Exception:
+            # Not decodable - only exact matches are possible
+            self.perceptual_hash = None
+
+
+def _fresh_entries():
+    cutoff = timezone.now() - timedelta(seconds=settings.AI_AUTOFILL_CACHE_TTL)
+    return AutofillCacheEntry.objects.filter(created_at__gte=cutoff)
+
+
+def lookup(fingerprint):
+    """
+    Find a cached result for the image.
+
+    Returns:
+        Tuple (result, cache_info); result is None on a miss
+    """
+    entry = _fresh_entries().filter(content_hash=fingerprint.content_hash).only('id', 'result').first()
+    if entry is not None:
+        return _hit(entry.id, entry.result, {'status': 'hit', 'match': 'exact', 'distance': 0})
+
+    if fingerprint.perceptual_hash is not None:
+        # Bands can only guarantee recall up to BAND_COUNT - 1 differing bits
+        max_distance = min(settings.AI_AUTOFILL_CACHE_MAX_DISTANCE, image_hashing.BAND_COUNT - 1)
+        bands = image_hashing.hash_bands(fingerprint.perceptual_hash)
+        band_filter = Q()
+        for index, band in enumerate(bands):
+            band_filter |= Q(**{f'phash_band_{index}': band})
+
+        best = None
+        for entry_id, stored_hash in _fresh_entries().filter(band_filter).values_list('id', 'perceptual_hash'):
+            distance = image_hashing.hamming_distance(
+                fingerprint.perceptual_hash, image_hashing.from_signed(stored_hash)
+            )
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (entry_id, distance)
+
+        if best is not None:
+            result = AutofillCacheEntry.objects.values_list('result', flat=True).get(id=best[0])
+            return _hit(best[0], result, {'status': 'hit', 'match': 'perceptual', 'distance': best[1]})
+
+    logger.info('AI autofill cache miss %s', fingerprint.content_hash[:12])
+    return None, {'status': 'miss'}
+
+
+def _hit(entry_id, result, cache_info):
+    AutofillCacheEntry.objects.filter(id=entry_id).update(hit_count=F('hit_count') + 1)
+    logger.info('AI autofill cache %s hit (distance %s)', cache_info['match'], cache_info['distance'])
+    return result, cache_info
+
+
+def store(fingerprint, result):
+    """Cache a successful analysis result and drop expired entries"""
+    if fingerprint.perceptual_hash is None:
+        return
+
+    cutoff = timezone.now() - timedelta(seconds=settings.AI_AUTOFILL_CACHE_TTL)
+    AutofillCacheEntry.objects.filter(created_at__lt=cutoff).delete()
+
+    perceptual_hash = fingerprint.perceptual_hash
+    bands = image_hashing.hash_bands(perceptual_hash)
+    AutofillCacheEntry.objects.update_or_create(
+        content_hash=fingerprint.content_hash,
+        defaults={
+            'perceptual_hash': image_hashing.to_signed(perceptual_hash),
+            'phash_band_0': bands[0],
+            'phash_band_1': bands[1],
+            'phash_band_2': bands[2],
+            'phash_band_3': bands[3],
+            'result': result,
+            'created_at': timezone.now(),
+        }
+    )
@@ -0,0 +1,117 @@
+"""
+Background jobs for AI autofill.
+Runs image analysis on a bounded worker pool so the slow Gemini round trip never
+holds a request thread, and keeps job state in memory for cheap status polling.
+"""
+import io
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import ai_service
+
+
+class AutofillQueueFull(Exception):
+    """Raised when too many autofill jobs are queued or running."""
+
+
+class AutofillJobManager:
+    """
+    Accepts autofill jobs and runs them on a small thread pool.
+
+    Jobs live in process memory (the backend runs as a single replica) and are
+    dropped AI_AUTOFILL_JOB_TTL seconds after they finish.
+    """
+
+    def __init__(self, max_workers, max_pending, job_ttl, max_wait):
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self.max_wait = max_wait
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-autofill')
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, user_id, image_file):
+        """
+        Queue an image for analysis.
+
+        Args:
+            user_id: Owner of the job; only they can read it
+            image_file: Uploaded image; read into memory before the request ends
+
+        Returns:
+            Public job dict
+
+        Raises:
+            AutofillQueueFull: If max_pending jobs are already queued or running
+        """
+        image_bytes = image_file.read()
+        job_id = uuid.uuid4().hex
+
+        with self._lock:
+            self._prune(time.monotonic())
+            active = sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+            if active >= self.max_pending:
+                raise AutofillQueueFull()
+            job = {'id': job_id, 'user_id': user_id, 'status': 'queued', 'finished_at': None}
+            self._jobs[job_id] = job
+
+        self._executor.submit(self._run, job_id, image_bytes)
+        return self._public(job)
+
+    def get(self, job_id, user_id):
+        """Return the public job dict, or None if unknown, expired or not owned by user_id"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['user_id'] != user_id:
+                return None
+            return self._public(job)
+
+    def _run(self, job_id, image_bytes):
+        self._update(job_id, status='running')
+        close_old_connections()
+        try:
+            result = ai_service.analyze_product_image_cached(io.BytesIO(image_bytes), quota_timeout=self.max_wait)
+            if 'error' in result and result.get('title') == '':
+                self._update(
+                    job_id, status='failed', error=result['error'],
+                    error_code=result.get('error_code'), retry_after=result.get('retry_after')
+                )
+            else:
+                self._update(job_id, status='done', result=ai_service.build_autofill_suggestion(result))
+        except Exception as e:
+            self._update(job_id, status='failed', error=f'AI service error: {str(e)}')
+        finally:
+            close_old_connections()
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            if job['status'] in ('done', 'failed'):
+                job['finished_at'] = time.monotonic()
+
+    def _prune(self, now):
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['finished_at'] is not None and now - job['finished_at'] > self.job_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _public(job):
+        return {key: value for key, value in job.items() if key not in ('user_id', 'finished_at')}
+
+
+autofill_jobs = AutofillJobManager(
+    max_workers=settings.AI_AUTOFILL_WORKERS,
+    max_pending=settings.AI_AUTOFILL_MAX_PENDING,
+    job_ttl=settings.AI_AUTOFILL_JOB_TTL,
+    max_wait=settings.AI_AUTOFILL_MAX_WAIT
+)
@@ -2,105 +2,381 @@
 AI Service for product image analysis using Google Gemini Pro.
 Analyzes uploaded product images and suggests title, description, category, and price.
 """
+import io
 import os
 import base64
 import json
-import google.generativeai as genai
+import threading
+import time
+from collections import deque
 from django.conf import settings
+from PIL import Image, ImageOps
 
 
-def analyze_product_image(image_file):
+class QuotaLimiter:
+    """
+    Sliding-window limiter matching the Gemini quota (requests per minute and per day).
+
+    State is per process, which matches the single backend replica. A caller may
+    wait for a per-minute slot, but an exhausted daily quota is reported at once.
+    """
+
+    def __init__(self, per_minute, per_day):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self._lock = threading.Lock()
+        self._minute = deque()
+        self._day = deque()
+
+    def _prune(self, now):
+        while self._minute and now - self._minute[0] >= 60:
+            self._minute.popleft()
+        while self._day and now - self._day[0] >= 86400:
+            self._day.popleft()
+
+    def acquire(self, timeout=0):
+        """
+        Take one request slot.
+
+        Args:
+            timeout: Seconds the caller is willing to wait for a per-minute slot
+
+        Returns:
+            Tuple (acquired, retry_after_seconds)
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._prune(now)
+                if len(self._day) >= self.per_day:
+                    return False, int(self._day[0] + 86400 - now) + 1
+                if len(self._minute) < self.per_minute:
+                    self._minute.append(now)
+                    self._day.append(now)
+                    return True, 0
+                wait_for = self._minute[0] + 60 - now
+            if now + wait_for > deadline:
+                return False, int(wait_for) + 1
+            time.sleep(wait_for)
+
+    def reset(self):
+        with self._lock:
+            self._minute.clear()
+            self._day.clear()
+
+
+quota_limiter = QuotaLimiter(
+    per_minute=settings.AI_AUTOFILL_REQUESTS_PER_MINUTE,
+    per_day=settings.AI_AUTOFILL_REQUESTS_PER_DAY
+)
+
+
+# User has quota for this model (10 RPM, 20 RPD)
+GEMINI_MODEL_NAME = 'gemini-2.5-flash-lite'
+
+_model = None
+_model_api_key = None
+_model_lock = threading.Lock()
+
+
+def get_generative_model(api_key):
+    """
+    Return the process-wide Gemini model, configuring the SDK on first use.
+
+    google.generativeai is imported here rather than at module level so that
+    Django startup, migrations and cache hits never pay for loading it.
+    """
+    global _model, _model_api_key
+
+    with _model_lock:
+        if _model is None or _model_api_key != api_key:
+            import google.generativeai as genai
+
+            genai.configure(api_key=api_key)
+            _model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+            _model_api_key = api_key
+        return _model
+
+
+def prepare_image_for_model(image_bytes):
+    """
+    Shrink an uploaded image before it is sent to the model.
+
+    JPEGs are decoded at reduced scale via draft mode, EXIF orientation is applied,
+    metadata (EXIF, GPS) is dropped and the image is re-encoded as a JPEG whose
+    long edge is at most AI_AUTOFILL_MAX_IMAGE_EDGE.
+
+    Returns:
+        Blob dict {'mime_type', 'data'} accepted by generate_content
+    """
+    max_edge = settings.AI_AUTOFILL_MAX_IMAGE_EDGE
+    img = Image.open(io.BytesIO(image_bytes))
+
+    # Only affects JPEGs: decodes at the smallest 1/2, 1/4 or 1/8 scale still >= max_edge
+    img.draft('RGB', (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=settings.AI_AUTOFILL_IMAGE_QUALITY, optimize=True)
+    return {'mime_type': 'image/jpeg', 'data': output.getvalue()}
+
+
+def _empty_result(error, **extra):
+    return {
+        'error': error,
+        'title': '',
+        'description': '',
+        'category_suggestion': '',
+        'price_min': 0,
+        'price_max': 0,
+        **extra
+    }
+
+
+PRODUCT_FIELDS = """{
+    "title": "A concise, descriptive title for the product (max 100 chars)",
+    "description": "A detailed description of the product including condition, features, and any visible details (2-3 sentences)",
+    "category_suggestion": "The most appropriate category for this product (e.g., Electronics, Clothing, Furniture, Books, Sports, Toys, Home & Garden, etc.)",
+    "price_min": <minimum suggested price in EUR as a number>,
+    "price_max": <maximum suggested price in EUR as a number>
+}"""
+
+SINGLE_IMAGE_PROMPT = f"""Analyze this product image for a second-hand marketplace listing.
+
+Please provide the following information in JSON format:
+{PRODUCT_FIELDS}
+
+Consider the apparent condition of the item when suggesting prices.
+Respond ONLY with valid JSON, no additional text."""
+
+BATCH_PROMPT = """The following {count} images each show a different product for a second-hand marketplace listing.
+
+Analyze every image separately and respond with a JSON array of exactly {count} objects,
+in the same order as the images, each in this format:
+{fields}
+
+Consider the apparent condition of each item when suggesting prices.
+Respond ONLY with the valid JSON array, no additional text."""
+
+
+def _parse_model_json(response):
+    response_text = response.text.strip()
+
+    # Remove markdown code blocks if present
+    if response_text.startswith('```'):
+        lines = response_text.split('\n')
+        response_text = '\n'.join(lines[1:-1])
+
+    return json.loads(response_text)
+
+
+def _normalize_result(result):
+    """Ensure all required fields exist"""
+    return {
+        'title': result.get('title', ''),
+        'description': result.get('description', ''),
+        'category_suggestion': result.get('category_suggestion', ''),
+        'price_min': float(result.get('price_min', 0)),
+        'price_max': float(result.get('price_max', 0))
+    }
+
+
+def _acquire_model(quota_timeout):
+    """
+    Return (model, None), or (None, error_result) when no key is set or the quota is exhausted
+    """
+    api_key = os.environ.get('GEMINI_API_KEY')
+
+    if not api_key:
+        return None, _empty_result('GEMINI_API_KEY environment variable not set')
+
+    acquired, retry_after = quota_limiter.acquire(timeout=quota_timeout)
+    if not acquired:
+        return None, _empty_result(
+            'AI quota exhausted, please try again later',
+            error_code='rate_limited',
+            retry_after=retry_after
+        )
+    return get_generative_model(api_key), None
+
+
+def analyze_product_image(image_file, quota_timeout=0):
     """
     Analyze a product image using Gemini Pro Vision.
     
     Args:
         image_file: An uploaded image file (from request.FILES)
+        quota_timeout: Seconds to wait for a free per-minute quota slot
     
     Returns:
-        dict with keys: title, description, category_suggestion, price_min, price_max
+        dict with keys: title, description, category_suggestion, price_min, price_max.
+        When the quota is exhausted, 'error_code' is 'rate_limited' and 'retry_after' is set.
     """
-    api_key = os.environ.get('GEMINI_API_KEY')
-    
-    if not api_key:
-        return {
-            'error': 'GEMINI_API_KEY environment variable not set',
-            'title': '',
-            'description': '',
-            'category_suggestion': '',
-            'price_min': 0,
-            'price_max': 0
-        }
-    
     try:
-        # Configure the Gemini API
-        genai.configure(api_key=api_key)
-        
+        model, error = _acquire_model(quota_timeout)
+        if error:
+            return error
+
         # Read image bytes
         image_bytes = image_file.read()
         image_file.seek(0)  # Reset file pointer for potential later use
         
-        # Create the model - user has quota for this model (10 RPM, 20 RPD)
-        model = genai.GenerativeModel('gemini-2.5-flash-lite')
-        
-        # Prepare the image for the API using PIL
-        import io
-        from PIL import Image
+        # Shrink the image before upload - full-resolution photos dominate latency
+        img = prepare_image_for_model(image_bytes)
         
-        # Load image with PIL for better compatibility
-        img = Image.open(io.BytesIO(image_bytes))
+        # Generate content with image
+        response = model.generate_content([SINGLE_IMAGE_PROMPT, img])
+        return _normalize_result(_parse_model_json(response))
         
-        # Create the prompt
-        prompt = """Analyze this product image for a second-hand marketplace listing.
+    except json.JSONDecodeError as e:
+        return _empty_result(f'Failed to parse AI response: {str(e)}')
+    except Exception as e:
+        return _empty_result(f'AI analysis failed: {str(e)}')
 
-Please provide the following information in JSON format:
-{
-    "title": "A concise, descriptive title for the product (max 100 chars)",
-    "description": "A detailed description of the product including condition, features, and any visible details (2-3 sentences)",
-    "category_suggestion": "The most appropriate category for this product (e.g., Electronics, Clothing, Furniture, Books, Sports, Toys, Home & Garden, etc.)",
-    "price_min": <minimum suggested price in EUR as a number>,
-    "price_max": <maximum suggested price in EUR as a number>
-}
 
-Consider the apparent condition of the item when suggesting prices.
-Respond ONLY with valid JSON, no additional text."""
+def analyze_product_images(image_files, quota_timeout=0):
+    """
+    Analyze several product images with a single model call (one quota slot).
+
+    Args:
+        image_files: Uploaded image files, at most AI_AUTOFILL_BATCH_SIZE
+        quota_timeout: Seconds to wait for a free per-minute quota slot
+
+    Returns:
+        List of analyze_product_image results, in the order of image_files
+    """
+    if len(image_files) == 1:
+        return [analyze_product_image(image_files[0], quota_timeout=quota_timeout)]
+
+    try:
+        model, error = _acquire_model(quota_timeout)
+        if error:
+            return [error] * len(image_files)
+
+        parts = [BATCH_PROMPT.format(count=len(image_files), fields=PRODUCT_FIELDS)]
+        for image_file in image_files:
+            parts.append(prepare_image_for_model(image_file.read()))
+            image_file.seek(0)
+
+        results = _parse_model_json(model.generate_content(parts))
+        if not isinstance(results, list) or len(results) != len(image_files):
+            return [_empty_result('AI response did not contain one result per image')] * len(image_files)
+        return [_normalize_result(result) for result in results]
 
-        # Generate content with image
-        response = model.generate_content([prompt, img])
-        
-        # Parse the response
-        response_text = response.text.strip()
-        
-        # Remove markdown code blocks if present
-        if response_text.startswith('```'):
-            lines = response_text.split('\n')
-            response_text = '\n'.join(lines[1:-1])
-        
-        result = json.loads(response_text)
-        
-        # Ensure all required fields exist
-        return {
-            'title': result.get('title', ''),
-            'description': result.get('description', ''),
-            'category_suggestion': result.get('category_suggestion', ''),
-            'price_min': float(result.get('price_min', 0)),
-            'price_max': float(result.get('price_max', 0))
-        }
-        
     except json.JSONDecodeError as e:
-        return {
-            'error': f'Failed to parse AI response: {str(e)}',
-            'title': '',
-            'description': '',
-            'category_suggestion': '',
-            'price_min': 0,
-            'price_max': 0
-        }
+        return [_empty_result(f'Failed to parse AI response: {str(e)}')] * len(image_files)
     except Exception as e:
-        return {
-            'error': f'AI analysis failed: {str(e)}',
-            'title': '',
-            'description': '',
-            'category_suggestion': '',
-            'price_min': 0,
-            'price_max': 0
-        }
+        return [_empty_result(f'AI analysis failed: {str(e)}')] * len(image_files)
+
+
+def analyze_product_image_cached(image_file, quota_timeout=0):
+    """
+    Analyze a product image, answering repeats of an already analyzed photo from the cache.
+
+    Args:
+        image_file: An uploaded image file (from request.FILES)
+        quota_timeout: Seconds to wait for a free per-minute quota slot
+
+    Returns:
+        Same dict as analyze_product_image plus 'cache' with hit/miss telemetry and
+        'source' ('gemini', or 'offline' when the catalog fallback answered)
+    """
+    for _, result in analyze_product_images_cached([image_file], quota_timeout=quota_timeout):
+        return result
+
+
+def analyze_product_images_cached(image_files, quota_timeout=0):
+    """
+    Analyze several product images, yielding each result as soon as it is known.
+
+    Cache hits are answered immediately; misses are packed AI_AUTOFILL_BATCH_SIZE
+    at a time into one model call, so only that many images are held in memory.
+
+    Yields:
+        Tuples (index into image_files, analyze_product_image_cached result)
+    """
+    from . import ai_cache
+
+    pending = []
+    for index, image_file in enumerate(image_files):
+        image_bytes = image_file.read()
+        image_file.seek(0)
+        fingerprint = ai_cache.ImageFingerprint(image_bytes)
+
+        cached, cache_info = ai_cache.lookup(fingerprint)
+        if cached is not None:
+            yield index, {**cached, 'source': 'gemini', 'cache': cache_info}
+            continue
+
+        pending.append((index, image_file, fingerprint, cache_info))
+        if len(pending) >= settings.AI_AUTOFILL_BATCH_SIZE:
+            yield from _analyze_misses(pending, quota_timeout)
+            pending = []
+
+    if pending:
+        yield from _analyze_misses(pending, quota_timeout)
+
+
+def _analyze_misses(pending, quota_timeout):
+    from . import ai_cache, offline_classifier
+
+    results = analyze_product_images([image_file for _, image_file, _, _ in pending], quota_timeout=quota_timeout)
+    for (index, image_file, fingerprint, cache_info), result in zip(pending, results):
+        if 'error' not in result:
+            ai_cache.store(fingerprint, result)
+            yield index, {**result, 'source': 'gemini', 'cache': cache_info}
+            continue
+
+        # Remote model unavailable (no key, quota exhausted, failed call) - ask the catalog instead
+        fallback = offline_classifier.suggest_from_catalog(image_file.read())
+        image_file.seek(0)
+        if fallback is not None:
+            yield index, {**fallback, 'cache': cache_info}
+        else:
+            yield index, {**result, 'cache': cache_info}
+
+
+def build_autofill_suggestion(result):
+    """
+    Turn an analysis result into the autofill API payload.
+    Maps the suggested category onto the closest existing leaf category; no categories are created.
+    Adds that category's historical price band when the platform has enough sales.
+    """
+    from .category_matcher import category_matcher
+    from .price_stats import price_bands
+
+    category_name = result.get('category_suggestion', '')
+    category_id = result.get('category_id')
+    category_confidence = None
+
+    if category_name and category_id is None:
+        match = category_matcher.match(category_name)
+        if match:
+            category_id = match.category_id
+            category_name = match.name
+            category_confidence = match.confidence
+
+    suggestion = {
+        'title': result.get('title', ''),
+        'description': result.get('description', ''),
+        'category_id': category_id,
+        'category_name': category_name,
+        'price_min': result.get('price_min', 0),
+        'price_max': result.get('price_max', 0)
+    }
+    if category_confidence is not None:
+        suggestion['category_confidence'] = category_confidence
+    if category_id is not None:
+        # What items in this category actually sold for - from memory, no queries
+        band = price_bands.suggested(category_id)
+        if band:
+            suggestion['price_band'] = band
+    # Optional telemetry and offline fallback hints
+    for key in ('source', 'keywords', 'confidence', 'cache'):
+        if key in result:
+            suggestion[key] = result[key]
+    return suggestion
@@ -0,0 +1,291 @@
+"""
+Streaming bulk import and export of product listings.
+Rows are read one at a time from CSV or NDJSON, validated in chunks and written
+with bulk_create, one transaction per chunk; exports stream rows straight from a
+database cursor. Neither side holds the whole file or catalog in memory.
+"""
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import zipfile
+from collections import defaultdict
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from . import change_log, geo_grid, image_hashing
+from .duplicate_images import duplicate_image_index
+from .map_clusters import invalidate_cells
+from .models import Category, Product
+from .product_search import product_search_index
+from .saved_searches import saved_search_percolator
+from .serializers import ProductImportRowSerializer
+from .suggestions import suggestion_index
+
+logger = logging.getLogger('market.bulk_products')
+
+IMAGE_DIR = 'product_images/'
+MAX_ZIP_MEMBER_SIZE = 20 * 1024 * 1024  # Matches FILE_UPLOAD_MAX_MEMORY_SIZE
+EXPORT_FIELDS = [
+    'id', 'title', 'description', 'price', 'category', 'image',
+    'latitude', 'longitude', 'city', 'status', 'created_at'
+]
+
+
+class CategoryResolver:
+    """
+    Maps import values to category ids from one query: ids, unique names
+    (case-insensitive) and full 'Parent > Child' paths.
+    """
+
+    def __init__(self):
+        rows = list(Category.objects.values_list('id', 'name', 'parent_id'))
+        names = {category_id: name for category_id, name, _ in rows}
+        parents = {category_id: parent_id for category_id, _, parent_id in rows}
+
+        self.paths = {}
+        self.by_key = {}
+        ids_by_name = defaultdict(set)
+        for category_id, name, _ in rows:
+            path = [name]
+            parent_id = parents[category_id]
+            while parent_id is not None:
+                path.insert(0, names[parent_id])
+                parent_id = parents[parent_id]
+            self.paths[category_id] = ' > '.join(path)
+            self.by_key[self.paths[category_id].lower()] = category_id
+            ids_by_name[name.lower()].add(category_id)
+
+        # Plain names only resolve when unique; full paths always win
+        self.ambiguous = set()
+        for name, ids in ids_by_name.items():
+            if name in self.by_key:
+                continue
+            if len(ids) == 1:
+                self.by_key[name] = next(iter(ids))
+            else:
+                self.ambiguous.add(name)
+
+    def resolve(self, value):
+        """
+        Returns:
+            Tuple (category_id, error); both None for an empty value
+        """
+        value = (value or '').strip()
+        if not value:
+            return None, None
+        if value.isdigit() and int(value) in self.paths:
+            return int(value), None
+        key = ' > '.join(part.strip() for part in value.split('>')).lower()
+        if key in self.by_key:
+            return self.by_key[key], None
+        if key in self.ambiguous:
+            return None, f"Category '{value}' is ambiguous, use the full 'Parent > Child' path."
+        return None, f"Unknown category '{value}'."
+
+
+def iter_rows(upload, file_format):
+    """
+    Yield (row_number, data, error) for each record of a CSV or NDJSON upload.
+    Empty CSV cells are treated as missing values.
+    """
+    text = io.TextIOWrapper(getattr(upload, 'file', upload), encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        for row_number, row in enumerate(csv.DictReader(text), start=1):
+            yield row_number, {key: value for key, value in row.items() if key and value not in ('', None)}, None
+        return
+
+    row_number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(data, dict):
+            yield row_number, None, 'Each line must be a JSON object.'
+            continue
+        yield row_number, data, None
+
+
+class ProductImporter:
+    """
+    Import listings for one seller.
+
+    Args:
+        seller: User the listings belong to
+        images_zip: Optional uploaded zip archive whose members rows may reference by name
+        batch_size: Rows validated and written per transaction
+    """
+
+    def __init__(self, seller, images_zip=None, batch_size=None):
+        self.seller = seller
+        self.batch_size = batch_size or settings.BULK_IMPORT_BATCH_SIZE
+        self.categories = CategoryResolver()
+        self.archive = zipfile.ZipFile(images_zip) if images_zip else None
+        self.members = {
+            info.filename: info for info in self.archive.infolist() if not info.is_dir()
+        } if self.archive else {}
+
+        # Default location from the seller's profile, read once instead of per row
+        profile = getattr(seller, 'profile', None)
+        self.default_location = (
+            getattr(profile, 'latitude', None), getattr(profile, 'longitude', None), getattr(profile, 'city', None)
+        )
+
+    def run(self, upload, file_format):
+        """
+        Yield one result per row ({'row', 'status': 'created', 'id'} or {'row', 'status': 'error', 'errors'}),
+        then {'summary': {'created', 'failed'}}.
+        """
+        created = failed = 0
+        rows = iter_rows(upload, file_format)
+        for chunk_index in itertools.count():
+            chunk = list(itertools.islice(rows, self.batch_size))
+            if not chunk:
+                break
+            if chunk_index * self.batch_size + len(chunk) > settings.BULK_IMPORT_MAX_ROWS:
+                yield {'row': chunk[0][0], 'status': 'error',
+                       'errors': {'file': [f'At most {settings.BULK_IMPORT_MAX_ROWS} rows per import.']}}
+                failed += 1
+                break
+            for result in self._import_chunk(chunk):
+                if result['status'] == 'created':
+                    created += 1
+                else:
+                    failed += 1
+                yield result
+        yield {'summary': {'created': created, 'failed': failed}}
+
+    def _import_chunk(self, chunk):
+        """Validate and write one chunk; results are returned in row order"""
+        results = []
+        valid = []
+        for row_number, data, error in chunk:
+            if error:
+                results.append({'row': row_number, 'status': 'error', 'errors': {'row': [error]}})
+                continue
+            product, image_member, errors = self._build(data)
+            if errors:
+                results.append({'row': row_number, 'status': 'error', 'errors': errors})
+            else:
+                valid.append((row_number, product, image_member))
+
+        if valid:
+            results.extend(self._write(valid))
+        return sorted(results, key=lambda result: result['row'])
+
+    def _write(self, valid):
+        stored = []
+        try:
+            with transaction.atomic():
+                for _, product, image_member in valid:
+                    if image_member:
+                        content = ContentFile(self.archive.read(image_member))
+                        product.image_hash = image_hashing.stored_dhash(content)
+                        name = default_storage.save(IMAGE_DIR + os.path.basename(image_member.filename), content)
+                        stored.append(name)
+                        product.image = name
+                Product.objects.bulk_create([product for _, product, _ in valid])
+                cells = {product.grid_cell for _, product, _ in valid}
+                transaction.on_commit(lambda: invalidate_cells(*cells))
+                # bulk_create sends no post_save, so new listings are percolated here
+                product_ids = [product.id for _, product, _ in valid]
+                change_log.record_created(product_ids)
+                transaction.on_commit(lambda: saved_search_percolator.products_created(product_ids))
+                hashes = [(product.id, product.image_hash, product.status) for _, product, _ in valid]
+                transaction.on_commit(lambda: duplicate_image_index.products_saved(hashes))
+                rows = [(product.id, product.title, product.description, product.status) for _, product, _ in valid]
+                transaction.on_commit(lambda: product_search_index.products_saved(rows))
+                titles = [product.title for _, product, _ in valid if product.status == 'AVAILABLE']
+                transaction.on_commit(lambda: suggestion_index.products_listed(titles))
+        except Exception as e:
+            logger.exception('Bulk import chunk failed')
+            for name in stored:
+                default_storage.delete(name)
+            return [
+                {'row': row_number, 'status': 'error', 'errors': {'row': [f'Could not be saved: {e}']}}
+                for row_number, _, _ in valid
+            ]
+
+        return [{'row': row_number, 'status': 'created', 'id': product.id} for row_number, product, _ in valid]
+
+    def _build(self, data):
+        """Validate one row; returns (unsaved Product, zip member or None, errors or None)"""
+        serializer = ProductImportRowSerializer(data=data)
+        if not serializer.is_valid():
+            return None, None, serializer.errors
+        row = serializer.validated_data
+
+        errors = {}
+        category_id, category_error = self.categories.resolve(row.get('category'))
+        if category_error:
+            errors['category'] = [category_error]
+
+        image, image_member = row['image'], None
+        if image in self.members:
+            image_member = self.members[image]
+            if image_member.file_size > MAX_ZIP_MEMBER_SIZE:
+                errors['image'] = ['Image in archive is too large.']
+        elif not image.startswith(IMAGE_DIR) or '..' in image or not default_storage.exists(image):
+            errors['image'] = [f"Image '{image}' is neither a stored product image nor in the archive."]
+
+        if errors:
+            return None, None, errors
+
+        default_latitude, default_longitude, default_city = self.default_location
+        latitude = row.get('latitude', default_latitude)
+        longitude = row.get('longitude', default_longitude)
+        product = Product(
+            seller=self.seller,
+            title=row['title'],
+            description=row['description'],
+            price=row['price'],
+            category_id=category_id,
+            image=image,
+            latitude=latitude,
+            longitude=longitude,
+            city=row.get('city') or default_city,
+            # bulk_create skips Product.save()
+            grid_cell=geo_grid.cell_for(latitude, longitude),
+        )
+        return product, image_member, None
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output"""
+
+    def write(self, value):
+        return value
+
+
+def iter_export(queryset, file_format):
+    """
+    Yield the listings of a queryset as CSV (with header) or NDJSON, chunk by chunk.
+    Columns match the import format, so an export can be re-imported.
+    """
+    paths = CategoryResolver().paths
+    rows = queryset.order_by('id').values_list(
+        'id', 'title', 'description', 'price', 'category_id', 'image',
+        'latitude', 'longitude', 'city', 'status', 'created_at'
+    ).iterator(chunk_size=settings.BULK_EXPORT_CHUNK_SIZE)
+
+    writer = csv.writer(_Echo())
+    if file_format == 'csv':
+        yield writer.writerow(EXPORT_FIELDS).encode()
+
+    for row in rows:
+        record = dict(zip(EXPORT_FIELDS, row))
+        record['category'] = paths.get(record['category'])
+        if file_format == 'csv':
+            yield writer.writerow(['' if value is None else value for value in record.values()]).encode()
+        else:
+            yield (json.dumps(record, cls=DjangoJSONEncoder) + '\n').encode()
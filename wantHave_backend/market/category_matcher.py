@@ -0,0 +1,189 @@
+"""
+In-memory fuzzy matcher from free-text category suggestions to existing leaf categories.
+Replaces the per-call name__iexact query (and the junk categories created on a miss)
+with token and trigram posting lists over the category tree, scored in one pass.
+"""
+import re
+import threading
+from collections import defaultdict
+
+from .models import Category
+
+# Leaves under these roots are never suggested for items being listed for sale
+EXCLUDED_ROOTS = {'to give away'}
+STOPWORDS = {'and', 'or', 'the', 'of', 'for', 'with', 'other', 'misc'}
+MIN_CONFIDENCE = 0.35
+MIN_TOKEN_SIMILARITY = 0.5  # Trigram Dice needed to treat a misspelled token as a known one
+
+# Weights of the three signals; an exact leaf-name match scores 1.0
+TOKEN_RECALL_WEIGHT = 0.5  # Share of query tokens found in the leaf (parent tokens count half)
+TOKEN_PRECISION_WEIGHT = 0.2  # Share of leaf-name tokens found in the query
+TRIGRAM_WEIGHT = 0.3  # Dice similarity of character trigrams, tolerates typos
+
+TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def normalize_tokens(text):
+    """Lowercase word tokens with possessives and simple plurals folded"""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower().replace("'s", '')):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def trigrams(text):
+    grams = set()
+    for token in TOKEN_RE.findall(text.lower()):
+        padded = f'  {token} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class CategoryMatch:
+    def __init__(self, category_id, name, confidence):
+        self.category_id = category_id
+        self.name = name
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f'CategoryMatch({self.category_id}, {self.name!r}, {self.confidence})'
+
+
+class CategoryIndex:
+    """Posting lists of one build of the category tree; never changed once built"""
+
+    def __init__(self):
+        self.leaves = {}
+        self.token_postings = defaultdict(set)
+        self.parent_token_postings = defaultdict(set)
+        self.trigram_postings = defaultdict(set)
+        self.vocabulary_trigrams = defaultdict(set)
+
+
+class CategoryMatcher:
+    """
+    Index of leaf categories, built lazily from one query and rebuilt after
+    Category changes (see market.signals). A rebuild swaps in a whole new
+    CategoryIndex, so match() never sees a half-built one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._index = CategoryIndex()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_loaded(self):
+        """Returns the current CategoryIndex, building it first if needed"""
+        if self._loaded:
+            return self._index
+        with self._lock:
+            if not self._loaded:
+                self._index = self._build(list(Category.objects.values_list('id', 'name', 'parent_id')))
+                self._loaded = True
+            return self._index
+
+    @staticmethod
+    def _build(rows):
+        names = {category_id: name for category_id, name, _ in rows}
+        parents = {category_id: parent_id for category_id, _, parent_id in rows}
+        has_children = {parent_id for _, _, parent_id in rows if parent_id is not None}
+
+        index = CategoryIndex()
+        for category_id, name, _ in rows:
+            if category_id in has_children:
+                continue
+            ancestors = []
+            parent_id = parents.get(category_id)
+            while parent_id is not None:
+                ancestors.append(names[parent_id])
+                parent_id = parents.get(parent_id)
+            if ancestors and ancestors[-1].lower() in EXCLUDED_ROOTS:
+                continue
+
+            leaf_tokens = set(normalize_tokens(name))
+            parent_tokens = set(token for ancestor in ancestors for token in normalize_tokens(ancestor)) - leaf_tokens
+            leaf_trigrams = trigrams(name)
+            index.leaves[category_id] = (name, len(leaf_tokens), len(leaf_trigrams))
+
+            for token in leaf_tokens:
+                index.token_postings[token].add(category_id)
+            for token in parent_tokens:
+                index.parent_token_postings[token].add(category_id)
+            for gram in leaf_trigrams:
+                index.trigram_postings[gram].add(category_id)
+            for token in leaf_tokens | parent_tokens:
+                for gram in trigrams(token):
+                    index.vocabulary_trigrams[gram].add(token)
+        return index
+
+    @staticmethod
+    def _correct(index, token):
+        """Map an unknown (misspelled) token to the most similar indexed token"""
+        if token in index.token_postings or token in index.parent_token_postings:
+            return token
+        token_trigrams = trigrams(token)
+        shared = defaultdict(int)
+        for gram in token_trigrams:
+            for candidate in index.vocabulary_trigrams.get(gram, ()):
+                shared[candidate] += 1
+        best, best_similarity = token, MIN_TOKEN_SIMILARITY
+        for candidate, count in shared.items():
+            similarity = 2 * count / (len(token_trigrams) + len(trigrams(candidate)))
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def match(self, text):
+        """
+        Return the best existing leaf category for a free-text suggestion.
+
+        Returns:
+            CategoryMatch, or None if nothing reaches MIN_CONFIDENCE
+        """
+        index = self._ensure_loaded()
+        query_tokens = set(self._correct(index, token) for token in normalize_tokens(text))
+        query_trigrams = trigrams(text)
+        if not query_tokens or not query_trigrams:
+            return None
+
+        leaf_hits = defaultdict(int)
+        parent_hits = defaultdict(int)
+        shared_trigrams = defaultdict(int)
+        for token in query_tokens:
+            for category_id in index.token_postings.get(token, ()):
+                leaf_hits[category_id] += 1
+            for category_id in index.parent_token_postings.get(token, ()):
+                parent_hits[category_id] += 1
+        for gram in query_trigrams:
+            for category_id in index.trigram_postings.get(gram, ()):
+                shared_trigrams[category_id] += 1
+
+        best = None
+        for category_id in set(leaf_hits) | set(parent_hits) | set(shared_trigrams):
+            name, leaf_token_count, leaf_trigram_count = index.leaves[category_id]
+            recall = (leaf_hits[category_id] + 0.5 * parent_hits[category_id]) / len(query_tokens)
+            precision = leaf_hits[category_id] / leaf_token_count if leaf_token_count else 0.0
+            dice = 2 * shared_trigrams[category_id] / (len(query_trigrams) + leaf_trigram_count)
+            score = (
+                TOKEN_RECALL_WEIGHT * min(recall, 1.0)
+                + TOKEN_PRECISION_WEIGHT * precision
+                + TRIGRAM_WEIGHT * dice
+            )
+            # Ties go to the older (seeded) category
+            if best is None or score > best[0] or (score == best[0] and category_id < best[1]):
+                best = (score, category_id, name)
+
+        if best is None or best[0] < MIN_CONFIDENCE:
+            return None
+        return CategoryMatch(best[1], best[2], round(best[0], 2))
+
+
+category_matcher = CategoryMatcher()
@@ -0,0 +1,140 @@
+"""
+Product change log for incremental client sync (GET /products/changes/).
+market.signals appends a ProductChange row in the same transaction as every
+product create, update, sale and delete; bulk imports append theirs in bulk. A
+client loads the product list once, then asks for the changes after its sync
+token and gets the current state of changed products plus tombstones (ids) of
+deleted ones.
+
+The token is the last change id the client has seen plus the time it was
+current. Ids are handed out by the single SQLite writer, so they become visible
+in order and a client never skips a change. compact_product_changes drops
+entries superseded by a newer entry of the same product, which no client needs,
+and entries older than CHANGE_LOG_RETENTION_DAYS; tokens older than that may
+have missed dropped changes and are refused, and the client reloads the list.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from .models import ProductChange
+
+
+class ExpiredSyncToken(Exception):
+    """Raised when a sync token predates the retained change log."""
+
+
+def make_token(change_id, at):
+    return f'{change_id}.{int(at.timestamp())}'
+
+
+def parse_token(token):
+    """
+    Returns:
+        (last change id seen, time the client was current)
+
+    Raises:
+        ValueError: The token is malformed
+    """
+    change_id, _, seconds = token.partition('.')
+    change_id, seconds = int(change_id), int(seconds)
+    if change_id < 0 or seconds < 0:
+        raise ValueError(f'Invalid sync token {token!r}')
+    try:
+        return change_id, datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+    except (OverflowError, OSError) as error:
+        raise ValueError(f'Invalid sync token {token!r}') from error
+
+
+def current_token():
+    """Token of the current end of the log, to take before loading the full list"""
+    latest = ProductChange.objects.aggregate(latest=Max('id'))['latest'] or 0
+    return make_token(latest, timezone.now())
+
+
+def record(product, created, previous_status=None):
+    """Log a saved product (called from post_save, inside the saving transaction)"""
+    if created:
+        action = ProductChange.CREATED
+    elif product.status == 'SOLD' and previous_status != 'SOLD':
+        action = ProductChange.SOLD
+    else:
+        action = ProductChange.UPDATED
+    ProductChange.objects.create(product_id=product.pk, action=action)
+
+
+def record_created(product_ids):
+    """Log products created without post_save, e.g. by a bulk import"""
+    ProductChange.objects.bulk_create([
+        ProductChange(product_id=product_id, action=ProductChange.CREATED) for product_id in product_ids
+    ])
+
+
+def record_deleted(product_id):
+    ProductChange.objects.create(product_id=product_id, action=ProductChange.DELETED)
+
+
+def changes_since(token, limit=None):
+    """
+    Products changed after a sync token, each once with its latest action.
+
+    Args:
+        token: Token from current_token() or a previous call
+        limit: Log entries read at most; default settings.CHANGE_FEED_PAGE_SIZE
+
+    Returns:
+        (ids of created or updated products, ids of deleted products, next token, whether more changes follow)
+
+    Raises:
+        ValueError: The token is malformed
+        ExpiredSyncToken: Changes after the token may have been compacted away
+    """
+    limit = settings.CHANGE_FEED_PAGE_SIZE if limit is None else limit
+    since_id, since_at = parse_token(token)
+    if since_at < timezone.now() - timedelta(days=settings.CHANGE_LOG_RETENTION_DAYS):
+        raise ExpiredSyncToken(token)
+    read_at = timezone.now()
+    rows = list(
+        ProductChange.objects.filter(id__gt=since_id).order_by('id').values_list('id', 'product_id', 'action', 'created_at')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    # With more to read, the client is only current up to the first entry it has not seen
+    next_at = rows[limit][3] if has_more else read_at
+    rows = rows[:limit]
+
+    latest = {}
+    for _, product_id, action, _ in rows:
+        latest.pop(product_id, None)  # Keep products in the order of their latest change
+        latest[product_id] = action
+    changed = [product_id for product_id, action in latest.items() if action != ProductChange.DELETED]
+    deleted = [product_id for product_id, action in latest.items() if action == ProductChange.DELETED]
+    next_id = rows[-1][0] if rows else since_id
+    return changed, deleted, make_token(next_id, next_at), has_more
+
+
+def compact(batch_size):
+    """
+    Drop superseded and expired log entries, batch_size ids per statement so
+    writers are never blocked for long.
+
+    Returns:
+        (superseded entries dropped, expired entries dropped)
+    """
+    cutoff = timezone.now() - timedelta(days=settings.CHANGE_LOG_RETENTION_DAYS)
+    expired = 0
+    while True:
+        ids = list(ProductChange.objects.filter(created_at__lt=cutoff).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        expired += ProductChange.objects.filter(created_at__lt=cutoff, id__lte=ids[-1]).delete()[0]
+
+    superseded, after = 0, 0
+    newer = ProductChange.objects.filter(product_id=OuterRef('product_id'), id__gt=OuterRef('id'))
+    while True:
+        ids = list(ProductChange.objects.filter(id__gt=after).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        superseded += ProductChange.objects.filter(Exists(newer), id__gt=after, id__lte=ids[-1]).delete()[0]
+        after = ids[-1]
+    return superseded, expired
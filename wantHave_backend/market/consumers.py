@@ -0,0 +1,58 @@
+from urllib.parse import parse_qs
+from channels.generic.websocket import AsyncWebsocketConsumer
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import json_backend
+from .watch_notifications import user_group
+
+
+def _user_id(scope):
+    """User id from a ?token=<JWT access token> query parameter or the session, or None"""
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+    if token:
+        try:
+            return AccessToken(token[0])[jwt_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError):
+            return None
+    user = scope.get('user')
+    return user.id if user is not None and user.is_authenticated else None
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    Per-user push channel, e.g. for price drops and status changes of watched products
+    and new listings matching saved searches.
+    Connect to ws/notifications/?token=<JWT access token>.
+    """
+    group_name = None
+
+    async def connect(self):
+        user_id = _user_id(self.scope)
+        if user_id is None:
+            await self.close()
+            return
+        self.group_name = user_group(user_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.group_name:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    # Receive a watched product update from the user's group
+    async def watchlist_update(self, event):
+        await self.send(text_data=json_backend.dumps({
+            'type': 'watchlist_update',
+            'product': event['product'],
+            'changes': event['changes'],
+        }).decode())
+
+    # Receive a new listing matching the user's saved searches
+    async def saved_search_match(self, event):
+        await self.send(text_data=json_backend.dumps({
+            'type': 'saved_search_match',
+            'searches': event['searches'],
+            'product': event['product'],
+        }).decode())
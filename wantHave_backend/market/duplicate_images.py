@@ -0,0 +1,186 @@
+"""
+Near-duplicate listing photos.
+Every product image's 64-bit dHash (Product.image_hash) is kept in an in-memory
+multi-index hash table: the hash is cut into the same image_hashing.BAND_COUNT
+bands of 16 bits as the AI cache uses (image_hashing.hash_bands) and each band
+has its own dict. If two hashes are within Hamming distance d = BAND_COUNT * a + b
+(0 <= b < BAND_COUNT), one of the first b + 1 bands differs by at most a bits or
+one of the others by at most a - 1 bits. Probing every band's dict with every
+value that close to the query's band therefore finds all of them; only those
+candidates are compared in full. Used for the duplicate warning on listing
+creation and the "possible duplicates" admin report.
+
+Hashes written behind the index's back (hash_product_images) are picked up when
+a process loads the index, i.e. after a restart.
+"""
+import itertools
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from django.conf import settings
+
+from . import image_hashing
+from .models import Product
+
+BAND_COUNT = image_hashing.BAND_COUNT
+BAND_WIDTHS = [image_hashing.BAND_BITS] * BAND_COUNT  # Low bits first, as image_hashing.hash_bands cuts them
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(width, radius):
+    """Masks of every way to flip at most `radius` bits of a band"""
+    return tuple(
+        sum(1 << bit for bit in bits)
+        for count in range(radius + 1)
+        for bits in itertools.combinations(range(width), count)
+    )
+
+
+@lru_cache(maxsize=None)
+def _probes(max_distance):
+    """Flip masks to probe each band with, for lookups within max_distance bits"""
+    a, b = divmod(max_distance, BAND_COUNT)
+    return tuple(
+        _flip_masks(width, a if band <= b else a - 1) if a or band <= b else ()
+        for band, width in enumerate(BAND_WIDTHS)
+    )
+
+
+class DuplicateImageIndex:
+    """
+    Hashes of the available products' images, built lazily from one query and
+    kept current by market.signals (and bulk imports) as products are saved and
+    deleted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.hashes = {}
+        self.bands = [defaultdict(set) for _ in range(BAND_COUNT)]
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self.hashes = {}
+            self.bands = [defaultdict(set) for _ in range(BAND_COUNT)]
+            rows = Product.objects.filter(status='AVAILABLE', image_hash__isnull=False).values_list('id', 'image_hash')
+            for product_id, stored_hash in rows.iterator(chunk_size=5000):
+                self._add(product_id, image_hashing.from_signed(stored_hash))
+            self._loaded = True
+
+    def _add(self, product_id, value):
+        self.hashes[product_id] = value
+        for table, band in zip(self.bands, image_hashing.hash_bands(value)):
+            table[band].add(product_id)
+
+    def _remove(self, product_id):
+        value = self.hashes.pop(product_id, None)
+        if value is None:
+            return
+        for table, band in zip(self.bands, image_hashing.hash_bands(value)):
+            bucket = table.get(band)
+            if bucket is not None:
+                bucket.discard(product_id)
+                if not bucket:
+                    del table[band]
+
+    def product_saved(self, product_id, stored_hash, status):
+        """Index a created or updated product (stored_hash as in Product.image_hash)"""
+        self.products_saved([(product_id, stored_hash, status)])
+
+    def products_saved(self, rows):
+        """Index (product id, stored hash, status) rows, e.g. of a bulk import"""
+        with self._lock:
+            if not self._loaded:
+                return  # Picked up by the next load
+            for product_id, stored_hash, status in rows:
+                self._remove(product_id)
+                if stored_hash is not None and status == 'AVAILABLE':
+                    self._add(product_id, image_hashing.from_signed(stored_hash))
+
+    def product_deleted(self, product_id):
+        with self._lock:
+            if self._loaded:
+                self._remove(product_id)
+
+    def find(self, value, max_distance=None, exclude=None):
+        """
+        Available products whose image hash is within max_distance bits of value.
+
+        Args:
+            value: Unsigned 64-bit dHash
+            max_distance: Default settings.DUPLICATE_IMAGE_MAX_DISTANCE
+            exclude: Product id to leave out, e.g. the product itself
+
+        Returns:
+            List of (product id, distance), closest first
+        """
+        max_distance = settings.DUPLICATE_IMAGE_MAX_DISTANCE if max_distance is None else max_distance
+        probes = _probes(max_distance)
+        self._ensure_loaded()
+        with self._lock:
+            candidates = set()
+            for table, band, masks in zip(self.bands, image_hashing.hash_bands(value), probes):
+                for mask in masks:
+                    candidates.update(table.get(band ^ mask, ()))
+            candidates.discard(exclude)
+            found = [(product_id, (self.hashes[product_id] ^ value).bit_count()) for product_id in candidates]
+        return sorted(
+            ((product_id, distance) for product_id, distance in found if distance <= max_distance),
+            key=lambda match: (match[1], match[0])
+        )
+
+    def duplicates(self, max_distance=None):
+        """
+        Every available product with at least one near-duplicate.
+
+        Returns:
+            Dict product id -> list of (product id, distance), closest first
+        """
+        self._ensure_loaded()
+        by_hash = defaultdict(list)
+        with self._lock:
+            for product_id, value in self.hashes.items():
+                by_hash[value].append(product_id)
+        report = {}
+        # Re-posts of one photo share a hash, so each distinct hash is looked up once
+        for value, product_ids in by_hash.items():
+            matches = self.find(value, max_distance)
+            for product_id in product_ids:
+                others = [match for match in matches if match[0] != product_id]
+                if others:
+                    report[product_id] = others
+        return report
+
+
+duplicate_image_index = DuplicateImageIndex()
+
+
+def possible_duplicates(product_id, limit):
+    """
+    Available listings whose photo matches a product's, for the warning shown
+    after creating it.
+
+    Returns:
+        List of dicts with id, title, seller_id and distance, closest first
+    """
+    stored_hash = Product.objects.filter(pk=product_id).values_list('image_hash', flat=True).first()
+    if stored_hash is None or limit <= 0:
+        return []
+    matches = duplicate_image_index.find(image_hashing.from_signed(stored_hash), exclude=product_id)[:limit]
+    products = {
+        row['id']: row
+        for row in Product.objects.filter(id__in=[match[0] for match in matches]).values('id', 'title', 'seller_id')
+    }
+    return [
+        {**products[match_id], 'distance': distance}
+        for match_id, distance in matches if match_id in products
+    ]
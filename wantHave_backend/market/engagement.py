@@ -0,0 +1,245 @@
+"""
+Write-behind product view, impression and click counters and trending scores.
+Requests only increment in-memory counters; a background thread writes them to
+ProductEngagement every ENGAGEMENT_FLUSH_INTERVAL seconds, or sooner once
+ENGAGEMENT_MAX_PENDING increments are buffered, with one bulk UPDATE per chunk
+of products instead of one write per hit. A crash loses at most what was
+buffered since the last flush, so at most one interval or ENGAGEMENT_MAX_PENDING
+increments. Pending counts are included in what the API reports.
+
+The trending score (Product.trending_score) is an exponentially decayed sum of
+weighted events. It is stored as log2 of the sum with every event scaled to TRENDING_EPOCH, i.e.
+log2(sum(weight * 2 ** ((time - epoch) / half-life))): all scores decay at
+the same rate, so the order at any moment is the decayed order without ever
+rewriting old scores, and a new event is a log-add onto the stored value.
+"""
+import atexit
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, FloatField, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from .models import Product, ProductEngagement
+
+logger = logging.getLogger('market.engagement')
+
+COUNTERS = ('views', 'impressions', 'clicks')
+FLUSH_CHUNK_SIZE = 500  # Products per UPDATE; each adds a CASE branch per counter
+
+# Trending events and their weights
+TRENDING_WEIGHTS = {'views': 1, 'watchlist_adds': 5, 'conversations': 8, 'offers': 10}
+TRENDING_EPOCH = 1767225600  # 2026-01-01 UTC; stored scores are relative to it
+TRENDING_HALF_LIFE = 24 * 3600  # Seconds; stored scores are in units of it, so it cannot change in place
+
+
+def log2_add(a, b):
+    """log2(2 ** a + 2 ** b) without overflow; None stands for an empty sum"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def trending_value(event, at=None):
+    """Log-space score of one event at a Unix time (default: now)"""
+    at = time.time() if at is None else at
+    return math.log2(TRENDING_WEIGHTS[event]) + (at - TRENDING_EPOCH) / TRENDING_HALF_LIFE
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class EngagementCounters:
+    """
+    In-process counter buffer. The backend runs as a single replica; start() is
+    called by the ASGI/WSGI entry points, so management commands and tests only
+    write when they call flush() themselves.
+    """
+
+    def __init__(self, flush_interval, max_pending):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = defaultdict(lambda: [0] * len(COUNTERS))
+        self._trending = {}
+        self._pending_total = 0
+        self._wake = threading.Event()
+        self._thread = None
+
+    def record(self, counter, product_ids):
+        """
+        Count one event for each of the products.
+
+        Args:
+            counter: One of COUNTERS
+            product_ids: Iterable of product ids
+        """
+        index = COUNTERS.index(counter)
+        trending = trending_value(counter) if counter in TRENDING_WEIGHTS else None
+        added = 0
+        with self._lock:
+            for product_id in product_ids:
+                self._pending[product_id][index] += 1
+                if trending is not None:
+                    self._trending[product_id] = log2_add(self._trending.get(product_id), trending)
+                added += 1
+            self._pending_total += added
+            full = self._pending_total >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def record_trending(self, event, product_id, at=None):
+        """
+        Add a trending event that has no counter of its own.
+
+        Args:
+            event: Key of TRENDING_WEIGHTS, e.g. 'offers'
+            product_id: Product the event is about
+            at: Unix time of the event, default now
+        """
+        value = trending_value(event, at)
+        with self._lock:
+            self._trending[product_id] = log2_add(self._trending.get(product_id), value)
+            self._pending_total += 1
+            full = self._pending_total >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def pending(self, product_ids):
+        """Buffered, not yet flushed counts: dict product id -> dict counter -> count"""
+        with self._lock:
+            return {
+                product_id: dict(zip(COUNTERS, self._pending[product_id]))
+                for product_id in product_ids if product_id in self._pending
+            }
+
+    def counts(self, product_ids):
+        """Stored plus buffered counts: dict product id -> dict counter -> count"""
+        product_ids = list(product_ids)
+        counts = {product_id: dict.fromkeys(COUNTERS, 0) for product_id in product_ids}
+        for row in ProductEngagement.objects.filter(product_id__in=product_ids).values('product_id', *COUNTERS):
+            counts[row.pop('product_id')].update(row)
+        for product_id, pending in self.pending(product_ids).items():
+            for counter, count in pending.items():
+                counts[product_id][counter] += count
+        return counts
+
+    def totals(self, queryset):
+        """
+        Stored plus buffered counts summed over a Product queryset, e.g. a seller's
+        listings. Stored counts are summed in SQL; only products with buffered
+        counts are looked up.
+        """
+        stored = ProductEngagement.objects.filter(product__in=queryset).aggregate(
+            **{counter: Sum(counter) for counter in COUNTERS}
+        )
+        totals = {counter: stored[counter] or 0 for counter in COUNTERS}
+        with self._lock:
+            buffered = list(self._pending)
+        if buffered:
+            matching = queryset.filter(id__in=buffered).values_list('id', flat=True)
+            for pending in self.pending(matching).values():
+                for counter, count in pending.items():
+                    totals[counter] += count
+        return totals
+
+    def flush(self):
+        """
+        Write buffered counts to the database.
+
+        Returns:
+            Number of products updated
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(lambda: [0] * len(COUNTERS))
+                trending, self._trending = self._trending, {}
+                self._pending_total = 0
+            if not pending and not trending:
+                return 0
+            try:
+                return self._write(pending, trending)
+            except Exception:
+                logger.exception('Flushing engagement counts of %s products failed', len(set(pending) | set(trending)))
+                self._restore(pending, trending)
+                return 0
+
+    def _write(self, pending, trending):
+        updated = 0
+        now = timezone.now()
+        with transaction.atomic():
+            for chunk in _chunks(sorted(set(pending) | set(trending)), FLUSH_CHUNK_SIZE):
+                # Events of products deleted in the meantime are dropped. Only this (single)
+                # flusher writes scores, so the stored ones cannot change before the update.
+                stored_scores = dict(Product.objects.filter(id__in=chunk).values_list('id', 'trending_score'))
+                counted = [product_id for product_id in stored_scores if product_id in pending]
+                if counted:
+                    ProductEngagement.objects.bulk_create(
+                        [ProductEngagement(product_id=product_id) for product_id in counted], ignore_conflicts=True
+                    )
+                    increments = {}
+                    for index, counter in enumerate(COUNTERS):
+                        branches = [
+                            When(product_id=product_id, then=Value(pending[product_id][index]))
+                            for product_id in counted if pending[product_id][index]
+                        ]
+                        if branches:
+                            increments[counter] = F(counter) + Case(*branches, default=Value(0), output_field=IntegerField())
+                    ProductEngagement.objects.filter(product_id__in=counted).update(**increments, updated_at=now)
+                scored = [product_id for product_id in stored_scores if product_id in trending]
+                if scored:
+                    Product.objects.filter(id__in=scored).update(trending_score=Case(
+                        *(When(id=product_id, then=Value(log2_add(stored_scores[product_id], trending[product_id])))
+                          for product_id in scored),
+                        output_field=FloatField()
+                    ))
+                updated += len(stored_scores)
+        return updated
+
+    def _restore(self, pending, trending):
+        with self._lock:
+            for product_id, counts in pending.items():
+                merged = self._pending[product_id]
+                for index, count in enumerate(counts):
+                    merged[index] += count
+                self._pending_total += sum(counts)
+            for product_id, value in trending.items():
+                self._trending[product_id] = log2_add(self._trending.get(product_id), value)
+                self._pending_total += 1
+
+    def start(self):
+        """Start the background flusher (idempotent) and flush once more at exit"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='engagement-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                updated = self.flush()
+                if updated:
+                    logger.info('Flushed engagement counts of %s products', updated)
+            finally:
+                close_old_connections()
+
+
+engagement_counters = EngagementCounters(
+    flush_interval=settings.ENGAGEMENT_FLUSH_INTERVAL,
+    max_pending=settings.ENGAGEMENT_MAX_PENDING,
+)
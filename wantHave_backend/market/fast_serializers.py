@@ -0,0 +1,156 @@
+"""
+Fast read path for list endpoints.
+A DRF serializer is compiled once per request into the values() columns it reads
+and one extractor per field; rows are then turned into dicts without building
+model instances or binding a serializer per object. The output renders to the
+same JSON as the serializer itself (see the parity tests).
+"""
+import datetime
+import re
+from operator import itemgetter
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from rest_framework import ISO_8601, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+# Serializer fields whose to_representation() returns values of these model fields unchanged
+PASSTHROUGH_FIELDS = {
+    serializers.BooleanField: (models.BooleanField,),
+    serializers.CharField: (models.CharField, models.TextField),
+    serializers.ChoiceField: (models.CharField,),
+    serializers.FloatField: (models.FloatField,),
+    serializers.IntegerField: (models.IntegerField, models.ForeignKey),
+}
+# File names that storage.url() and build_absolute_uri() leave unchanged
+PLAIN_FILE_NAME = re.compile(r'[\w-]+(?:[./][\w-]+)*', re.ASCII)
+
+
+def _value(column, to_representation):
+    def extract(row):
+        value = row[column]
+        return None if value is None else to_representation(value)
+    return extract
+
+
+def _file_url(column, storage, request):
+    # Plain names on local storage are appended to a URL prefix built once;
+    # other names and storages go through storage.url() per row
+    prefix = None
+    if isinstance(storage, FileSystemStorage) and PLAIN_FILE_NAME.fullmatch(storage.base_url.strip('/')):
+        prefix = request.build_absolute_uri(storage.base_url) if request is not None else storage.base_url
+
+    def extract(row):
+        name = row[column]
+        if not name:
+            return None
+        if prefix is not None and PLAIN_FILE_NAME.fullmatch(name):
+            return prefix + name
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+    return extract
+
+
+def datetime_converter(field):
+    """
+    Equivalent of a DateTimeField's to_representation() for non-null values.
+    UTC datetimes as read from the database render as isoformat() with a Z suffix
+    when the field outputs ISO 8601 in UTC; anything else uses the field itself.
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    utc_output = (
+        isinstance(output_format, str) and output_format.lower() == ISO_8601
+        and getattr(field_timezone, 'key', field_timezone) in ('UTC', datetime.timezone.utc)
+    )
+
+    def convert(value):
+        if utc_output and value.tzinfo is datetime.timezone.utc:
+            return value.isoformat()[:-6] + 'Z'
+        return field.to_representation(value)
+    return convert
+
+
+def _nested(column, steps):
+    def extract(row):
+        if row[column] is None:
+            return None
+        return {name: get(row) for name, get in steps}
+    return extract
+
+
+def compile_serializer(serializer, prefix=''):
+    """
+    Compile the readable fields of a serializer instance.
+
+    Args:
+        serializer: Serializer instance (not bound to data); its context is used
+            for request-dependent output such as absolute file URLs
+        prefix: Lookup prefix for nested serializers
+
+    Returns:
+        Tuple (columns, steps): values() lookups and (field name, extractor) pairs
+    Raises:
+        TypeError: For fields without a column, e.g. SerializerMethodField
+    """
+    model = serializer.Meta.model
+    request = serializer.context.get('request')
+    columns = []
+    steps = []
+    for field in serializer._readable_fields:
+        if field.source == '*' or isinstance(field, (serializers.SerializerMethodField, serializers.ManyRelatedField)):
+            raise TypeError(f'{type(serializer).__name__}.{field.field_name} cannot be read from values()')
+        column = prefix + '__'.join(field.source_attrs)
+        columns.append(column)
+
+        if isinstance(field, serializers.ModelSerializer):
+            nested_columns, nested_steps = compile_serializer(field, column + '__')
+            columns.extend(nested_columns)
+            steps.append((field.field_name, _nested(column, nested_steps)))
+        elif isinstance(field, serializers.PrimaryKeyRelatedField):
+            steps.append((field.field_name, itemgetter(column)))
+        elif isinstance(field, serializers.FileField):
+            storage = _model_field(model, field.source_attrs).storage
+            steps.append((field.field_name, _file_url(column, storage, request)))
+        elif isinstance(field, serializers.DateTimeField):
+            steps.append((field.field_name, _value(column, datetime_converter(field))))
+        elif isinstance(_model_field(model, field.source_attrs), PASSTHROUGH_FIELDS.get(type(field), ())):
+            steps.append((field.field_name, itemgetter(column)))
+        else:
+            steps.append((field.field_name, _value(column, field.to_representation)))
+    return list(dict.fromkeys(columns)), steps
+
+
+def _model_field(model, source_attrs):
+    """Model field a (possibly related) source points to"""
+    for attr in source_attrs[:-1]:
+        model = model._meta.get_field(attr).related_model
+    return model._meta.get_field(source_attrs[-1])
+
+
+def serialize_queryset(queryset, serializer):
+    """
+    List data for a queryset, equal to serializer's many=True output.
+
+    Args:
+        queryset: Queryset of serializer.Meta.model, in the order to return
+        serializer: Serializer instance to compile, e.g. view.get_serializer()
+    """
+    columns, steps = compile_serializer(serializer)
+    return [{name: get(row) for name, get in steps} for row in queryset.values(*columns)]
+
+
+class FastListMixin:
+    """
+    ViewSet mixin serving list() through serialize_queryset().
+    Views override fast_list_data() when their serializer has method fields.
+    Paginated views keep the regular list().
+    """
+
+    def fast_list_data(self, queryset):
+        return serialize_queryset(queryset, self.get_serializer())
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        return Response(self.fast_list_data(self.filter_queryset(self.get_queryset())))
@@ -0,0 +1,80 @@
+"""
+Web Mercator grid cells for map clustering.
+A location is stored as the Morton code (interleaved x/y bits) of its tile at
+GRID_ZOOM, so every tile at a coarser zoom is one contiguous range of cell ids
+and its parent cell is a plain integer division.
+"""
+import math
+
+GRID_ZOOM = 20  # ~38 m cells at the equator; 40-bit codes fit a BigIntegerField
+MAX_LATITUDE = 85.05112878  # Web Mercator limit
+
+
+def _interleave(x, y, bits):
+    code = 0
+    for bit in range(bits):
+        code |= ((x >> bit) & 1) << (2 * bit + 1)
+        code |= ((y >> bit) & 1) << (2 * bit)
+    return code
+
+
+def tile_xy(latitude, longitude, zoom):
+    """Web Mercator tile coordinates containing a point"""
+    n = 1 << zoom
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    lat_rad = math.radians(latitude)
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def cell_for(latitude, longitude):
+    """Grid cell of a location, or None without coordinates"""
+    if latitude is None or longitude is None:
+        return None
+    x, y = tile_xy(latitude, longitude, GRID_ZOOM)
+    return _interleave(x, y, GRID_ZOOM)
+
+
+def cell_divisor(zoom):
+    """Number of grid cells in one tile at the given zoom"""
+    return 4 ** (GRID_ZOOM - zoom)
+
+
+def tile_of_cell(cell, zoom):
+    return cell // cell_divisor(zoom)
+
+
+def tiles_in_bbox(min_lng, min_lat, max_lng, max_lat, zoom):
+    """Morton codes of all tiles at the zoom level intersecting the bounding box"""
+    min_x, min_y = tile_xy(max_lat, min_lng, zoom)  # Tile y grows southwards
+    max_x, max_y = tile_xy(min_lat, max_lng, zoom)
+    return [
+        _interleave(x, y, zoom)
+        for x in range(min_x, max_x + 1)
+        for y in range(min_y, max_y + 1)
+    ]
+
+
+def tile_count_in_bbox(min_lng, min_lat, max_lng, max_lat, zoom):
+    min_x, min_y = tile_xy(max_lat, min_lng, zoom)
+    max_x, max_y = tile_xy(min_lat, max_lng, zoom)
+    return (max_x - min_x + 1) * (max_y - min_y + 1)
+
+
+def cell_ranges(tiles, zoom):
+    """
+    Half-open grid cell ranges covering the tiles, with adjacent tiles merged.
+
+    Returns:
+        List of (start, end) tuples
+    """
+    divisor = cell_divisor(zoom)
+    ranges = []
+    for tile in sorted(tiles):
+        start = tile * divisor
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], start + divisor)
+        else:
+            ranges.append((start, start + divisor))
+    return ranges
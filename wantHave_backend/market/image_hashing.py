@@ -0,0 +1,74 @@
+"""
+Image fingerprints for duplicate detection.
+Exact content hashes plus a 64-bit difference hash (dHash) that survives resizing,
+re-encoding and small edits, split into bands for indexed near-duplicate lookups.
+market.models imports this module at startup, so Pillow and numpy are imported on first use.
+"""
+import hashlib
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+BAND_COUNT = 4
+BAND_BITS = HASH_BITS // BAND_COUNT
+
+
+def content_hash(data):
+    """SHA-256 hex digest of the raw file bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def dhash(image):
+    """
+    Compute the 64-bit difference hash of a PIL image.
+    Each bit records whether a pixel is brighter than its right neighbour
+    on a 9x8 grayscale thumbnail.
+    """
+    import numpy as np
+    from PIL import Image
+
+    # JPEG draft mode decodes at a fraction of the full size, far cheaper than a full decode
+    image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+    thumbnail = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = np.asarray(thumbnail)
+    # Row by row, first pixel in the most significant bit
+    bits = np.packbits(pixels[:, :-1] > pixels[:, 1:])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def stored_dhash(file):
+    """
+    dHash of an image file in its database form (see to_signed), or None when
+    the file cannot be decoded. Leaves the file at position 0.
+    """
+    from PIL import Image
+
+    try:
+        file.seek(0)
+        return to_signed(dhash(Image.open(file)))
+    except Exception:
+        return None
+    finally:
+        file.seek(0)
+
+
+def hamming_distance(a, b):
+    return bin((a ^ b) & ((1 << HASH_BITS) - 1)).count('1')
+
+
+def hash_bands(value):
+    """
+    Split a hash into BAND_COUNT equal bands.
+    Two hashes within Hamming distance < BAND_COUNT share at least one band exactly,
+    so an exact match on any band finds every near-duplicate candidate.
+    """
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (band * BAND_BITS)) & mask for band in range(BAND_COUNT)]
+
+
+def to_signed(value):
+    """Map an unsigned 64-bit hash onto a signed 64-bit database integer"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def from_signed(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
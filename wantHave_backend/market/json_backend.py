@@ -0,0 +1,73 @@
+"""
+JSON encoding for API responses, request bodies and WebSocket frames.
+Uses orjson when it is installed and the standard library otherwise. Both produce
+the same bytes as DRF's JSONRenderer with default settings: compact, UTF-8,
+Decimal as float, datetimes as ISO 8601 with Z for UTC, U+2028/U+2029 escaped.
+"""
+import datetime
+import decimal
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # Optional speed-up, see requirements.txt
+    orjson = None
+
+# Datetimes go through DRF's encoder (orjson writes +00:00 instead of Z)
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    # Prices and timestamps first, as DRF's encoder converts them; everything else goes to it
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, datetime.datetime):
+        representation = obj.isoformat()
+        return representation[:-6] + 'Z' if representation.endswith('+00:00') else representation
+    return _encoder.default(obj)
+
+
+def _strict_constant(value):
+    raise ValueError(f'Out of range float values are not JSON compliant: {value!r}')
+
+
+def _escape_separators(data):
+    # Line and paragraph separators are valid JSON but not valid JavaScript
+    if b'\xe2\x80\xa8' in data or b'\xe2\x80\xa9' in data:
+        data = data.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return data
+
+
+def dumps(data):
+    """
+    Encode data as UTF-8 JSON bytes.
+    With orjson, NaN and infinity are written as null instead of raising ValueError.
+    """
+    if orjson is not None:
+        try:
+            return _escape_separators(orjson.dumps(data, default=_default, option=ORJSON_OPTIONS))
+        except orjson.JSONEncodeError:
+            pass  # E.g. integers beyond 64 bits; the standard library raises real errors
+    text = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    return _escape_separators(text.encode('utf-8'))
+
+
+def loads(data):
+    """
+    Decode JSON from bytes or str.
+
+    Raises:
+        ValueError: Invalid JSON, including NaN and infinity
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # Re-parsed below for the standard library's error message and big integers
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode('utf-8')
+    return json.loads(data, parse_constant=_strict_constant)
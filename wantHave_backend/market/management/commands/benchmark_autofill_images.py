@@ -0,0 +1,154 @@
+"""
+Django management command to benchmark image preprocessing for AI autofill.
+Compares the legacy path (full-resolution PIL image handed to the SDK) with the
+pre-shrunk upload, using a local stand-in model instead of the Gemini API.
+"""
+
+from django.core.management.base import BaseCommand
+from unittest.mock import patch
+from io import BytesIO
+from PIL import Image
+from google.generativeai.types import content_types
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+from market import ai_service
+
+
+class StandInModel:
+    """
+    Local replacement for genai.GenerativeModel.
+    Serializes image parts exactly like the SDK does, then simulates the upload
+    at a fixed bandwidth plus a fixed model latency.
+    """
+
+    def __init__(self, bandwidth_bytes_per_s, model_latency_s):
+        self.bandwidth = bandwidth_bytes_per_s
+        self.model_latency = model_latency_s
+        self.bytes_sent = 0
+
+    def generate_content(self, parts):
+        for part in parts:
+            if isinstance(part, str):
+                self.bytes_sent += len(part.encode())
+            else:
+                blob = content_types.to_blob(part)
+                self.bytes_sent += len(blob.data)
+        time.sleep(self.bytes_sent / self.bandwidth + self.model_latency)
+        return type('Response', (), {'text': json.dumps({
+            'title': 'Benchmark item', 'description': '', 'category_suggestion': 'Electronics',
+            'price_min': 1, 'price_max': 2
+        })})()
+
+
+def legacy_analyze(image_bytes, model):
+    """The pre-shrinking code path: decode at full size and let the SDK re-encode it"""
+    img = Image.open(BytesIO(image_bytes))
+    return model.generate_content(['prompt', img])
+
+
+def run_path(path, image_bytes, iterations, bandwidth, latency, queue):
+    """Run one code path in a fresh process so its peak RSS can be measured in isolation"""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    durations = []
+    bytes_sent = 0
+
+    for _ in range(iterations):
+        model = StandInModel(bandwidth, latency)
+        start = time.perf_counter()
+        if path == 'legacy':
+            legacy_analyze(image_bytes, model)
+        else:
+            with patch.object(ai_service, 'get_generative_model', return_value=model), \
+                    patch.object(ai_service, 'quota_limiter', ai_service.QuotaLimiter(10 ** 6, 10 ** 6)), \
+                    patch.dict(os.environ, {'GEMINI_API_KEY': 'benchmark'}):
+                ai_service.analyze_product_image(BytesIO(image_bytes))
+        durations.append(time.perf_counter() - start)
+        bytes_sent = model.bytes_sent
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        'bytes_sent': bytes_sent,
+        'peak_rss_growth_kb': rss_after - rss_before,
+        'latency_ms': sorted(durations)[len(durations) // 2] * 1000,
+    })
+
+
+class Command(BaseCommand):
+    help = 'Benchmark AI autofill image preprocessing against the legacy full-resolution upload'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--image',
+            help='Path to a sample photo (default: synthetic 4000x3000 JPEG)'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=5,
+            help='Runs per path, median latency is reported (default: 5)'
+        )
+        parser.add_argument(
+            '--bandwidth-mbit',
+            type=float,
+            default=20.0,
+            help='Simulated upload bandwidth to the model API in Mbit/s (default: 20)'
+        )
+        parser.add_argument(
+            '--model-latency-ms',
+            type=float,
+            default=0.0,
+            help='Simulated model processing time per call (default: 0)'
+        )
+
+    def handle(self, *args, **options):
+        if options['image']:
+            with open(options['image'], 'rb') as f:
+                image_bytes = f.read()
+        else:
+            image_bytes = self._synthetic_photo()
+
+        bandwidth = options['bandwidth_mbit'] * 1_000_000 / 8
+        latency = options['model_latency_ms'] / 1000
+        self.stdout.write(f"Input image: {len(image_bytes) / 1024:.0f} KB")
+
+        results = {}
+        context = multiprocessing.get_context('fork')
+        for path in ('legacy', 'preshrunk'):
+            queue = context.Queue()
+            process = context.Process(
+                target=run_path,
+                args=(path, image_bytes, options['iterations'], bandwidth, latency, queue)
+            )
+            process.start()
+            results[path] = queue.get()
+            process.join()
+
+        self.stdout.write(f"{'path':<12}{'bytes sent':>14}{'peak RSS +KB':>14}{'latency ms':>12}")
+        for path, result in results.items():
+            self.stdout.write(
+                f"{path:<12}{result['bytes_sent']:>14}{result['peak_rss_growth_kb']:>14}"
+                f"{result['latency_ms']:>12.1f}"
+            )
+
+        legacy, preshrunk = results['legacy'], results['preshrunk']
+        self.stdout.write(self.style.SUCCESS(
+            f"Bytes sent reduced {legacy['bytes_sent'] / max(preshrunk['bytes_sent'], 1):.1f}x, "
+            f"latency {legacy['latency_ms'] / max(preshrunk['latency_ms'], 0.001):.1f}x faster"
+        ))
+
+    @staticmethod
+    def _synthetic_photo():
+        """A noisy 12 MP JPEG with EXIF, roughly what a phone camera uploads"""
+        image = Image.effect_noise((4000, 3000), 64).convert('RGB')
+        gradient = Image.linear_gradient('L').resize((4000, 3000)).convert('RGB')
+        image = Image.blend(image, gradient, 0.5)
+        exif = Image.Exif()
+        exif[0x0112] = 1  # Orientation
+        exif[0x010F] = 'Benchmark Camera'  # Make
+        output = BytesIO()
+        image.save(output, format='JPEG', quality=95, exif=exif)
+        return output.getvalue()
@@ -0,0 +1,112 @@
+"""
+Django management command to benchmark category matching for AI autofill.
+Compares the legacy name__iexact lookup with the in-memory category matcher on
+category suggestions as the Gemini model phrases them, labelled with the leaf a
+human would pick.
+"""
+
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+import time
+
+from market.category_matcher import category_matcher
+from market.models import Category
+
+# (model output, expected leaf category) - None means no sellable leaf fits
+SAMPLE_SUGGESTIONS = [
+    ('Smartphones', 'Smartphones'),
+    ('Smartphone', 'Smartphones'),
+    ('smart phone', 'Smartphones'),
+    ('Smartfones', 'Smartphones'),
+    ('Laptop', 'Laptops'),
+    ('Laptops', 'Laptops'),
+    ('Laptp', 'Laptops'),
+    ('Jewelry', 'Jewelry'),
+    ('Jewellery', 'Jewelry'),
+    ('Furniture', 'Furniture'),
+    ('Furnitur', 'Furniture'),
+    ('Lenses', 'Lenses'),
+    ('Camera lens', 'Lenses'),
+    ('Books', 'Books'),
+    ('Book', 'Books'),
+    ('Team sports', 'Team sports'),
+    ('Garden tools', 'Garden tools'),
+    ('Gardening tools', 'Garden tools'),
+    ('Audio equipment', 'Audio equipment'),
+    ('Phone accessories', 'Phone accessories'),
+    ('Electronics', None),
+    ('Miscellaneous', None),
+    ('Collectibles & Antiques', 'Collectibles'),
+]
+
+
+def legacy_match(text):
+    """The previous lookup: exact case-insensitive name, one query per call"""
+    category = Category.objects.filter(name__iexact=text).first()
+    return category.id if category else None
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the in-memory category matcher against the legacy exact-name lookup'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Passes over the sample suggestions for timing (default: 200)'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        # Labels name a leaf; the same leaf name can appear under several parents
+        leaf_ids = defaultdict(set)
+        for category_id, name in Category.objects.filter(children__isnull=True).values_list('id', 'name'):
+            leaf_ids[name].add(category_id)
+        samples = [
+            (text, leaf_ids[expected] if expected else {None})
+            for text, expected in SAMPLE_SUGGESTIONS
+            if expected is None or expected in leaf_ids
+        ]
+        if not samples:
+            self.stdout.write(self.style.WARNING('No seeded categories found, run migrations first'))
+            return
+
+        category_matcher.invalidate()
+        results = {}
+        for path, lookup in (('legacy', legacy_match), ('matcher', self._matcher_id)):
+            lookup(samples[0][0])  # Warm up (builds the matcher index)
+            with CaptureQueriesContext(connection) as queries, transaction.atomic():
+                correct = sum(lookup(text) in expected for text, expected in samples)
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    for text, _ in samples:
+                        lookup(text)
+                elapsed = time.perf_counter() - start
+            calls = iterations * len(samples) + len(samples)
+            results[path] = {
+                'accuracy': correct / len(samples),
+                'queries_per_call': len(queries) / calls,
+                'latency_us': elapsed / (iterations * len(samples)) * 1_000_000,
+            }
+
+        self.stdout.write(f"{len(samples)} sample suggestions, {iterations} iterations")
+        self.stdout.write(f"{'path':<10}{'accuracy':>10}{'queries/call':>14}{'latency us':>12}")
+        for path, result in results.items():
+            self.stdout.write(
+                f"{path:<10}{result['accuracy']:>10.0%}{result['queries_per_call']:>14.2f}"
+                f"{result['latency_us']:>12.1f}"
+            )
+
+        legacy, matcher = results['legacy'], results['matcher']
+        self.stdout.write(self.style.SUCCESS(
+            f"Accuracy {legacy['accuracy']:.0%} -> {matcher['accuracy']:.0%}, "
+            f"{legacy['latency_us'] / max(matcher['latency_us'], 0.001):.1f}x faster"
+        ))
+
+    @staticmethod
+    def _matcher_id(text):
+        match = category_matcher.match(text)
+        return match.category_id if match else None
@@ -0,0 +1,87 @@
+"""
+Django management command to benchmark near-duplicate photo lookups.
+Fills a market.duplicate_images index with random 64-bit hashes plus re-posts
+a few bits away from some of them, then finds the duplicates of sample hashes
+through the multi-index tables and through a linear scan over all hashes,
+checks both find the same products and reports time per lookup. Nothing is
+written to the database.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import random
+import time
+
+from market.duplicate_images import DuplicateImageIndex
+from market.image_hashing import HASH_BITS
+
+
+class Command(BaseCommand):
+    help = 'Benchmark near-duplicate photo lookups against a linear scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=1000000,
+            help='Product hashes to index (default: 1000000)'
+        )
+        parser.add_argument(
+            '--lookups',
+            type=int,
+            default=200,
+            help='Hashes to look up (default: 200)'
+        )
+        parser.add_argument(
+            '--max-distance',
+            type=int,
+            default=settings.DUPLICATE_IMAGE_MAX_DISTANCE,
+            help=f'Hamming radius (default: {settings.DUPLICATE_IMAGE_MAX_DISTANCE})'
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        max_distance = options['max_distance']
+        hashes = [rng.getrandbits(HASH_BITS) for _ in range(options['products'])]
+        # Every tenth product is re-posted with a few bits changed
+        for index in range(0, len(hashes), 10):
+            hashes.append(self._flip(hashes[index], rng.randint(0, max_distance), rng))
+
+        index = DuplicateImageIndex()
+        start = time.perf_counter()
+        for product_id, value in enumerate(hashes):
+            index._add(product_id, value)
+        index._loaded = True
+        build_s = time.perf_counter() - start
+
+        queries = [self._flip(rng.choice(hashes), rng.randint(0, max_distance), rng) for _ in range(options['lookups'])]
+        start = time.perf_counter()
+        indexed = [index.find(value, max_distance) for value in queries]
+        indexed_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scanned = [
+            sorted(
+                (distance, product_id) for product_id, other in enumerate(hashes)
+                if (distance := (other ^ value).bit_count()) <= max_distance
+            )
+            for value in queries
+        ]
+        scan_s = time.perf_counter() - start
+
+        if [[(distance, product_id) for product_id, distance in found] for found in indexed] != scanned:
+            raise CommandError('Index and linear scan found different duplicates')
+        count = len(queries)
+        self.stdout.write(f"{len(hashes)} hashes indexed in {build_s:.1f}s, radius {max_distance} bits")
+        self.stdout.write(f"{count} lookups, {sum(map(len, indexed)) / count:.1f} duplicates per lookup")
+        self.stdout.write(f"{'path':<14}{'ms/lookup':>12}")
+        self.stdout.write(f"{'linear scan':<14}{scan_s * 1000 / count:>12.3f}")
+        self.stdout.write(f"{'multi-index':<14}{indexed_s * 1000 / count:>12.3f}")
+        self.stdout.write(self.style.SUCCESS(f'Same duplicates, {scan_s / indexed_s:.0f}x faster'))
+
+    @staticmethod
+    def _flip(value, bits, rng):
+        for bit in rng.sample(range(HASH_BITS), bits):
+            value ^= 1 << bit
+        return value
@@ -0,0 +1,139 @@
+"""
+Django management command to benchmark the fast list read path.
+Renders the product list, watchlist and conversation list through the DRF
+serializers and through market.fast_serializers, checks the JSON is identical
+and reports time and queries. Rows are created in a transaction that is rolled
+back afterwards.
+"""
+
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+import time
+
+from chat.fast_serializers import conversation_list_data
+from chat.serializers import ConversationSerializer
+from chat.views import ConversationViewSet
+from market.fast_serializers import serialize_queryset
+from market.models import Category, Conversation, Message, Product, WatchlistItem
+from market.serializers import ProductSerializer, WatchlistItemSerializer
+
+
+class QueryCounter:
+    """Execute wrapper counting queries (the debug query log is capped at 9000 entries)"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark DRF serializers against the fast list read path'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=10000,
+            help='Products, watchlist items and conversations to create (default: 10000)'
+        )
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        request = Request(APIRequestFactory().get('/', HTTP_HOST='localhost'))
+
+        results = {}
+        with transaction.atomic():
+            user = self._create_rows(rows)
+            request.user = user
+            context = {'request': request}
+            conversations = ConversationViewSet(request=request, format_kwarg=None).get_queryset()
+            # Same queryset for both paths, as ProductViewSet serves it
+            products = ProductSerializer.optimize_queryset(
+                Product.objects.filter(title__startswith='Benchmark ').order_by('-created_at')
+            )
+            watchlist = WatchlistItem.objects.filter(user=user).order_by('-added_at')
+
+            cases = {
+                'products': (
+                    lambda: ProductSerializer(products, many=True, context=context).data,
+                    lambda: serialize_queryset(products, ProductSerializer(context=context)),
+                ),
+                'watchlist': (
+                    lambda: WatchlistItemSerializer(watchlist, many=True, context=context).data,
+                    lambda: serialize_queryset(watchlist, WatchlistItemSerializer(context=context)),
+                ),
+                'conversations': (
+                    lambda: ConversationSerializer(conversations, many=True, context=context).data,
+                    lambda: conversation_list_data(conversations, request),
+                ),
+            }
+            for name, paths in cases.items():
+                payloads = []
+                for path, serialize in zip(('drf', 'fast'), paths):
+                    queries = QueryCounter()
+                    with connection.execute_wrapper(queries):
+                        start = time.perf_counter()
+                        payloads.append(JSONRenderer().render(serialize()))
+                        elapsed = time.perf_counter() - start
+                    results[name, path] = (elapsed * 1000, queries.count)
+                if payloads[0] != payloads[1]:
+                    raise CommandError(f'{name}: fast path output differs from the serializer')
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{rows} rows per list, identical JSON for all lists")
+        self.stdout.write(f"{'list':<15}{'drf ms':>10}{'queries':>10}{'fast ms':>10}{'queries':>10}{'speedup':>10}")
+        for name in cases:
+            drf_ms, drf_queries = results[name, 'drf']
+            fast_ms, fast_queries = results[name, 'fast']
+            self.stdout.write(
+                f"{name:<15}{drf_ms:>10.0f}{drf_queries:>10}{fast_ms:>10.0f}{fast_queries:>10}"
+                f"{drf_ms / max(fast_ms, 0.001):>9.1f}x"
+            )
+        self.stdout.write(self.style.SUCCESS('Fast path matches the serializers'))
+
+    @staticmethod
+    def _create_rows(count):
+        category = Category.objects.filter(children__isnull=True).first()
+        user = User.objects.create_user(username='benchmark-user', password=None)
+        sellers = [
+            User.objects.create_user(username=f'benchmark-seller-{index}', password=None)
+            for index in range(20)
+        ]
+        products = Product.objects.bulk_create([
+            Product(
+                seller=sellers[index % len(sellers)],
+                title=f'Benchmark product {index}',
+                description='Used, in good condition, pickup or shipping.',
+                price=Decimal(10 + index % 500),
+                image=f'product_images/benchmark-{index}.jpg',
+                category=category if index % 4 else None,
+                latitude=48.2 + index % 100 / 1000,
+                longitude=16.37 + index % 100 / 1000,
+                city='Vienna',
+            )
+            for index in range(count)
+        ])
+        WatchlistItem.objects.bulk_create([WatchlistItem(user=user, product=product) for product in products])
+
+        conversations = Conversation.objects.bulk_create([
+            Conversation(product=product) for product in products
+        ])
+        Through = Conversation.participants.through
+        Through.objects.bulk_create([
+            Through(conversation_id=conversation.id, user_id=user_id)
+            for conversation, product in zip(conversations, products)
+            for user_id in (user.id, product.seller_id)
+        ])
+        Message.objects.bulk_create([
+            Message(conversation=conversation, sender_id=product.seller_id, content=f'Still available? {index}')
+            for index, (conversation, product) in enumerate(zip(conversations, products))
+        ])
+        return user
@@ -0,0 +1,126 @@
+"""
+Django management command to benchmark the JSON backend.
+Compares DRF's JSONRenderer/JSONParser and the consumer's json.dumps/json.loads
+with market.json_backend on a rendered product list, a list with raw Decimal and
+datetime values, and chat frames. Output bytes are checked to be identical.
+"""
+
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from io import BytesIO
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+import datetime
+import json
+import time
+
+from market import json_backend
+from market.parsers import FastJSONParser
+from market.renderers import FastJSONRenderer
+
+
+def product_list(count):
+    """Product list as ProductSerializer renders it"""
+    return [{
+        'id': index,
+        'title': f'Benchmark product {index}',
+        'description': 'Used, in good condition, pickup or shipping. Grüße aus Wien.',
+        'price': f'{10 + index % 500}.00',
+        'image': f'http://localhost/media/product_images/benchmark-{index}.jpg',
+        'status': 'AVAILABLE',
+        'created_at': '2026-10-19T08:15:30.123456Z',
+        'seller_id': index % 20,
+        'seller_username': f'seller{index % 20}',
+        'category': {'id': 12, 'name': 'Laptops', 'parent': 1},
+        'buyer': None,
+        'sold_at': None,
+        'latitude': 48.2 + index % 100 / 1000,
+        'longitude': 16.37 + index % 100 / 1000,
+        'city': 'Vienna',
+    } for index in range(count)]
+
+
+def raw_list(count):
+    """Aggregates with Decimal and datetime values, as in clusters and price bands"""
+    now = datetime.datetime(2026, 10, 19, 8, 15, 30, 123456, tzinfo=datetime.timezone.utc)
+    return [{
+        'cell': 1_000_000 + index,
+        'count': index % 50,
+        'min_price': Decimal(f'{10 + index % 500}.50'),
+        'updated_at': now,
+    } for index in range(count)]
+
+
+def chat_frames(count):
+    return [{
+        'type': 'message',
+        'message': f'Is it still available? {index}',
+        'sender_id': index % 20,
+        'sender_username': f'seller{index % 20}',
+        'sender_profile_picture': None,
+        'timestamp': '2026-10-19 08:15:30.123456+00:00',
+        'conversation': '42',
+    } for index in range(count)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark DRF/stdlib JSON against market.json_backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=10000,
+            help='Rows per list payload; chat frames are 10x this (default: 10000)'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=5,
+            help='Timed passes per case (default: 5)'
+        )
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        iterations = options['iterations']
+        products, raw, frames = product_list(rows), raw_list(rows), chat_frames(rows * 10)
+        product_bytes = JSONRenderer().render(products)
+        frame_texts = [json.dumps(frame) for frame in frames]
+        backend = 'orjson' if json_backend.orjson else 'stdlib'
+
+        cases = [
+            ('render products', len(product_bytes),
+             lambda: JSONRenderer().render(products), lambda: FastJSONRenderer().render(products)),
+            ('render raw values', len(JSONRenderer().render(raw)),
+             lambda: JSONRenderer().render(raw), lambda: FastJSONRenderer().render(raw)),
+            ('parse products', len(product_bytes),
+             lambda: JSONParser().parse(BytesIO(product_bytes)), lambda: FastJSONParser().parse(BytesIO(product_bytes))),
+            ('chat frames out', sum(map(len, frame_texts)),
+             lambda: [json.dumps(frame) for frame in frames],
+             lambda: [json_backend.dumps(frame).decode() for frame in frames]),
+            ('chat frames in', sum(map(len, frame_texts)),
+             lambda: [json.loads(text) for text in frame_texts],
+             lambda: [json_backend.loads(text) for text in frame_texts]),
+        ]
+
+        for name in ('render products', 'render raw values'):
+            _, _, legacy, fast = next(case for case in cases if case[0] == name)
+            if legacy() != fast():
+                raise CommandError(f'{name}: output differs from JSONRenderer')
+
+        self.stdout.write(f"{rows} rows, {rows * 10} chat frames, {iterations} iterations, backend: {backend}")
+        self.stdout.write(f"{'case':<20}{'legacy ms':>11}{'MB/s':>8}{'fast ms':>10}{'MB/s':>8}{'speedup':>9}")
+        for name, size, legacy, fast in cases:
+            timings = []
+            for run in (legacy, fast):
+                run()  # Warm up
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    run()
+                timings.append((time.perf_counter() - start) / iterations)
+            legacy_s, fast_s = timings
+            self.stdout.write(
+                f"{name:<20}{legacy_s * 1000:>11.1f}{size / legacy_s / 1e6:>8.0f}"
+                f"{fast_s * 1000:>10.1f}{size / fast_s / 1e6:>8.0f}{legacy_s / fast_s:>8.1f}x"
+            )
+        self.stdout.write(self.style.SUCCESS('Rendered output identical to JSONRenderer'))
@@ -0,0 +1,123 @@
+"""
+Django management command to benchmark typo-tolerant product search.
+Indexes a synthetic catalog of "<brand> <item> ..." titles in a
+market.product_search index, then searches for the brand and item of sample
+products with one typo in each word (dropped, doubled, swapped or replaced
+letter). Reports for the trigram index and for the LIKE-style substring scan
+the admin used: the share of queries with a relevant product (same brand and
+item) in the top 10, precision of the top 10 and time per query. Nothing is
+written to the database.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import random
+import statistics
+import string
+import time
+
+from market.product_search import ProductSearchIndex
+
+BRANDS = (
+    'adidas nike puma reebok asics salomon patagonia columbia samsung apple xiaomi huawei sony philips '
+    'bosch makita dewalt ikea lego playmobil canon nikon fujifilm olympus garmin shimano specialized '
+    'trek cannondale dyson miele siemens nintendo playstation logitech lenovo dell asus'
+).split()
+ITEMS = (
+    'sneakers jacket backpack hoodie phone tablet headphones speaker drill sander wardrobe shelf '
+    'bricks figures camera lens watch derailleur bicycle vacuum dishwasher console controller mouse '
+    'keyboard laptop monitor charger'
+).split()
+FILLER = 'used like new barely worn original box size black white blue red small large pickup only'.split()
+
+
+def misspell(word, rng):
+    """One typo: a dropped, doubled, swapped or replaced letter"""
+    at = rng.randrange(len(word))
+    kind = rng.choice(('drop', 'double', 'swap', 'replace'))
+    if kind == 'drop' and len(word) > 3:
+        return word[:at] + word[at + 1:]
+    if kind == 'swap' and at < len(word) - 1:
+        return word[:at] + word[at + 1] + word[at] + word[at + 2:]
+    if kind == 'replace':
+        return word[:at] + rng.choice(string.ascii_lowercase) + word[at + 1:]
+    return word[:at] + word[at] + word[at:]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark typo-tolerant product search against a substring scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=100000,
+            help='Products in the synthetic catalog (default: 100000)'
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=300,
+            help='Misspelled queries (default: 300)'
+        )
+        parser.add_argument(
+            '--max-candidates',
+            type=int,
+            default=settings.SEARCH_MAX_CANDIDATES,
+            help=f'Products scored per query (default: {settings.SEARCH_MAX_CANDIDATES})'
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        catalog = []
+        for product_id in range(1, options['products'] + 1):
+            brand, item = rng.choice(BRANDS), rng.choice(ITEMS)
+            title = ' '.join([brand.capitalize(), item] + rng.sample(FILLER, rng.randint(0, 3)))
+            description = ' '.join(rng.choices(FILLER, k=rng.randint(3, 12)))
+            catalog.append((product_id, title, description, brand, item))
+
+        index = ProductSearchIndex()
+        start = time.perf_counter()
+        for product_id, title, description, _, _ in catalog:
+            index._add(product_id, title, description, 'AVAILABLE')
+        index._loaded = True
+        build_s = time.perf_counter() - start
+
+        by_id = {product[0]: product for product in catalog}
+        queries = []
+        for _ in range(options['queries']):
+            _, _, _, brand, item = rng.choice(catalog)
+            queries.append((f'{misspell(brand, rng)} {misspell(item, rng)}', brand, item))
+
+        def relevant(product_id, brand, item):
+            return by_id[product_id][3] == brand and by_id[product_id][4] == item
+
+        results = {}
+        for name, search in (
+            ('trigram index', lambda query: [
+                product_id for product_id, _ in index.search(query, 10, max_candidates=options['max_candidates'])
+            ]),
+            ('substring scan', lambda query: [
+                product_id for product_id, title, description, _, _ in reversed(catalog)
+                if all(word in f'{title} {description}'.lower() for word in query.split())
+            ][:10]),
+        ):
+            timings, found, precision = [], 0, []
+            for query, brand, item in queries:
+                start = time.perf_counter()
+                top = search(query)
+                timings.append(time.perf_counter() - start)
+                hits = sum(relevant(product_id, brand, item) for product_id in top)
+                found += hits > 0
+                precision.append(hits / len(top) if top else 0)
+            results[name] = (found / len(queries), statistics.mean(precision), timings)
+
+        self.stdout.write(f"{len(catalog)} products indexed in {build_s:.1f}s, {len(queries)} misspelled queries")
+        self.stdout.write(f"{'path':<16}{'found@10':>10}{'prec@10':>10}{'ms/query':>10}{'p95 ms':>10}")
+        for name, (found, precision, timings) in results.items():
+            p95 = statistics.quantiles(timings, n=20)[-1]
+            self.stdout.write(
+                f"{name:<16}{found:>10.1%}{precision:>10.1%}{statistics.mean(timings) * 1000:>10.3f}{p95 * 1000:>10.3f}"
+            )
+        self.stdout.write(self.style.SUCCESS('Done'))
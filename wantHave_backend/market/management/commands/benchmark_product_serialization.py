@@ -0,0 +1,108 @@
+"""
+Django management command to benchmark product list serialization.
+Renders the same products in full as before (plain queryset), in full with the
+optimized queryset, as cards and as a sparse fieldset, and reports time, queries
+and JSON payload bytes per 1,000 products. Products are created in a transaction
+that is rolled back afterwards.
+"""
+
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+import time
+
+from market.models import Category, Product
+from market.serializers import ProductSerializer
+
+SPARSE_FIELDS = ['id', 'title', 'price', 'image']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark full, card and sparse product serialization'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=1000,
+            help='Number of products to serialize (default: 1000)'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=5,
+            help='Timed passes per representation (default: 5)'
+        )
+
+    def handle(self, *args, **options):
+        count = options['products']
+        iterations = options['iterations']
+        paths = {
+            'legacy': (None, False),
+            'full': (None, True),
+            'card': (ProductSerializer.Meta.views['card'], True),
+            'sparse': (SPARSE_FIELDS, True),
+        }
+
+        results = {}
+        with transaction.atomic():
+            self._create_products(count)
+            products = Product.objects.filter(title__startswith='Benchmark ').order_by('-created_at')
+            for path, (fields, optimized) in paths.items():
+                reset_queries()  # The query log is capped, a full log would capture nothing
+                with CaptureQueriesContext(connection) as queries:
+                    payload = self._render(products, fields, optimized)  # Also warms up
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    self._render(products, fields, optimized)
+                elapsed = time.perf_counter() - start
+                per_thousand = 1000 / count
+                results[path] = {
+                    'ms': elapsed / iterations * 1000 * per_thousand,
+                    'queries': len(queries) * per_thousand,
+                    'bytes': len(payload) * per_thousand,
+                }
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{count} products, {iterations} iterations, figures per 1,000 products")
+        self.stdout.write(f"{'path':<10}{'ms':>10}{'queries':>10}{'bytes':>12}")
+        for path, result in results.items():
+            self.stdout.write(
+                f"{path:<10}{result['ms']:>10.1f}{result['queries']:>10.0f}{result['bytes']:>12.0f}"
+            )
+
+        legacy, card = results['legacy'], results['card']
+        self.stdout.write(self.style.SUCCESS(
+            f"Card vs legacy: {legacy['ms'] / max(card['ms'], 0.001):.1f}x faster, "
+            f"{1 - card['bytes'] / legacy['bytes']:.0%} smaller payload"
+        ))
+
+    @staticmethod
+    def _render(products, fields, optimized):
+        queryset = ProductSerializer.optimize_queryset(products, fields) if optimized else products.all()
+        return JSONRenderer().render(ProductSerializer(queryset, many=True, fields=fields).data)
+
+    @staticmethod
+    def _create_products(count):
+        category = Category.objects.filter(children__isnull=True).first()
+        sellers = [
+            User.objects.create_user(username=f'benchmark-seller-{index}', password=None)
+            for index in range(20)
+        ]
+        Product.objects.bulk_create([
+            Product(
+                seller=sellers[index % len(sellers)],
+                title=f'Benchmark product {index}',
+                description='Used, in good condition, pickup or shipping. ' * 12,
+                price=Decimal(10 + index % 500),
+                image=f'product_images/benchmark-{index}.jpg',
+                category=category,
+                latitude=48.2 + index % 100 / 1000,
+                longitude=16.37 + index % 100 / 1000,
+                city='Vienna',
+            )
+            for index in range(count)
+        ])
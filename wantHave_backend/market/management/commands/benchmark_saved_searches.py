@@ -0,0 +1,130 @@
+"""
+Django management command to benchmark saved search percolation.
+Creates saved searches spread over categories, price ranges, cities and
+keywords, then matches new listings through market.saved_searches and through
+a linear scan over all searches, checks both find the same searches and
+reports time per listing. Rows are created in a transaction that is rolled
+back afterwards.
+"""
+
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+import random
+import time
+
+from market.category_matcher import normalize_tokens
+from market.models import Category, Product, SavedSearch
+from market.saved_searches import SavedSearchPercolator, matches
+
+CITIES = [
+    (48.2082, 16.3738), (48.3069, 14.2858), (47.0707, 15.4395), (47.8095, 13.0550),
+    (47.2692, 11.4041), (46.6249, 14.3050), (52.5200, 13.4050), (48.1351, 11.5820),
+    (50.0755, 14.4378), (47.4979, 19.0402),
+]
+WORDS = ['laptop', 'thinkpad', 'bike', 'vintage', 'lamp', 'sofa', 'camera', 'lens', 'jacket', 'guitar', 'book', 'desk']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark saved search percolation against a linear scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--searches',
+            type=int,
+            default=100000,
+            help='Saved searches to create (default: 100000)'
+        )
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=200,
+            help='New listings to percolate (default: 200)'
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            category_ids = list(Category.objects.values_list('id', flat=True))
+            self._create_searches(options['searches'], category_ids, rng)
+            products = [self._product(index, category_ids, rng) for index in range(options['products'])]
+
+            percolator = SavedSearchPercolator()
+            start = time.perf_counter()
+            percolator._ensure_loaded()
+            build_s = time.perf_counter() - start
+            searches = sorted(percolator.searches.values(), key=lambda search: search.id)
+
+            start = time.perf_counter()
+            indexed = [[search.id for search in percolator.match(product)] for product in products]
+            indexed_s = time.perf_counter() - start
+            candidates = sum(len(percolator.candidates(product)) for product in products)
+
+            start = time.perf_counter()
+            scanned = []
+            for product in products:
+                tokens = set(normalize_tokens(f'{product.title} {product.description}'))
+                ancestors = set(percolator.category_ids(product.category_id))
+                scanned.append([
+                    search.id for search in searches
+                    if search.user_id != product.seller_id and matches(search, product, tokens, ancestors)
+                ])
+            scan_s = time.perf_counter() - start
+            transaction.set_rollback(True)
+
+        if indexed != scanned:
+            raise CommandError('Percolator and linear scan found different searches')
+        count = len(products)
+        self.stdout.write(
+            f"{len(searches)} saved searches, {len(percolator.buckets)} buckets, index built in {build_s * 1000:.0f} ms"
+        )
+        self.stdout.write(
+            f"{count} listings, {sum(map(len, indexed)) / count:.1f} matches and "
+            f"{candidates / count:.0f} candidates per listing"
+        )
+        self.stdout.write(f"{'path':<14}{'ms/listing':>12}{'searches checked':>18}")
+        self.stdout.write(f"{'linear scan':<14}{scan_s * 1000 / count:>12.3f}{len(searches):>18}")
+        self.stdout.write(f"{'percolator':<14}{indexed_s * 1000 / count:>12.3f}{candidates / count:>18.0f}")
+        self.stdout.write(self.style.SUCCESS(f'Same matches, {scan_s / indexed_s:.0f}x faster'))
+
+    @staticmethod
+    def _create_searches(count, category_ids, rng):
+        users = User.objects.bulk_create([
+            User(username=f'benchmark-buyer-{index}') for index in range(max(count // 100, 1))
+        ])
+        batch = []
+        for index in range(count):
+            min_price = rng.choice([None, None, Decimal(rng.randrange(0, 500))])
+            max_price = rng.choice([None, Decimal(rng.randrange(500, 3000))])
+            located = rng.random() < 0.8
+            latitude, longitude = rng.choice(CITIES)
+            batch.append(SavedSearch(
+                user=users[index % len(users)],
+                category_id=rng.choice(category_ids) if rng.random() < 0.9 else None,
+                min_price=min_price,
+                max_price=max_price,
+                latitude=latitude + rng.uniform(-0.2, 0.2) if located else None,
+                longitude=longitude + rng.uniform(-0.2, 0.2) if located else None,
+                radius_km=rng.choice([5, 10, 25, 50, 100]) if located else None,
+                keywords=' '.join(rng.sample(WORDS, rng.choice([0, 0, 1, 2]))),
+            ))
+            if len(batch) == 5000:
+                SavedSearch.objects.bulk_create(batch)
+                batch = []
+        SavedSearch.objects.bulk_create(batch)
+
+    @staticmethod
+    def _product(index, category_ids, rng):
+        latitude, longitude = rng.choice(CITIES)
+        return Product(
+            id=index,
+            seller_id=0,
+            category_id=rng.choice(category_ids),
+            title=' '.join(rng.sample(WORDS, 2)),
+            description='Used, in good condition, pickup or shipping.',
+            price=Decimal(rng.randrange(5, 2500)),
+            latitude=latitude + rng.uniform(-0.5, 0.5),
+            longitude=longitude + rng.uniform(-0.5, 0.5),
+        )
@@ -0,0 +1,94 @@
+"""
+Django management command to benchmark search box autocomplete.
+Builds a market.suggestions snapshot from random listing titles, maps it and
+looks up prefixes of sample titles (1 to 10 characters, from any of their
+first words) through the sorted key array and through a linear scan over all
+suggestions, checks both return the same suggestions and reports time per
+lookup. Nothing is written to the database.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+import os
+import random
+import tempfile
+import time
+
+from market.suggestions import MAX_KEY_WORDS, TITLE, Snapshot, index_arrays, normalize, write_snapshot
+
+WORDS = (
+    'vintage leather jacket wooden desk lamp road bike mountain phone case charger '
+    'sofa table chair mirror camera lens guitar amplifier kids shoes boots dress '
+    'winter summer black white red blue green large small new used oak steel glass '
+    'kitchen garden coffee machine vacuum cleaner headphones speaker monitor keyboard'
+).split()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark autocomplete lookups against a linear scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--suggestions',
+            type=int,
+            default=200000,
+            help='Distinct titles to index (default: 200000)'
+        )
+        parser.add_argument(
+            '--lookups',
+            type=int,
+            default=500,
+            help='Prefixes to look up (default: 500)'
+        )
+        parser.add_argument('--limit', type=int, default=8, help='Suggestions per lookup (default: 8)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        limit = options['limit']
+        texts = sorted({
+            ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 6))) + f' {rng.randrange(10000)}'
+            for _ in range(options['suggestions'])
+        })
+        weights = [float(int(rng.paretovariate(1.5))) for _ in texts]
+
+        start = time.perf_counter()
+        arrays = index_arrays(texts, [TITLE] * len(texts), [-1] * len(texts), weights, [1] * len(texts))
+        build_s = time.perf_counter() - start
+
+        queries = []
+        for _ in range(options['lookups']):
+            words = rng.choice(texts).split(' ')
+            queries.append(' '.join(words[rng.randrange(min(len(words), MAX_KEY_WORDS)):])[:rng.randint(1, 10)])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'suggest_index.bin')
+            write_snapshot(path, arrays, time.time())
+            snapshot = Snapshot(path)
+            start = time.perf_counter()
+            indexed = [snapshot.lookup(normalize(prefix), limit).tolist() for prefix in queries]
+            indexed_s = time.perf_counter() - start
+            del snapshot
+
+        word_starts = [
+            [' '.join(words[start:]) for start in range(min(len(words), MAX_KEY_WORDS))]
+            for words in (text.split(' ') for text in texts)
+        ]
+        start = time.perf_counter()
+        scanned = []
+        for prefix in queries:
+            prefix = normalize(prefix)
+            matches = [index for index, keys in enumerate(word_starts) if any(key.startswith(prefix) for key in keys)]
+            scanned.append(sorted(matches, key=lambda index: (-weights[index], index))[:limit])
+        scan_s = time.perf_counter() - start
+
+        if indexed != scanned:
+            raise CommandError('Index and linear scan returned different suggestions')
+        count = len(queries)
+        self.stdout.write(
+            f"{len(texts)} suggestions, {len(arrays['keys'])} keys indexed in {build_s:.1f}s, "
+            f"{len(arrays['short_prefixes'])} short prefixes precomputed"
+        )
+        self.stdout.write(f"{'path':<14}{'ms/lookup':>12}")
+        self.stdout.write(f"{'linear scan':<14}{scan_s * 1000 / count:>12.3f}")
+        self.stdout.write(f"{'sorted keys':<14}{indexed_s * 1000 / count:>12.3f}")
+        self.stdout.write(self.style.SUCCESS(f'Same suggestions, {scan_s / indexed_s:.0f}x faster'))
@@ -0,0 +1,72 @@
+"""
+Django management command to build the offline autofill index.
+Computes image embeddings for products that have none or whose image changed,
+so each run only touches new and edited listings, and deletes the embeddings of
+products whose image was removed.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from market.models import Product, ProductEmbedding
+from market.offline_classifier import compute_product_embedding
+import logging
+import time
+
+logger = logging.getLogger('market.ai_autofill')
+
+
+class Command(BaseCommand):
+    help = 'Compute image embeddings for the offline AI autofill fallback'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recompute embeddings for all products, not only new or changed ones'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Products written per transaction (default: 200)'
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        batch_size = options['batch_size']
+
+        # Only ids and image names are loaded to find stale rows
+        stale_ids, removed_ids = [], []
+        for product_id, image_name, embedded_name in Product.objects.values_list(
+            'id', 'image', 'embedding__image_name'
+        ).iterator():
+            if not image_name:
+                if embedded_name is not None:
+                    removed_ids.append(product_id)
+            elif options['rebuild'] or image_name != embedded_name:
+                stale_ids.append(product_id)
+        logger.info(f"Found {len(stale_ids)} products to embed")
+
+        removed = 0
+        for offset in range(0, len(removed_ids), batch_size):
+            removed += ProductEmbedding.objects.filter(product_id__in=removed_ids[offset:offset + batch_size]).delete()[0]
+
+        embedded = 0
+        for offset in range(0, len(stale_ids), batch_size):
+            batch_ids = stale_ids[offset:offset + batch_size]
+            embeddings = []
+            for product in Product.objects.filter(id__in=batch_ids).only('id', 'image'):
+                vector = compute_product_embedding(product)
+                if vector is not None:
+                    embeddings.append(ProductEmbedding(product=product, vector=vector, image_name=product.image.name))
+
+            with transaction.atomic():
+                ProductEmbedding.objects.filter(product_id__in=batch_ids).delete()
+                ProductEmbedding.objects.bulk_create(embeddings)
+            embedded += len(embeddings)
+
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Embedded {embedded} of {len(stale_ids)} products, deleted {removed} embeddings "
+            f"of removed images in {elapsed:.1f}s"
+        ))
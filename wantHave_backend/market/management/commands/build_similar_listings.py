@@ -0,0 +1,35 @@
+"""
+Django management command to build the similar listings index.
+Loads the catalog into market.similar_listings and stores every product's
+nearest neighbours; after the first build only products affected by new
+listings, watchers, conversations or sold neighbours are recomputed.
+"""
+
+from django.core.management.base import BaseCommand
+from market.similar_listings import WRITE_BATCH_SIZE, build
+import time
+
+
+class Command(BaseCommand):
+    help = 'Precompute similar listings for GET /products/<id>/similar/'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recompute neighbours of all products, e.g. after titles were edited'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=WRITE_BATCH_SIZE,
+            help=f'Products written per transaction (default: {WRITE_BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        refreshed, total = build(rebuild=options['rebuild'], batch_size=options['batch_size'])
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Refreshed similar listings of {refreshed} of {total} products in {elapsed:.1f}s"
+        ))
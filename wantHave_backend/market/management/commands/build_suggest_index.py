@@ -0,0 +1,23 @@
+"""
+Django management command to build the autocomplete snapshot.
+Writes SUGGEST_INDEX_PATH from the current catalog; running servers map the
+new file within seconds. Servers also rebuild it after product changes, so this
+is only needed on deploy or after editing the database directly.
+"""
+
+from django.core.management.base import BaseCommand
+from market.suggestions import suggestion_index
+import time
+
+
+class Command(BaseCommand):
+    help = 'Build the memory-mapped index behind GET /products/suggest/'
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        suggestion_index.rebuild()
+        snapshot = suggestion_index._snapshot
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(snapshot.weights)} suggestions under {len(snapshot.keys)} keys in {elapsed:.1f}s"
+        ))
@@ -0,0 +1,35 @@
+"""
+Django management command to compact the product change log.
+Drops entries superseded by a newer entry of the same product and entries
+older than CHANGE_LOG_RETENTION_DAYS, a batch of ids per statement so product
+writes are never blocked for long. Clients with tokens older than the
+retention window reload the product list.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from market.change_log import compact
+from market.models import ProductChange
+import time
+
+
+class Command(BaseCommand):
+    help = 'Compact the change log behind GET /products/changes/'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Log entries examined per delete statement (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        superseded, expired = compact(options['batch_size'])
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Dropped {superseded} superseded and {expired} expired entries "
+            f"(older than {settings.CHANGE_LOG_RETENTION_DAYS} days), "
+            f"{ProductChange.objects.count()} left, in {elapsed:.1f}s"
+        ))
@@ -0,0 +1,62 @@
+"""
+Django management command to backfill perceptual hashes of product images.
+New uploads are hashed in Product.save(); this covers products stored before
+that, and images referenced by path in bulk imports. The hashes are written
+with bulk_update, which running backend processes do not see: restart them so
+their duplicate image index is reloaded with the new hashes.
+"""
+
+from django.core.management.base import BaseCommand
+from market import image_hashing
+from market.models import Product
+import logging
+import time
+
+logger = logging.getLogger('market.duplicate_images')
+
+
+class Command(BaseCommand):
+    help = 'Compute the perceptual hash of product images that have none'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rehash',
+            action='store_true',
+            help='Recompute hashes of all products, not only those without one'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Products updated per query (default: 500)'
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        batch_size = options['batch_size']
+
+        products = Product.objects.exclude(image='').only('id', 'image')
+        if not options['rehash']:
+            products = products.filter(image_hash__isnull=True)
+        product_ids = list(products.values_list('id', flat=True))
+        logger.info(f"Found {len(product_ids)} product images to hash")
+
+        hashed = 0
+        for offset in range(0, len(product_ids), batch_size):
+            batch = list(products.filter(id__in=product_ids[offset:offset + batch_size]))
+            for product in batch:
+                try:
+                    with product.image.open('rb') as image:
+                        product.image_hash = image_hashing.stored_dhash(image)
+                except OSError:
+                    product.image_hash = None  # Missing file
+            updated = [product for product in batch if product.image_hash is not None]
+            Product.objects.bulk_update(updated, ['image_hash'])
+            hashed += len(updated)
+
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Hashed {hashed} of {len(product_ids)} product images in {elapsed:.1f}s"
+        ))
+        if hashed:
+            self.stdout.write('Restart the backend so its duplicate image index includes the new hashes')
@@ -6,7 +6,6 @@ Used in VPN environments where webhooks cannot reach the backend.
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
-from market.models import Order
 from market.stripe_service import StripeService
 import logging
 import time
@@ -48,12 +47,9 @@ class Command(BaseCommand):
 
         start_time = time.time()
 
-        # Query pending orders created within last N hours
+        # Query pending (and still payable cancelled) orders created within last N hours
         cutoff_time = timezone.now() - timedelta(hours=age_hours)
-        pending_orders = Order.objects.filter(
-            status='PENDING',
-            created_at__gte=cutoff_time
-        ).order_by('created_at')[:max_orders]
+        pending_orders = StripeService.pollable_orders(cutoff_time).order_by('created_at')[:max_orders]
 
         total_orders = pending_orders.count()
         logger.info(f"Found {total_orders} pending orders to check")
@@ -0,0 +1,55 @@
+"""
+Django management command to rebuild the category price bands from scratch.
+Normally the sketches are updated incrementally as orders are paid and offers
+accepted; this backfills existing history or repairs drift after manual edits.
+"""
+
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from market.models import Category, CategoryPriceStats, Offer, Order
+from market.price_stats import PriceSketch, price_bands
+import time
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-category price quantile sketches from paid orders and accepted offers'
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        parents = dict(Category.objects.values_list('id', 'parent_id'))
+        sketches = defaultdict(lambda: {'sold': PriceSketch(), 'accepted': PriceSketch()})
+
+        sources = (
+            ('sold', Order.objects.filter(status='PAID').values_list('product__category_id', 'price')),
+            # Paid offers were accepted first
+            ('accepted', Offer.objects.filter(status__in=['ACCEPTED', 'PAID']).values_list(
+                'product__category_id', 'amount'
+            )),
+        )
+        counts = {}
+        for kind, rows in sources:
+            counts[kind] = 0
+            for category_id, price in rows.iterator():
+                while category_id is not None:
+                    sketches[category_id][kind].add(price)
+                    category_id = parents.get(category_id)
+                counts[kind] += 1
+
+        with transaction.atomic():
+            CategoryPriceStats.objects.all().delete()
+            CategoryPriceStats.objects.bulk_create([
+                CategoryPriceStats(
+                    category_id=category_id,
+                    sold_sketch=kinds['sold'].to_dict(),
+                    accepted_sketch=kinds['accepted'].to_dict()
+                )
+                for category_id, kinds in sketches.items()
+            ])
+        price_bands.invalidate()
+
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt price bands for {len(sketches)} categories from {counts['sold']} sales "
+            f"and {counts['accepted']} accepted offers in {elapsed:.1f}s"
+        ))
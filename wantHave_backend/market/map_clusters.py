@@ -0,0 +1,95 @@
+"""
+Server-side marker clustering for the product map.
+Available products are grouped by grid cell in SQL (see market.geo_grid); results
+are cached per (zoom, tile) and dropped when a product in that tile changes, so
+the payload depends on the viewport, not on the catalog size.
+
+The cache is Django's default per-process cache: a product change only drops the
+tiles of the process that saved it. Other backend processes keep serving their
+copy for up to PRODUCT_CLUSTER_CACHE_TTL seconds.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, BigIntegerField, Count, ExpressionWrapper, F, Min, Q, Window
+from django.db.models.functions import RowNumber
+
+from . import geo_grid
+from .models import Product
+
+CLUSTER_DEPTH = 2  # Clusters are 1/4 of a tile edge, ~64 px on 256 px tiles
+MAX_ZOOM = geo_grid.GRID_ZOOM - CLUSTER_DEPTH
+SAMPLE_SIZE = 3  # Newest product ids returned per cluster
+
+
+def _cache_key(zoom, tile):
+    return f'product-clusters:{zoom}:{tile}'
+
+
+def clusters_for_bbox(min_lng, min_lat, max_lng, max_lat, zoom):
+    """
+    Clusters of available products within the bounding box.
+
+    Returns:
+        List of dicts with cell, count, latitude, longitude (centroid), min_price, sample_ids
+    """
+    tiles = geo_grid.tiles_in_bbox(min_lng, min_lat, max_lng, max_lat, zoom)
+    keys = {tile: _cache_key(zoom, tile) for tile in tiles}
+    cached = cache.get_many(keys.values())
+
+    missing = [tile for tile, key in keys.items() if key not in cached]
+    if missing:
+        computed = _compute_tiles(missing, zoom)
+        cache.set_many(
+            {keys[tile]: clusters for tile, clusters in computed.items()},
+            timeout=settings.PRODUCT_CLUSTER_CACHE_TTL
+        )
+        cached.update({keys[tile]: clusters for tile, clusters in computed.items()})
+
+    return [cluster for tile in tiles for cluster in cached[keys[tile]]]
+
+
+def _compute_tiles(tiles, zoom):
+    """Aggregate all missing tiles with one grouped query plus one query for sample ids"""
+    cluster_zoom = zoom + CLUSTER_DEPTH
+    in_tiles = Q()
+    for start, end in geo_grid.cell_ranges(tiles, zoom):
+        in_tiles |= Q(grid_cell__gte=start, grid_cell__lt=end)
+
+    products = Product.objects.filter(in_tiles, status='AVAILABLE').annotate(
+        cluster=ExpressionWrapper(
+            F('grid_cell') / geo_grid.cell_divisor(cluster_zoom), output_field=BigIntegerField()
+        )
+    )
+
+    samples = {}
+    for cluster, product_id in products.annotate(
+        rank=Window(RowNumber(), partition_by=[F('cluster')], order_by=[F('created_at').desc(), F('id').desc()])
+    ).filter(rank__lte=SAMPLE_SIZE).values_list('cluster', 'id'):
+        samples.setdefault(cluster, []).append(product_id)
+
+    by_tile = {tile: [] for tile in tiles}
+    rows = products.values('cluster').annotate(
+        count=Count('id'), latitude=Avg('latitude'), longitude=Avg('longitude'), min_price=Min('price')
+    ).order_by('cluster')
+    for row in rows:
+        tile = row['cluster'] // 4 ** CLUSTER_DEPTH
+        by_tile[tile].append({
+            'cell': row['cluster'],
+            'count': row['count'],
+            'latitude': round(row['latitude'], 6),
+            'longitude': round(row['longitude'], 6),
+            'min_price': row['min_price'],
+            'sample_ids': samples.get(row['cluster'], []),
+        })
+    return by_tile
+
+
+def invalidate_cells(*cells):
+    """Drop cached clusters of every zoom level for the tiles containing these grid cells"""
+    keys = [
+        _cache_key(zoom, geo_grid.tile_of_cell(cell, zoom))
+        for cell in set(cells) if cell is not None
+        for zoom in range(MAX_ZOOM + 1)
+    ]
+    if keys:
+        cache.delete_many(keys)
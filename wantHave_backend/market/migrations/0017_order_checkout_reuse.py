@@ -0,0 +1,50 @@
+# Generated by Django 5.1.2 on 2026-10-19 00:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def cancel_duplicate_pending_orders(apps, schema_editor):
+    """
+    Keep only the newest PENDING order per buyer/product/price so the constraint can be added.
+    Their sessions are not expired here; poll_stripe_payments keeps polling CANCELLED
+    orders without checkout_expires_at, so a late payment is still recorded.
+    """
+    Order = apps.get_model('market', 'Order')
+    seen = set()
+    duplicate_ids = []
+    pending = Order.objects.filter(status='PENDING').order_by('-created_at', '-id')
+    for order_id, buyer_id, product_id, price in pending.values_list('id', 'buyer_id', 'product_id', 'price'):
+        key = (buyer_id, product_id, price)
+        if key in seen:
+            duplicate_ids.append(order_id)
+        else:
+            seen.add(key)
+    if duplicate_ids:
+        Order.objects.filter(id__in=duplicate_ids).update(status='CANCELLED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0016_add_product_location'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='checkout_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='stripe_checkout_url',
+            field=models.URLField(blank=True, max_length=2048),
+        ),
+        migrations.RunPython(cancel_duplicate_pending_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'PENDING')), fields=('buyer', 'product', 'price'), name='unique_pending_order_per_buyer_product_price'),
+        ),
+    ]
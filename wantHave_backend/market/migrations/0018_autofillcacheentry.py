@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-19 00:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0017_order_checkout_reuse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutofillCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('perceptual_hash', models.BigIntegerField()),
+                ('phash_band_0', models.IntegerField(db_index=True)),
+                ('phash_band_1', models.IntegerField(db_index=True)),
+                ('phash_band_2', models.IntegerField(db_index=True)),
+                ('phash_band_3', models.IntegerField(db_index=True)),
+                ('result', models.JSONField()),
+                ('hit_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-19 00:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0018_autofillcacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vector', models.BinaryField()),
+                ('image_name', models.CharField(max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='embedding', to='market.product')),
+            ],
+        ),
+    ]
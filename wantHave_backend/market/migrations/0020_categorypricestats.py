@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-19 00:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0019_productembedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryPriceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sold_sketch', models.JSONField(default=dict)),
+                ('accepted_sketch', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='price_stats', to='market.category')),
+            ],
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.2 on 2026-10-19 00:52
+
+import math
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Frozen copy of market.geo_grid.cell_for as of this migration, so later changes
+# to the app module cannot change what it computes
+GRID_ZOOM = 20
+MAX_LATITUDE = 85.05112878
+
+
+def cell_for(latitude, longitude):
+    n = 1 << GRID_ZOOM
+    lat_rad = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude)))
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    x, y = min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+    code = 0
+    for bit in range(GRID_ZOOM):
+        code |= ((x >> bit) & 1) << (2 * bit + 1)
+        code |= ((y >> bit) & 1) << (2 * bit)
+    return code
+
+
+def fill_grid_cells(apps, schema_editor):
+    """Compute grid cells of existing products (historical models don't run Product.save)"""
+    Product = apps.get_model('market', 'Product')
+    products = []
+    for product in Product.objects.filter(latitude__isnull=False, longitude__isnull=False).only(
+        'id', 'latitude', 'longitude'
+    ).iterator():
+        product.grid_cell = cell_for(product.latitude, product.longitude)
+        products.append(product)
+    Product.objects.bulk_update(products, ['grid_cell'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0020_categorypricestats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='grid_cell',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_grid_cells, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'grid_cell'], name='product_status_grid_cell_idx'),
+        ),
+    ]
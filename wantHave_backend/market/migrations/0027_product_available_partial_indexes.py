@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-19 02:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0026_product_image_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_status_grid_cell_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_status_trending_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'AVAILABLE')), fields=['-created_at'], name='product_avail_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'AVAILABLE')), fields=['category', '-created_at'], name='product_avail_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'AVAILABLE')), fields=['grid_cell'], name='product_avail_grid_cell_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'AVAILABLE')), fields=['-trending_score'], name='product_avail_trending_idx'),
+        ),
+    ]
@@ -3,6 +3,8 @@ from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 
+from . import geo_grid, image_hashing
+
 # User Profile with Map Location
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -72,10 +74,115 @@ class Product(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='AVAILABLE')
     buyer = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='purchases')
 
+    # Map grid cell of latitude/longitude (see market.geo_grid), maintained in save()
+    grid_cell = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    # Signed 64-bit dHash of the image (see market.image_hashing), set in save() when an image is uploaded
+    image_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    # Decayed event score in log2 space, written only by market.engagement; None until the first event
+    trending_score = models.FloatField(null=True, blank=True, editable=False)
+
+    class Meta:
+        # Partial indexes over available products only: SOLD rows pile up with every
+        # sale, but the feed, map and trending reads never touch them
+        indexes = [
+            # The product feed (newest first, optionally per category)
+            models.Index(fields=['-created_at'], condition=models.Q(status='AVAILABLE'), name='product_avail_created_idx'),
+            models.Index(fields=['category', '-created_at'], condition=models.Q(status='AVAILABLE'), name='product_avail_category_idx'),
+            # Map clustering scans cell ranges of available products
+            models.Index(fields=['grid_cell'], condition=models.Q(status='AVAILABLE'), name='product_avail_grid_cell_idx'),
+            # ?ordering=trending reads the top available products straight off this index
+            models.Index(fields=['-trending_score'], condition=models.Q(status='AVAILABLE'), name='product_avail_trending_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.grid_cell = geo_grid.cell_for(self.latitude, self.longitude)
+        if self.image and not self.image._committed:
+            # A newly assigned file, hashed before storage takes it over
+            self.image_hash = image_hashing.stored_dhash(self.image)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            derived = {'grid_cell'} if {'latitude', 'longitude'} & set(update_fields) else set()
+            if 'image' in update_fields:
+                derived.add('image_hash')
+            if derived:
+                kwargs['update_fields'] = {*update_fields, *derived}
+        elif not self._state.adding and not kwargs.get('force_insert'):
+            # A loaded product's trending_score may be stale; saving it would undo flushed events
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'trending_score'
+            ]
+        super().save(*args, **kwargs)
+
+
+
+
+class ProductEngagement(models.Model):
+    """
+    View, impression and click counts of a product, kept apart from Product so
+    that saving a listing never overwrites them. Written in bulk by market.engagement.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='engagement')
+    views = models.PositiveIntegerField(default=0)  # Detail page loads
+    impressions = models.PositiveIntegerField(default=0)  # Appearances in product lists
+    clicks = models.PositiveIntegerField(default=0)  # Click-throughs from a list to the detail page
+    updated_at = models.DateTimeField(auto_now=True)
 
+    def __str__(self):
+        return f"Engagement of product {self.product_id}"
+
+
+class ProductChange(models.Model):
+    """
+    Entry of the product change log behind GET /products/changes/ (see
+    market.change_log). Written in the same transaction as the change; the id
+    is the sync position, so the product is not a foreign key and tombstones
+    outlive it.
+    """
+    CREATED = 'CREATED'
+    UPDATED = 'UPDATED'
+    SOLD = 'SOLD'
+    DELETED = 'DELETED'
+    ACTION_CHOICES = [
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (SOLD, 'Sold'),
+        (DELETED, 'Deleted'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    product_id = models.IntegerField(db_index=True)  # Also finds a product's newer entries when compacting
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"#{self.id} {self.action} product {self.product_id}"
+
+
+class SimilarProduct(models.Model):
+    """
+    Precomputed neighbour of a product for "similar listings", built by the
+    build_similar_listings command (see market.similar_listings).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similar_products')
+    neighbour = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similar_to')
+    rank = models.PositiveSmallIntegerField()  # 0 is the most similar
+    score = models.FloatField()
+    built_at = models.DateTimeField(db_index=True)  # Start of the build that wrote the row
+
+    class Meta:
+        constraints = [
+            # Also the index the similar endpoint reads a product's neighbours by
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_similar_product_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} ~ {self.neighbour_id} (#{self.rank})"
 
 
 class WatchlistItem(models.Model):
@@ -91,6 +198,29 @@ class WatchlistItem(models.Model):
         return f"{self.user.username} watches {self.product.title}"
 
 
+class SavedSearch(models.Model):
+    """
+    Standing search of a buyer; new listings matching it are pushed to the user
+    (see market.saved_searches). Empty criteria match everything.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='saved_searches')
+    name = models.CharField(max_length=100, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='saved_searches')  # Includes subcategories
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    radius_km = models.FloatField(null=True, blank=True)  # Needs latitude/longitude
+    keywords = models.CharField(max_length=200, blank=True)  # All must occur in title or description
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.user.username}: {self.name or self.keywords or 'saved search'}"
+
+
 # Chat Models
 class Conversation(models.Model):
     participants = models.ManyToManyField(User, related_name='conversations')
@@ -171,6 +301,8 @@ class Order(models.Model):
 
     # Stripe references
     stripe_checkout_session_id = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    stripe_checkout_url = models.URLField(max_length=2048, blank=True)
+    checkout_expires_at = models.DateTimeField(null=True, blank=True)
 
     # Polling metadata (for VPN environment where webhooks can't reach backend)
     last_polled_at = models.DateTimeField(null=True, blank=True)
@@ -185,6 +317,14 @@ class Order(models.Model):
             models.Index(fields=['stripe_checkout_session_id']),
             models.Index(fields=['status', 'created_at']),  # Optimize polling queries
         ]
+        constraints = [
+            # At most one open checkout per buyer/product/amount (double-clicks, retries)
+            models.UniqueConstraint(
+                fields=['buyer', 'product', 'price'],
+                condition=models.Q(status='PENDING'),
+                name='unique_pending_order_per_buyer_product_price',
+            ),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.product.title} - {self.status}"
@@ -253,3 +393,50 @@ class StripeWebhookEvent(models.Model):
 
     def __str__(self):
         return f"{self.event_type} - {self.event_id}"
+
+
+class ProductEmbedding(models.Model):
+    """
+    Compact image embedding of a product, used by the offline autofill classifier.
+    Built incrementally by the build_autofill_index management command.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='embedding')
+    vector = models.BinaryField()  # float32 array, see offline_classifier.EMBEDDING_DIM
+    image_name = models.CharField(max_length=255)  # Image the vector was computed from
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Embedding for {self.product.title}"
+
+
+class AutofillCacheEntry(models.Model):
+    """
+    Cached AI autofill result for an analyzed image.
+    Looked up by exact content hash first, then by perceptual hash bands for near-duplicates.
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    perceptual_hash = models.BigIntegerField()  # Signed representation of the 64-bit dHash
+    phash_band_0 = models.IntegerField(db_index=True)
+    phash_band_1 = models.IntegerField(db_index=True)
+    phash_band_2 = models.IntegerField(db_index=True)
+    phash_band_3 = models.IntegerField(db_index=True)
+    result = models.JSONField()
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Autofill cache {self.content_hash[:12]} ({self.result.get('title', '')})"
+
+
+class CategoryPriceStats(models.Model):
+    """
+    Streaming price quantile sketches for a category, including all its subcategories.
+    Maintained incrementally by market.price_stats as orders are paid and offers accepted.
+    """
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, related_name='price_stats')
+    sold_sketch = models.JSONField(default=dict)  # Prices of paid orders
+    accepted_sketch = models.JSONField(default=dict)  # Amounts of accepted offers
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Price stats for {self.category.name}"
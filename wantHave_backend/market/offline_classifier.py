@@ -0,0 +1,194 @@
+"""
+Offline fallback for AI autofill.
+Suggests a category and price band from the existing catalog when the Gemini model
+is unavailable (missing key, exhausted quota, failed call): nearest neighbours over
+compact image embeddings, plus TF-IDF over the neighbours' titles for keyword hints.
+"""
+import io
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+import numpy as np
+from django.db.models import Count, Max
+from PIL import Image
+
+from .models import ProductChange, ProductEmbedding
+
+logger = logging.getLogger('market.ai_autofill')
+
+THUMBNAIL_SIZE = 8  # 8x8 RGB layout features
+HISTOGRAM_BINS = 4  # 4x4x4 RGB colour histogram
+EMBEDDING_DIM = THUMBNAIL_SIZE * THUMBNAIL_SIZE * 3 + HISTOGRAM_BINS ** 3
+NEIGHBOURS = 10
+KEYWORDS = 3
+INDEX_CHECK_INTERVAL = 60  # Seconds between checks for a newer index build
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def embed_image(image):
+    """
+    Compute a unit-length float32 embedding of a PIL image.
+    Combines a mean-centred 8x8 thumbnail (layout) with a colour histogram (palette).
+    """
+    image.draft('RGB', (64, 64))
+    image = image.convert('RGB')
+
+    layout = np.asarray(image.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BILINEAR), dtype=np.float32)
+    layout = layout.ravel() / 255
+    layout -= layout.mean()
+
+    bin_width = 256 // HISTOGRAM_BINS
+    pixels = np.asarray(image.resize((32, 32), Image.Resampling.NEAREST), dtype=np.uint8).reshape(-1, 3) // bin_width
+    bins = (pixels[:, 0].astype(np.int32) * HISTOGRAM_BINS + pixels[:, 1]) * HISTOGRAM_BINS + pixels[:, 2]
+    histogram = np.bincount(bins, minlength=HISTOGRAM_BINS ** 3).astype(np.float32)
+
+    vector = np.concatenate([_normalize(layout), _normalize(histogram)])
+    return _normalize(vector).astype(np.float32)
+
+
+def _normalize(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class CatalogIndex:
+    """
+    In-memory nearest-neighbour index over all ProductEmbedding rows.
+    Reloaded when the build_autofill_index command has written newer embeddings
+    or a product was changed since (see market.change_log).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self.matrix = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.category_ids = []
+        self.category_names = {}
+        self.prices = np.zeros(0)
+        self.titles = []
+        self.idf = {}
+
+    def invalidate(self):
+        """Force a reload on the next lookup"""
+        with self._lock:
+            self._version = None
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < INDEX_CHECK_INTERVAL:
+            return
+        with self._lock:
+            self._checked_at = now
+            stats = ProductEmbedding.objects.filter(product__category__isnull=False).aggregate(
+                count=Count('id'), latest=Max('updated_at')
+            )
+            # Title, category and price edits leave the embeddings alone but are in the change log
+            latest_change = ProductChange.objects.aggregate(latest=Max('id'))['latest']
+            version = (stats['count'], stats['latest'], latest_change)
+            if version != self._version:
+                self._load()
+                self._version = version
+
+    def _load(self):
+        rows = ProductEmbedding.objects.filter(product__category__isnull=False).values_list(
+            'vector', 'product__category_id', 'product__category__name', 'product__price', 'product__title'
+        )
+        vectors, category_ids, prices, titles = [], [], [], []
+        category_names = {}
+        for vector, category_id, category_name, price, title in rows.iterator():
+            vectors.append(np.frombuffer(bytes(vector), dtype=np.float32))
+            category_ids.append(category_id)
+            category_names[category_id] = category_name
+            prices.append(float(price))
+            titles.append(title)
+
+        document_frequency = Counter()
+        for title in titles:
+            document_frequency.update(set(tokenize(title)))
+
+        self.matrix = np.vstack(vectors) if vectors else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.category_ids = category_ids
+        self.category_names = category_names
+        self.prices = np.asarray(prices)
+        self.titles = titles
+        self.idf = {term: math.log((1 + len(titles)) / (1 + df)) + 1 for term, df in document_frequency.items()}
+        logger.info('Offline autofill index loaded with %s products', len(titles))
+
+    def suggest(self, image):
+        """
+        Suggest a category, price band and title keywords for a PIL image.
+
+        Returns:
+            Analysis-shaped dict, or None if the catalog index is empty
+        """
+        self._ensure_fresh()
+        if not len(self.titles):
+            return None
+
+        query = embed_image(image)
+        similarities = self.matrix @ query
+        k = min(NEIGHBOURS, len(similarities))
+        neighbours = np.argpartition(-similarities, k - 1)[:k]
+        weights = np.clip(similarities[neighbours], 0, None) + 1e-6
+
+        votes = defaultdict(float)
+        for index, weight in zip(neighbours, weights):
+            votes[self.category_ids[index]] += weight
+        category_id = max(votes, key=votes.get)
+        in_category = [index for index in neighbours if self.category_ids[index] == category_id]
+
+        price_min, price_max = np.percentile(self.prices[in_category], [25, 75])
+        return {
+            'title': '',
+            'description': '',
+            'category_suggestion': self.category_names[category_id],
+            'category_id': category_id,
+            'price_min': round(float(price_min), 2),
+            'price_max': round(float(price_max), 2),
+            'keywords': self._keywords(in_category),
+            'confidence': round(votes[category_id] / float(weights.sum()), 2),
+            'source': 'offline'
+        }
+
+    def _keywords(self, indexes):
+        """Highest-weighted terms of the TF-IDF centroid of the neighbours' titles"""
+        centroid = Counter()
+        for index in indexes:
+            counts = Counter(tokenize(self.titles[index]))
+            weights = {term: count * self.idf.get(term, 1.0) for term, count in counts.items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+            for term, weight in weights.items():
+                centroid[term] += weight / norm
+        return [term for term, _ in centroid.most_common(KEYWORDS)]
+
+
+catalog_index = CatalogIndex()
+
+
+def compute_product_embedding(product):
+    """Embed a product's stored image; returns float32 bytes or None if unreadable"""
+    try:
+        with product.image.open('rb') as image_file:
+            return embed_image(Image.open(image_file)).tobytes()
+    except Exception as e:
+        logger.warning('Could not embed image of product %s: %s', product.id, e)
+        return None
+
+
+def suggest_from_catalog(image_bytes):
+    """Offline autofill suggestion for an uploaded image, or None if unavailable"""
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        return catalog_index.suggest(image)
+    except Exception as e:
+        logger.warning('Offline autofill failed: %s', e)
+        return None
@@ -0,0 +1,22 @@
+"""
+API parsers.
+FastJSONParser is the default JSON parser (see market.json_backend).
+"""
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from . import json_backend
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser through market.json_backend; bodies in other charsets than UTF-8 use DRF's parser"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if encoding.lower().replace('-', '') != 'utf8' or not self.strict:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return json_backend.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,187 @@
+"""
+Historical price bands per category.
+Paid order prices and accepted offer amounts are folded into mergeable quantile
+sketches (DDSketch: logarithmic buckets with a fixed relative error), stored per
+category and each of its ancestors, so p10/p50/p90 never require scanning orders.
+"""
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .models import Category, CategoryPriceStats
+
+logger = logging.getLogger('market.price_stats')
+
+RELATIVE_ACCURACY = 0.01  # Quantile estimates are within 1% of a real sold price
+BAND_QUANTILES = {'p10': 0.1, 'p50': 0.5, 'p90': 0.9}
+SNAPSHOT_CHECK_INTERVAL = 60  # Seconds between checks for updates written by other processes
+
+
+class PriceSketch:
+    """
+    DDSketch over non-negative prices.
+
+    A value x > 0 is counted in bucket ceil(log_gamma(x)); every value in a bucket
+    is within RELATIVE_ACCURACY of the bucket's estimate. Free items are counted apart.
+    """
+    gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    log_gamma = math.log(gamma)
+
+    def __init__(self, zero_count=0, bins=None):
+        self.zero_count = zero_count
+        self.bins = bins or {}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('zero', 0), {int(index): count for index, count in data.get('bins', {}).items()})
+
+    def to_dict(self):
+        return {'zero': self.zero_count, 'bins': {str(index): count for index, count in sorted(self.bins.items())}}
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.bins.values())
+
+    def add(self, value):
+        value = float(value)
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + 1
+
+    def merge(self, other):
+        self.zero_count += other.zero_count
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def quantile(self, q):
+        """Estimated q-quantile, or None for an empty sketch"""
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def band(self):
+        """{'count', 'p10', 'p50', 'p90'}, or None for an empty sketch"""
+        if not self.count:
+            return None
+        band = {'count': self.count}
+        for name, q in BAND_QUANTILES.items():
+            band[name] = round(self.quantile(q), 2)
+        return band
+
+
+def _category_with_ancestors(category_id):
+    ids = []
+    while category_id is not None:
+        ids.append(category_id)
+        category_id = Category.objects.filter(id=category_id).values_list('parent_id', flat=True).first()
+    return ids
+
+
+def record_price(category_id, kind, price):
+    """
+    Add one price to the category's and all its ancestors' sketches.
+
+    Args:
+        category_id: Category of the product, or None (ignored)
+        kind: 'sold' or 'accepted'
+        price: Decimal price
+    """
+    if category_id is None:
+        return
+    field = f'{kind}_sketch'
+    with transaction.atomic():
+        for stats_category_id in _category_with_ancestors(category_id):
+            stats, _ = CategoryPriceStats.objects.select_for_update().get_or_create(category_id=stats_category_id)
+            sketch = PriceSketch.from_dict(getattr(stats, field))
+            sketch.add(price)
+            setattr(stats, field, sketch.to_dict())
+            stats.save(update_fields=[field, 'updated_at'])
+        transaction.on_commit(price_bands.invalidate)
+
+
+def record_sale(order):
+    """Fold a paid order's price into its product category's price band"""
+    record_price(order.product.category_id, 'sold', order.price)
+
+
+def record_accepted_offer(offer):
+    """Fold an accepted offer's amount into its product category's price band"""
+    record_price(offer.product.category_id, 'accepted', offer.amount)
+
+
+class PriceBandSnapshot:
+    """
+    In-memory p10/p50/p90 per category, so autofill and listing views need no queries.
+    Reloaded when CategoryPriceStats rows changed (the payment poller runs in its own process).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self.bands = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < SNAPSHOT_CHECK_INTERVAL:
+            return
+        with self._lock:
+            self._checked_at = now
+            stats = CategoryPriceStats.objects.aggregate(count=Count('id'), latest=Max('updated_at'))
+            version = (stats['count'], stats['latest'])
+            if version != self._version:
+                self._load()
+                self._version = version
+
+    def _load(self):
+        bands = {}
+        for category_id, sold, accepted in CategoryPriceStats.objects.values_list(
+            'category_id', 'sold_sketch', 'accepted_sketch'
+        ):
+            bands[category_id] = {
+                'sold': PriceSketch.from_dict(sold).band(),
+                'accepted': PriceSketch.from_dict(accepted).band(),
+            }
+        self.bands = bands
+        logger.info('Price bands loaded for %s categories', len(bands))
+
+    def get(self, category_id):
+        """{'sold': band|None, 'accepted': band|None}, or None without any history"""
+        self._ensure_fresh()
+        return self.bands.get(category_id)
+
+    def suggested(self, category_id):
+        """
+        Band to suggest for a new listing: sold prices once there are enough,
+        otherwise accepted offers, otherwise None.
+        """
+        bands = self.get(category_id)
+        if not bands:
+            return None
+        for kind in ('sold', 'accepted'):
+            band = bands[kind]
+            if band and band['count'] >= settings.PRICE_BAND_MIN_SAMPLES:
+                return {**band, 'source': kind}
+        return None
+
+
+price_bands = PriceBandSnapshot()
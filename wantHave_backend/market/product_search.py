@@ -0,0 +1,156 @@
+"""
+Typo-tolerant product search.
+Titles and, with SEARCH_INDEX_DESCRIPTIONS, descriptions are cut into character
+trigrams (category_matcher.trigrams), kept in in-memory posting lists. A query
+matches a product when enough of its trigrams occur in the product's text, so a
+misspelled word still shares most of its trigrams with the real one.
+
+A product holding at least m = MIN_SIMILARITY * n of the n query trigrams holds
+one of the n - m + 1 rarest, so only those posting lists generate candidates.
+Generation stops at SEARCH_MAX_CANDIDATES products and the other trigrams are
+only checked against the candidates, so a query costs at most that many
+products times its trigrams, however common its words are. Matches are ranked
+by the share of query trigrams found, those only in the description counting
+DESCRIPTION_WEIGHT.
+"""
+import math
+import threading
+from collections import defaultdict
+from django.conf import settings
+
+from .category_matcher import trigrams
+from .models import Product
+
+MIN_SIMILARITY = 0.5  # Share of the query's trigrams a product must contain
+DESCRIPTION_WEIGHT = 0.5  # Rank weight of a trigram found only in the description
+
+
+class ProductSearchIndex:
+    """
+    Trigram posting lists of all products, built lazily from one query and kept
+    current by market.signals (and bulk imports) as products are saved and
+    deleted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.grams = {}
+        self.title_postings = defaultdict(set)
+        self.description_postings = defaultdict(set)
+        self.available = set()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self.grams = {}
+            self.title_postings = defaultdict(set)
+            self.description_postings = defaultdict(set)
+            self.available = set()
+            rows = Product.objects.values_list('id', 'title', 'description', 'status')
+            for row in rows.iterator(chunk_size=5000):
+                self._add(*row)
+            self._loaded = True
+
+    def _add(self, product_id, title, description, status):
+        title_grams = frozenset(trigrams(title))
+        description_grams = frozenset(
+            trigrams(description) - title_grams if settings.SEARCH_INDEX_DESCRIPTIONS and description else ()
+        )
+        self.grams[product_id] = (title_grams, description_grams)
+        for gram in title_grams:
+            self.title_postings[gram].add(product_id)
+        for gram in description_grams:
+            self.description_postings[gram].add(product_id)
+        if status == 'AVAILABLE':
+            self.available.add(product_id)
+
+    def _remove(self, product_id):
+        grams = self.grams.pop(product_id, None)
+        if grams is None:
+            return
+        for postings, product_grams in zip((self.title_postings, self.description_postings), grams):
+            for gram in product_grams:
+                posting = postings.get(gram)
+                if posting is not None:
+                    posting.discard(product_id)
+                    if not posting:
+                        del postings[gram]
+        self.available.discard(product_id)
+
+    def product_saved(self, product_id, title, description, status):
+        self.products_saved([(product_id, title, description, status)])
+
+    def products_saved(self, rows):
+        """Index (product id, title, description, status) rows, e.g. of a bulk import"""
+        with self._lock:
+            if not self._loaded:
+                return  # Picked up by the next load
+            for product_id, title, description, status in rows:
+                self._remove(product_id)
+                self._add(product_id, title, description, status)
+
+    def product_deleted(self, product_id):
+        with self._lock:
+            if self._loaded:
+                self._remove(product_id)
+
+    def search(self, query, limit=None, available_only=True, max_candidates=None):
+        """
+        Products matching a possibly misspelled query.
+
+        Args:
+            query: Search text
+            limit: Default settings.SEARCH_RESULT_LIMIT
+            available_only: Leave out sold products
+            max_candidates: Default settings.SEARCH_MAX_CANDIDATES
+
+        Returns:
+            List of (product id, score between 0 and 1), best first
+        """
+        limit = settings.SEARCH_RESULT_LIMIT if limit is None else limit
+        max_candidates = settings.SEARCH_MAX_CANDIDATES if max_candidates is None else max_candidates
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        required = math.ceil(MIN_SIMILARITY * len(query_grams))
+        self._ensure_loaded()
+        with self._lock:
+            postings = sorted(
+                ((self.title_postings.get(gram, ()), self.description_postings.get(gram, ())) for gram in query_grams),
+                key=lambda pair: len(pair[0]) + len(pair[1])
+            )
+            hits, scores = {}, {}  # Query trigrams found in each candidate; weighted by where
+            for rank, (title_posting, description_posting) in enumerate(postings):
+                for product_id in hits:
+                    if product_id in title_posting:
+                        hits[product_id] += 1
+                        scores[product_id] += 1
+                    elif product_id in description_posting:
+                        hits[product_id] += 1
+                        scores[product_id] += DESCRIPTION_WEIGHT
+                if rank > len(postings) - required:
+                    continue
+                # Rarest trigrams: every product matching well enough holds one of them
+                for weight, posting in ((1, title_posting), (DESCRIPTION_WEIGHT, description_posting)):
+                    for product_id in posting:
+                        if len(hits) >= max_candidates:
+                            break
+                        if product_id not in hits and (not available_only or product_id in self.available):
+                            hits[product_id] = 1
+                            scores[product_id] = weight
+        ranked = sorted(
+            ((product_id, scores[product_id] / len(query_grams)) for product_id, count in hits.items() if count >= required),
+            key=lambda match: (-match[1], -match[0])
+        )
+        return ranked[:limit]
+
+
+product_search_index = ProductSearchIndex()
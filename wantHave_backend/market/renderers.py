@@ -0,0 +1,66 @@
+"""
+API renderers.
+FastJSONRenderer is the default JSON renderer (see market.json_backend). The
+streaming renderers produce one self-contained record per render() call, so views
+can stream a response record by record and still return ordinary error Responses.
+"""
+import csv
+import io
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from . import json_backend
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer output through market.json_backend.
+    Indented output (?indent= in the Accept header) and non-default JSON settings use DRF's renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (
+            self.get_indent(accepted_media_type, renderer_context or {})
+            or self.ensure_ascii or not self.compact or not self.strict
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        return json_backend.dumps(data)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline-delimited JSON, one object per line"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json_backend.dumps(data) + b'\n'
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Server-sent events, one data event per object"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b'data: ' + json_backend.dumps(data) + b'\n\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """CSV with a header row; a single object renders as one row"""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        if not rows:
+            return b''
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=list(rows[0]), extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+        return output.getvalue().encode(self.charset)
@@ -0,0 +1,245 @@
+"""
+Saved searches, percolated against new listings.
+Instead of running every saved search whenever a product is listed, the searches
+are kept in an in-memory inverted index keyed by (category, geo tile). A new
+product looks up only the buckets of its category's ancestors and of its tile,
+plus the "any category" and "anywhere" buckets, and checks price, distance and
+keywords of those candidates. Matches are pushed to the users' notification
+groups on the channel layer.
+"""
+import asyncio
+import logging
+import math
+import threading
+from collections import defaultdict, namedtuple
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
+
+from . import geo_grid
+from .category_matcher import normalize_tokens
+from .models import Category, Product, SavedSearch
+from .watch_notifications import user_group
+
+logger = logging.getLogger('market.saved_searches')
+
+GEO_INDEX_ZOOM = 9  # ~78 km tiles at the equator, ~50 km in Central Europe
+MAX_SEARCH_TILES = 64  # Wider searches are indexed as "anywhere" and checked by distance only
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+IndexedSearch = namedtuple('IndexedSearch', [
+    'id', 'user_id', 'name', 'category_id', 'min_price', 'max_price',
+    'latitude', 'longitude', 'radius_km', 'keywords',
+])
+
+SEARCH_COLUMNS = (
+    'id', 'user_id', 'name', 'category_id', 'min_price', 'max_price',
+    'latitude', 'longitude', 'radius_km', 'keywords',
+)
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Great-circle (haversine) distance"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def search_tiles(latitude, longitude, radius_km):
+    """
+    Index tiles covering a search circle, or None when the search is not bounded
+    by location or covers more than MAX_SEARCH_TILES tiles.
+    """
+    if latitude is None or longitude is None or radius_km is None:
+        return None
+    lat_delta = radius_km / KM_PER_DEGREE
+    lng_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    bbox = (longitude - lng_delta, latitude - lat_delta, longitude + lng_delta, latitude + lat_delta)
+    if geo_grid.tile_count_in_bbox(*bbox, GEO_INDEX_ZOOM) > MAX_SEARCH_TILES:
+        return None
+    return geo_grid.tiles_in_bbox(*bbox, GEO_INDEX_ZOOM)
+
+
+def product_tile(product):
+    cell = geo_grid.cell_for(product.latitude, product.longitude)
+    return None if cell is None else geo_grid.tile_of_cell(cell, GEO_INDEX_ZOOM)
+
+
+def matches(search, product, tokens, category_ids):
+    """
+    Full predicate of a saved search.
+
+    Args:
+        search: IndexedSearch
+        product: Product (saved or not)
+        tokens: Normalized tokens of the product's title and description
+        category_ids: The product's category and its ancestors
+    """
+    if search.category_id is not None and search.category_id not in category_ids:
+        return False
+    if search.min_price is not None and product.price < search.min_price:
+        return False
+    if search.max_price is not None and product.price > search.max_price:
+        return False
+    if search.radius_km is not None and search.latitude is not None and search.longitude is not None:
+        if product.latitude is None or product.longitude is None:
+            return False
+        if distance_km(search.latitude, search.longitude, product.latitude, product.longitude) > search.radius_km:
+            return False
+    return search.keywords <= tokens
+
+
+class SavedSearchPercolator:
+    """
+    Index of all saved searches, built lazily from one query and kept current
+    by market.signals as searches are saved and deleted; category tree changes
+    rebuild it.
+
+    Buckets are keyed by (category id or None, tile or None); None stands for
+    "any category" and "anywhere".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='saved-searches')
+        self.searches = {}
+        self.buckets = defaultdict(set)
+        self.parents = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self.searches = {}
+            self.buckets = defaultdict(set)
+            self.parents = dict(Category.objects.values_list('id', 'parent_id'))
+            for row in SavedSearch.objects.values_list(*SEARCH_COLUMNS).iterator(chunk_size=2000):
+                self._add(self._indexed(row))
+            self._loaded = True
+
+    @staticmethod
+    def _indexed(row):
+        search = IndexedSearch(*row)
+        return search._replace(keywords=frozenset(normalize_tokens(search.keywords)))
+
+    @staticmethod
+    def _keys(search):
+        tiles = search_tiles(search.latitude, search.longitude, search.radius_km)
+        return [(search.category_id, tile) for tile in (tiles or [None])]
+
+    def _add(self, search):
+        self.searches[search.id] = search
+        for key in self._keys(search):
+            self.buckets[key].add(search.id)
+
+    def _remove(self, search_id):
+        search = self.searches.pop(search_id, None)
+        if search is None:
+            return
+        for key in self._keys(search):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(search_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def search_saved(self, search):
+        """Index a created or updated SavedSearch"""
+        with self._lock:
+            if not self._loaded:
+                return  # Picked up by the next load
+            self._remove(search.pk)
+            self._add(self._indexed([getattr(search, column) for column in SEARCH_COLUMNS]))
+
+    def search_deleted(self, search_id):
+        with self._lock:
+            if self._loaded:
+                self._remove(search_id)
+
+    def category_ids(self, category_id):
+        """The category and its ancestors"""
+        ids = []
+        while category_id is not None and category_id not in ids:
+            ids.append(category_id)
+            category_id = self.parents.get(category_id)
+        return ids
+
+    def candidates(self, product):
+        """Ids of the searches in the buckets a product falls into"""
+        self._ensure_loaded()
+        tiles = [None]
+        tile = product_tile(product)
+        if tile is not None:
+            tiles.append(tile)
+        with self._lock:
+            found = set()
+            for category_id in [None, *self.category_ids(product.category_id)]:
+                for tile in tiles:
+                    found.update(self.buckets.get((category_id, tile), ()))
+            return found
+
+    def match(self, product):
+        """Saved searches of other users matching a product, ordered by id"""
+        candidate_ids = self.candidates(product)
+        tokens = set(normalize_tokens(f'{product.title} {product.description}'))
+        with self._lock:
+            category_ids = set(self.category_ids(product.category_id))
+            found = [self.searches[search_id] for search_id in candidate_ids if search_id in self.searches]
+        return sorted(
+            (search for search in found if search.user_id != product.seller_id and matches(search, product, tokens, category_ids)),
+            key=lambda search: search.id
+        )
+
+    def products_created(self, product_ids):
+        """Percolate newly listed products in the background"""
+        self._executor.submit(self._run, list(product_ids))
+
+    def _run(self, product_ids):
+        close_old_connections()
+        try:
+            products = Product.objects.filter(pk__in=product_ids, status='AVAILABLE').only(
+                'id', 'seller_id', 'category_id', 'title', 'description', 'price', 'latitude', 'longitude', 'city'
+            )
+            events = []
+            for product in products:
+                by_user = defaultdict(list)
+                for search in self.match(product):
+                    by_user[search.user_id].append({'id': search.id, 'name': search.name})
+                events.extend((user_id, self._event(product, searches)) for user_id, searches in by_user.items())
+            if events:
+                async_to_sync(self._publish)(events)
+                logger.info('%s saved search notifications for products %s', len(events), product_ids)
+        except Exception:
+            logger.exception('Saved search percolation for products %s failed', product_ids)
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def _event(product, searches):
+        return {
+            'type': 'saved_search.match',
+            'searches': searches,
+            'product': {
+                'id': product.id, 'title': product.title, 'price': str(product.price),
+                'category_id': product.category_id, 'city': product.city,
+            },
+        }
+
+    @staticmethod
+    async def _publish(events):
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        await asyncio.gather(*(layer.group_send(user_group(user_id), event) for user_id, event in events))
+
+
+saved_search_percolator = SavedSearchPercolator()
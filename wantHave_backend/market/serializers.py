@@ -1,8 +1,12 @@
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth.models import User
-from .models import UserProfile, Product, Category, Order, Payment, WatchlistItem
+from django.utils.functional import cached_property
+from . import watchlist_cache
+from .engagement import engagement_counters
+from .models import UserProfile, Product, Category, Order, Payment, SavedSearch, WatchlistItem
 import re
+from decimal import Decimal
 
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=6)
@@ -57,13 +61,14 @@ class UserProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     active_listings_count = serializers.SerializerMethodField()
     sold_items_count = serializers.SerializerMethodField()
+    listing_engagement = serializers.SerializerMethodField()
 
     class Meta:
         model = UserProfile
         fields = [
             'id', 'user', 'profile_picture', 'city', 'zip_code', 'country',
             'latitude', 'longitude', 'address',
-            'active_listings_count', 'sold_items_count', 'member_since', 'updated_at'
+            'active_listings_count', 'sold_items_count', 'listing_engagement', 'member_since', 'updated_at'
         ]
         read_only_fields = ['id', 'member_since', 'updated_at']
 
@@ -73,6 +78,10 @@ class UserProfileSerializer(serializers.ModelSerializer):
     def get_sold_items_count(self, obj):
         return obj.user.products.filter(status='SOLD').count()
 
+    def get_listing_engagement(self, obj):
+        """Views, impressions and clicks summed over all of the user's listings"""
+        return engagement_counters.totals(obj.user.products.all())
+
 class UserProfileUpdateSerializer(serializers.ModelSerializer):
     first_name = serializers.CharField(source='user.first_name', required=False)
     last_name = serializers.CharField(source='user.last_name', required=False)
@@ -114,8 +123,64 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'parent']
         read_only_fields = ['id']
 
-class ProductSerializer(serializers.ModelSerializer):
-    seller_id = serializers.IntegerField(source='seller.id', read_only=True)
+def requested_fields(request, serializer_class):
+    """
+    Field names a request asks for: a named view (?view=card, see Meta.views),
+    narrowed by ?fields=a,b. Returns None when the request asks for everything.
+    """
+    if request is None:
+        return None
+    params = getattr(request, 'query_params', request.GET)
+    fields = None
+    view = params.get('view')
+    if view in getattr(serializer_class.Meta, 'views', {}):
+        fields = set(serializer_class.Meta.views[view])
+    names = {name.strip() for name in params.get('fields', '').split(',') if name.strip()}
+    if names:
+        fields = names if fields is None else fields & names
+    return fields
+
+
+class SparseFieldsetMixin:
+    """
+    Renders only the requested fields, passed as fields=[...] or taken from the
+    request in the serializer context (which also works when nested).
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        self._requested = fields
+        self._requested_resolved = fields is not None
+        super().__init__(*args, **kwargs)
+
+    @property
+    def _readable_fields(self):
+        if not self._requested_resolved:
+            # Resolved once per serializer; a many=True child is shared by all rows
+            self._requested = requested_fields(self.context.get('request'), type(self))
+            self._requested_resolved = True
+        for field in super()._readable_fields:
+            if self._requested is None or field.field_name in self._requested:
+                yield field
+
+
+class IsWatchedField(serializers.ReadOnlyField):
+    """Whether the requesting user watches the product, from their cached watched ids"""
+
+    def __init__(self, **kwargs):
+        super().__init__(source='id', **kwargs)
+
+    @cached_property
+    def watched_ids(self):
+        # Bound once per serializer; a many=True child is shared by all rows
+        request = self.context.get('request')
+        return watchlist_cache.watched_product_ids(getattr(request, 'user', None))
+
+    def to_representation(self, value):
+        return value in self.watched_ids
+
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    seller_id = serializers.IntegerField(read_only=True)
     seller_username = serializers.CharField(source='seller.username', read_only=True)
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
@@ -125,6 +190,7 @@ class ProductSerializer(serializers.ModelSerializer):
         required=False,
         allow_null=True
     )
+    is_watched = IsWatchedField()
 
     class Meta:
         model = Product
@@ -145,8 +211,55 @@ class ProductSerializer(serializers.ModelSerializer):
             'latitude',
             'longitude',
             'city',
+            'is_watched',
         ]
         read_only_fields = ['id', 'created_at', 'seller_id', 'seller_username', 'category', 'buyer', 'sold_at']
+        views = {
+            # Product lists and cards: no description, buyer or coordinates
+            'card': [
+                'id', 'title', 'price', 'image', 'status', 'created_at',
+                'seller_id', 'seller_username', 'category', 'city', 'is_watched'
+            ],
+        }
+        # Columns each field reads; 'a__b' columns are loaded with select_related('a')
+        field_columns = {
+            'seller_id': ['seller'],
+            'seller_username': ['seller', 'seller__username'],
+            'category': ['category', 'category__id', 'category__name', 'category__parent'],
+            'category_id': [],  # Write-only
+            'is_watched': ['id'],
+        }
+
+    @classmethod
+    def optimize_queryset(cls, queryset, fields=None):
+        """
+        Load only the columns the given fields read, joining seller and category
+        when they are rendered instead of querying them once per product.
+        """
+        names = [name for name in cls.Meta.fields if fields is None or name in fields]
+        columns = {'id'}
+        related = set()
+        for name in names:
+            for column in cls.Meta.field_columns.get(name, [name]):
+                columns.add(column)
+                if '__' in column:
+                    related.add(column.split('__')[0])
+        return queryset.select_related(*sorted(related)).only(*sorted(columns))
+
+class ProductImportRowSerializer(serializers.Serializer):
+    """
+    One row of a bulk product import (see market.bulk_products).
+    category is an id, a name or a 'Parent > Child' path; image is a stored path or a zip member.
+    """
+    title = serializers.CharField(max_length=200)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'))
+    category = serializers.CharField(required=False, allow_blank=True)
+    image = serializers.CharField(max_length=100)
+    latitude = serializers.FloatField(required=False, allow_null=True, min_value=-90, max_value=90)
+    longitude = serializers.FloatField(required=False, allow_null=True, min_value=-180, max_value=180)
+    city = serializers.CharField(required=False, allow_blank=True, max_length=100)
+
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     pass
@@ -190,6 +303,7 @@ class CheckoutSessionSerializer(serializers.Serializer):
     session_id = serializers.CharField()
     url = serializers.URLField()
     order_id = serializers.IntegerField()
+    reused = serializers.BooleanField(default=False)
 
 class WatchlistItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
@@ -203,3 +317,28 @@ class WatchlistItemSerializer(serializers.ModelSerializer):
         model = WatchlistItem
         fields = ['id', 'product', 'product_id', 'added_at']
         read_only_fields = ['id', 'added_at']
+
+
+class SavedSearchSerializer(serializers.ModelSerializer):
+    latitude = serializers.FloatField(required=False, allow_null=True, min_value=-90, max_value=90)
+    longitude = serializers.FloatField(required=False, allow_null=True, min_value=-180, max_value=180)
+    radius_km = serializers.FloatField(required=False, allow_null=True, min_value=0.1, max_value=20000)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'), required=False, allow_null=True)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'), required=False, allow_null=True)
+
+    class Meta:
+        model = SavedSearch
+        fields = [
+            'id', 'name', 'category', 'min_price', 'max_price',
+            'latitude', 'longitude', 'radius_km', 'keywords', 'created_at'
+        ]
+        read_only_fields = ['id', 'created_at']
+
+    def validate(self, attrs):
+        current = {field: getattr(self.instance, field, None) for field in ('min_price', 'max_price', 'latitude', 'longitude', 'radius_km')}
+        current.update(attrs)
+        if current['min_price'] is not None and current['max_price'] is not None and current['min_price'] > current['max_price']:
+            raise serializers.ValidationError({'max_price': 'Must not be lower than min_price.'})
+        if current['radius_km'] is not None and (current['latitude'] is None or current['longitude'] is None):
+            raise serializers.ValidationError({'radius_km': 'A radius needs latitude and longitude.'})
+        return attrs
@@ -1,8 +1,18 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from . import change_log, watchlist_cache
+from .category_matcher import category_matcher
+from .duplicate_images import duplicate_image_index
+from .map_clusters import invalidate_cells
+from .engagement import engagement_counters
+from .models import Category, Conversation, Offer, Product, SavedSearch, UserProfile, WatchlistItem
+from .product_search import product_search_index
+from .saved_searches import saved_search_percolator
+from .suggestions import suggestion_index
+from .watch_notifications import WATCHED_FIELDS, watcher_fanout
 
 class MarketConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
@@ -21,4 +31,125 @@ def create_user_profile(sender, instance, created, **kwargs):
 def save_user_profile(sender, instance, **kwargs):
     """Save the UserProfile when the User is saved"""
     if hasattr(instance, 'profile'):
-        instance.profile.save()
\ No newline at end of file
+        instance.profile.save()
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_matcher(sender, **kwargs):
+    """Rebuild the autofill category index and the saved search index after the category tree changes"""
+    category_matcher.invalidate()
+    saved_search_percolator.invalidate()
+    transaction.on_commit(suggestion_index.categories_changed)
+
+@receiver(pre_save, sender=Product)
+def remember_product_state(sender, instance, **kwargs):
+    """
+    Keep the stored grid cell, title, price and status: a moved product also clears
+    its old map tile, watchers hear about price drops and status changes, and
+    autocomplete swaps an old title for the new one.
+    """
+    instance._previous_grid_cell = None
+    instance._previous_title = None
+    instance._previous_state = None
+    if instance.pk:
+        stored = Product.objects.filter(pk=instance.pk).values_list('grid_cell', 'title', *WATCHED_FIELDS).first()
+        if stored:
+            instance._previous_grid_cell, instance._previous_title = stored[:2]
+            instance._previous_state = dict(zip(WATCHED_FIELDS, stored[2:]))
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_clusters(sender, instance, **kwargs):
+    """Drop cached map clusters of the tiles this product was and is in"""
+    invalidate_cells(getattr(instance, '_previous_grid_cell', None), instance.grid_cell)
+
+@receiver(post_save, sender=WatchlistItem)
+@receiver(post_delete, sender=WatchlistItem)
+def invalidate_watched_products(sender, instance, **kwargs):
+    """Drop the user's cached watched product ids once the change is committed"""
+    transaction.on_commit(lambda: watchlist_cache.invalidate(instance.user_id))
+
+@receiver(post_save, sender=Product)
+def notify_watchers(sender, instance, created, **kwargs):
+    """Queue watcher notifications after a committed price or status change"""
+    previous = getattr(instance, '_previous_state', None)
+    if created or not previous:
+        return
+    current = {field: Product._meta.get_field(field).to_python(getattr(instance, field)) for field in WATCHED_FIELDS}
+    changes = {
+        field: (previous[field], current[field])
+        for field in WATCHED_FIELDS if previous[field] != current[field]
+    }
+    if changes:
+        transaction.on_commit(lambda: watcher_fanout.product_changed(instance.pk, changes))
+
+@receiver(post_save, sender=Product)
+def percolate_saved_searches(sender, instance, created, **kwargs):
+    """Match a new listing against saved searches once it is committed"""
+    if created:
+        transaction.on_commit(lambda: saved_search_percolator.products_created([instance.pk]))
+
+@receiver(post_save, sender=Product)
+def index_product_image(sender, instance, **kwargs):
+    """Keep the duplicate photo index in step with the product's image hash and status"""
+    product_id, image_hash, status = instance.pk, instance.image_hash, instance.status
+    transaction.on_commit(lambda: duplicate_image_index.product_saved(product_id, image_hash, status))
+
+@receiver(post_delete, sender=Product)
+def unindex_product_image(sender, instance, **kwargs):
+    product_id = instance.pk  # Cleared by the time on_commit callbacks run
+    transaction.on_commit(lambda: duplicate_image_index.product_deleted(product_id))
+
+@receiver(post_save, sender=Product)
+def log_product_change(sender, instance, created, **kwargs):
+    """Append to the change log for client sync, in the saving transaction"""
+    previous = getattr(instance, '_previous_state', None)
+    change_log.record(instance, created, previous['status'] if previous else None)
+
+@receiver(post_delete, sender=Product)
+def log_product_deletion(sender, instance, **kwargs):
+    change_log.record_deleted(instance.pk)
+
+@receiver(post_save, sender=Product)
+def index_product_text(sender, instance, **kwargs):
+    """Keep the search trigrams in step with the product's title, description and status"""
+    row = (instance.pk, instance.title, instance.description, instance.status)
+    transaction.on_commit(lambda: product_search_index.product_saved(*row))
+
+@receiver(post_delete, sender=Product)
+def unindex_product_text(sender, instance, **kwargs):
+    product_id = instance.pk  # Cleared by the time on_commit callbacks run
+    transaction.on_commit(lambda: product_search_index.product_deleted(product_id))
+
+@receiver(post_save, sender=Product)
+def update_suggestions(sender, instance, **kwargs):
+    """Swap the autocomplete title of a product listed, renamed, sold or relisted"""
+    previous = getattr(instance, '_previous_state', None)
+    old = instance._previous_title if previous and previous['status'] == 'AVAILABLE' else None
+    new = instance.title if instance.status == 'AVAILABLE' else None
+    if old != new:
+        transaction.on_commit(lambda: suggestion_index.product_changed(old, new))
+
+@receiver(post_delete, sender=Product)
+def remove_suggestion(sender, instance, **kwargs):
+    if instance.status == 'AVAILABLE':
+        title = instance.title
+        transaction.on_commit(lambda: suggestion_index.product_changed(title, None))
+
+@receiver(post_save, sender=SavedSearch)
+def index_saved_search(sender, instance, **kwargs):
+    transaction.on_commit(lambda: saved_search_percolator.search_saved(instance))
+
+@receiver(post_delete, sender=SavedSearch)
+def unindex_saved_search(sender, instance, **kwargs):
+    search_id = instance.pk  # Cleared by the time on_commit callbacks run
+    transaction.on_commit(lambda: saved_search_percolator.search_deleted(search_id))
+
+@receiver(post_save, sender=WatchlistItem)
+@receiver(post_save, sender=Conversation)
+@receiver(post_save, sender=Offer)
+def count_trending_event(sender, instance, created, **kwargs):
+    """Add committed watchlist adds, product conversations and offers to the product's trending score"""
+    event = {WatchlistItem: 'watchlist_adds', Conversation: 'conversations', Offer: 'offers'}[sender]
+    if created and instance.product_id is not None:
+        transaction.on_commit(lambda: engagement_counters.record_trending(event, instance.product_id))
@@ -0,0 +1,282 @@
+"""
+Item-to-item "similar listings".
+The build_similar_listings command loads the catalog into NumPy arrays: a sparse
+(CSR) product x product co-occurrence matrix from users who watched or asked
+about several products, and L2-normalised TF-IDF title vectors. Each product's
+candidates are the products sharing a title term or a user with it, plus the
+same-category products nearest in price; the top NEIGHBOURS by combined score
+are stored as SimilarProduct rows, so the API serves them with one indexed read.
+"""
+import logging
+from collections import defaultdict
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .category_matcher import normalize_tokens
+from .models import Category, Conversation, Product, SimilarProduct, WatchlistItem
+
+logger = logging.getLogger('market.similar_listings')
+
+NEIGHBOURS = 12
+MAX_DOCUMENT_FREQUENCY = 0.05  # Title terms in a larger share of products add no candidates (they still score)
+COMMON_TERM_FLOOR = 100  # ...unless they are in at most this many products
+MAX_PRODUCTS_PER_USER = 50  # Most recent products per user counted as co-occurring
+CATEGORY_CANDIDATES = 40  # Same-category products nearest in price added as candidates
+WRITE_BATCH_SIZE = 500
+
+# The score is a weighted sum of signals in [0, 1]
+TEXT_WEIGHT = 0.45  # Cosine of the TF-IDF title vectors
+COOCCURRENCE_WEIGHT = 0.3  # Users in common / sqrt(users of each)
+CATEGORY_WEIGHT = 0.15  # 1 for the same category, 0.5 for a sibling
+PRICE_WEIGHT = 0.05  # 2 ** -|log2 of the price ratio|
+DISTANCE_WEIGHT = 0.05  # Halves every DISTANCE_HALF_KM, 0 without locations
+DISTANCE_HALF_KM = 25
+
+
+def _csr(rows, cols, data, shape_rows):
+    """CSR arrays (indptr, indices, data) from COO entries, duplicates summed"""
+    if not len(rows):
+        return np.zeros(shape_rows + 1, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    width = int(cols.max()) + 1
+    keys, inverse = np.unique(rows.astype(np.int64) * width + cols, return_inverse=True)
+    summed = np.bincount(inverse, weights=data)
+    key_rows = keys // width
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(key_rows, minlength=shape_rows))])
+    return indptr, keys % width, summed
+
+
+def _or_missing(value):
+    return -1 if value is None else value
+
+
+class SimilarityIndex:
+    """
+    Catalog arrays; row i describes product ids[i].
+
+    Args:
+        products: (id, title, category_id, price, latitude, longitude, status) tuples
+        parents: Dict category id -> parent id
+        interactions: (user id, product id) pairs, most recent first per user
+    """
+
+    def __init__(self, products, parents, interactions):
+        self.ids = np.array([row[0] for row in products], dtype=np.int64)
+        self.position = {product_id: index for index, product_id in enumerate(self.ids.tolist())}
+        count = len(self.ids)
+        self.available = np.array([row[6] == 'AVAILABLE' for row in products], dtype=bool)
+        # -1 stands for no category / a top-level category
+        self.category = np.array([_or_missing(row[2]) for row in products], dtype=np.int64)
+        self.parent = np.array([_or_missing(parents.get(row[2])) for row in products], dtype=np.int64)
+        self.log_price = np.log2(np.array([float(row[3]) for row in products], dtype=np.float64) + 1)
+        self.latitude = np.radians(np.array([row[4] if row[4] is not None else np.nan for row in products], dtype=np.float64))
+        self.longitude = np.radians(np.array([row[5] if row[5] is not None else np.nan for row in products], dtype=np.float64))
+
+        self._build_tfidf([row[1] for row in products], count)
+        self._build_cooccurrence(interactions, count)
+
+        # Same-category products sorted by price, for the price-window candidates
+        self.by_category = {}
+        order = np.lexsort((self.log_price, self.category))
+        boundaries = np.flatnonzero(np.diff(self.category[order])) + 1
+        for group in np.split(order, boundaries):
+            if len(group) and self.category[group[0]] != -1:
+                self.by_category[int(self.category[group[0]])] = group
+
+    def _build_tfidf(self, titles, count):
+        vocabulary = {}
+        rows, terms, counts = [], [], []
+        for index, title in enumerate(titles):
+            term_counts = defaultdict(int)
+            for token in normalize_tokens(title):
+                term_counts[vocabulary.setdefault(token, len(vocabulary))] += 1
+            for term, term_count in term_counts.items():
+                rows.append(index)
+                terms.append(term)
+                counts.append(term_count)
+        rows = np.array(rows, dtype=np.int64)
+        terms = np.array(terms, dtype=np.int64)
+        document_frequency = np.bincount(terms, minlength=len(vocabulary))
+        idf = np.log((1 + count) / (1 + document_frequency)) + 1
+        weights = (1 + np.log(np.array(counts, dtype=np.float64))) * idf[terms]
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=count))
+        weights /= norms[rows]
+
+        # Row-major (product -> terms) and column-major (term -> products) copies of the matrix
+        self.title_indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=count))])
+        self.title_terms, self.title_weights = terms, weights
+        order = np.argsort(terms, kind='stable')
+        self.term_indptr = np.concatenate([[0], np.cumsum(document_frequency)])
+        self.term_rows, self.term_weights = rows[order], weights[order]
+        self.candidate_terms = document_frequency <= max(MAX_DOCUMENT_FREQUENCY * count, COMMON_TERM_FLOOR)
+
+    def _build_cooccurrence(self, interactions, count):
+        per_user = defaultdict(list)
+        for user_id, product_id in interactions:
+            index = self.position.get(product_id)
+            products = per_user[user_id]
+            if index is not None and index not in products and len(products) < MAX_PRODUCTS_PER_USER:
+                products.append(index)
+        self.users = np.zeros(count)
+        rows, cols = [], []
+        for products in per_user.values():
+            products = np.array(products, dtype=np.int64)
+            self.users[products] += 1
+            if len(products) > 1:
+                pair_rows, pair_cols = np.meshgrid(products, products, indexing='ij')
+                mask = pair_rows != pair_cols
+                rows.append(pair_rows[mask])
+                cols.append(pair_cols[mask])
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        self.co_indptr, self.co_cols, co_counts = _csr(rows, cols, np.ones(len(rows)), count)
+        co_rows = np.repeat(np.arange(count), np.diff(self.co_indptr))
+        self.co_scores = co_counts / np.sqrt(self.users[co_rows] * self.users[self.co_cols]) if len(co_counts) else co_counts
+
+    def neighbours(self, index, count=NEIGHBOURS):
+        """
+        Most similar available products of row index.
+
+        Returns:
+            List of (row, score), best first
+        """
+        terms = self.title_terms[self.title_indptr[index]:self.title_indptr[index + 1]]
+        text_rows = [
+            self.term_rows[self.term_indptr[term]:self.term_indptr[term + 1]]
+            for term in terms if self.candidate_terms[term]
+        ]
+        co_rows = self.co_cols[self.co_indptr[index]:self.co_indptr[index + 1]]
+        co_values = self.co_scores[self.co_indptr[index]:self.co_indptr[index + 1]]
+
+        pools = text_rows + [co_rows]
+        group = self.by_category.get(int(self.category[index]))
+        if group is not None:
+            at = np.searchsorted(self.log_price[group], self.log_price[index])
+            pools.append(group[max(at - CATEGORY_CANDIDATES // 2, 0):at + CATEGORY_CANDIDATES // 2])
+        candidates = np.unique(np.concatenate(pools))
+        candidates = candidates[(candidates != index) & self.available[candidates]]
+        if not len(candidates):
+            return []
+
+        text = self._text_scores(index, candidates)
+        cooccurrence = np.zeros(len(candidates))
+        if len(co_rows):
+            at = np.searchsorted(candidates, co_rows)
+            found = (at < len(candidates)) & (candidates[np.minimum(at, len(candidates) - 1)] == co_rows)
+            cooccurrence[at[found]] = co_values[found]
+        category = np.where(
+            (self.category[candidates] == self.category[index]) & (self.category[index] != -1), 1.0,
+            np.where((self.parent[candidates] == self.parent[index]) & (self.parent[index] != -1), 0.5, 0.0)
+        )
+        price = np.exp2(-np.abs(self.log_price[candidates] - self.log_price[index]))
+        distance = np.nan_to_num(np.exp2(-self._distance_km(index, candidates) / DISTANCE_HALF_KM))
+
+        scores = (
+            TEXT_WEIGHT * text + COOCCURRENCE_WEIGHT * cooccurrence + CATEGORY_WEIGHT * category
+            + PRICE_WEIGHT * price + DISTANCE_WEIGHT * distance
+        )
+        best = np.lexsort((self.ids[candidates], -scores))[:count]
+        return [(int(candidates[row]), float(scores[row])) for row in best]
+
+    def _text_scores(self, index, candidates):
+        """Title cosine of row index with each candidate row"""
+        start, end = self.title_indptr[index], self.title_indptr[index + 1]
+        order = np.argsort(self.title_terms[start:end])
+        own_terms, own_weights = self.title_terms[start:end][order], self.title_weights[start:end][order]
+        if not len(own_terms):
+            return np.zeros(len(candidates))
+        # Gather the candidates' CSR rows into one flat slice
+        starts = self.title_indptr[candidates]
+        lengths = self.title_indptr[candidates + 1] - starts
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        entries = np.repeat(starts, lengths) + offsets
+        terms = self.title_terms[entries]
+        at = np.minimum(np.searchsorted(own_terms, terms), len(own_terms) - 1)
+        products = np.where(own_terms[at] == terms, own_weights[at] * self.title_weights[entries], 0.0)
+        return np.bincount(np.repeat(np.arange(len(candidates)), lengths), weights=products, minlength=len(candidates))
+
+    def _distance_km(self, index, candidates):
+        """Haversine distances; NaN where either location is missing"""
+        lat1, lng1 = self.latitude[index], self.longitude[index]
+        lat2, lng2 = self.latitude[candidates], self.longitude[candidates]
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+        return 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def load_index():
+    """SimilarityIndex of the whole catalog, from four queries"""
+    products = list(Product.objects.order_by('id').values_list(
+        'id', 'title', 'category_id', 'price', 'latitude', 'longitude', 'status'
+    ))
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    interactions = list(WatchlistItem.objects.order_by('user_id', '-added_at').values_list('user_id', 'product_id'))
+    # Buyers asking about a product; the seller takes part in every conversation about it
+    interactions += Conversation.participants.through.objects.filter(
+        conversation__product__isnull=False
+    ).exclude(user_id=F('conversation__product__seller_id')).order_by(
+        'user_id', '-conversation__created_at'
+    ).values_list('user_id', 'conversation__product_id')
+    return SimilarityIndex(products, parents, interactions)
+
+
+def stale_product_ids(index, since, new):
+    """
+    Products whose neighbours may have changed since the build at `since`:
+    new products, products with new watchers or conversations and their
+    co-occurring products, and products listing a neighbour that is no
+    longer available.
+
+    Args:
+        index: SimilarityIndex
+        since: Start of the last build
+        new: Ids of the products created since then
+    """
+    stale = set(new)
+    touched = set(WatchlistItem.objects.filter(added_at__gte=since).values_list('product_id', flat=True))
+    touched |= set(Conversation.objects.filter(created_at__gte=since, product__isnull=False).values_list('product_id', flat=True))
+    for product_id in touched & set(index.position):
+        row = index.position[product_id]
+        stale.add(product_id)
+        stale.update(index.ids[index.co_cols[index.co_indptr[row]:index.co_indptr[row + 1]]].tolist())
+    stale |= set(SimilarProduct.objects.exclude(neighbour__status='AVAILABLE').values_list('product_id', flat=True))
+    return stale
+
+
+def build(rebuild=False, batch_size=WRITE_BATCH_SIZE):
+    """
+    Refresh stored neighbours; all of them, or only stale ones after a previous build.
+    New products are also offered as neighbours to the products they are most similar to.
+
+    Args:
+        rebuild: Recompute every product's neighbours
+        batch_size: Products whose neighbours are replaced per transaction
+
+    Returns:
+        Tuple (products refreshed, products in the catalog)
+    """
+    started = timezone.now()
+    index = load_index()
+    last_build = None if rebuild else SimilarProduct.objects.aggregate(last=Max('built_at'))['last']
+    if last_build is None:
+        targets = set(index.position)
+    else:
+        new = set(Product.objects.filter(created_at__gte=last_build).values_list('id', flat=True)) & set(index.position)
+        targets = stale_product_ids(index, last_build, new)
+        for product_id in new:
+            targets.update(int(index.ids[row]) for row, _ in index.neighbours(index.position[product_id]))
+
+    targets = sorted(targets & set(index.position))
+    for start in range(0, len(targets), batch_size):
+        batch = targets[start:start + batch_size]
+        rows = [
+            SimilarProduct(product_id=product_id, neighbour_id=int(index.ids[row]), rank=rank,
+                           score=round(score, 6), built_at=started)
+            for product_id in batch
+            for rank, (row, score) in enumerate(index.neighbours(index.position[product_id]))
+        ]
+        with transaction.atomic():
+            SimilarProduct.objects.filter(product_id__in=batch).delete()
+            SimilarProduct.objects.bulk_create(rows)
+    logger.info('Refreshed similar listings of %s of %s products', len(targets), len(index.ids))
+    return len(targets), len(index.ids)
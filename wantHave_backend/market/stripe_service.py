@@ -5,10 +5,14 @@ Handles checkout session creation, webhook processing, and payment verification.
 
 import stripe
 from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal
 from typing import Optional, Dict, Any
 from .models import Order, Payment, Product, StripeWebhookEvent
+from .price_stats import record_sale
 
 # Initialize Stripe with secret key
 stripe.api_key = settings.STRIPE_SECRET_KEY
@@ -19,6 +23,11 @@ class StripeService:
 
     PLATFORM_FEE_PERCENTAGE = Decimal('0.10')  # 10% platform fee
 
+    # Stripe allows 30 minutes to 24 hours; shorter sessions keep PENDING orders short-lived
+    CHECKOUT_SESSION_LIFETIME = timedelta(hours=1)
+    # Don't hand out a session the buyer can't realistically finish paying
+    CHECKOUT_REUSE_MARGIN = timedelta(minutes=5)
+
     @staticmethod
     def calculate_fees(product_price: Decimal) -> Dict[str, Decimal]:
         """
@@ -38,6 +47,125 @@ class StripeService:
             'seller_amount': seller_amount.quantize(Decimal('0.01'))
         }
 
+    @staticmethod
+    def get_or_create_pending_order(product: Product, buyer_user, seller_user, price: Decimal) -> Order:
+        """
+        Return the open PENDING order for this buyer/product/price, creating it if needed.
+
+        The partial unique constraint on Order guarantees at most one such row, so
+        concurrent requests (double-clicks, retries) converge on the same order.
+        Orders whose checkout session has (almost) expired are cancelled and replaced,
+        once Stripe has expired the session so it can no longer be paid.
+
+        Returns:
+            Order in PENDING status
+
+        Raises:
+            stripe.error.StripeError: If the old session could not be expired
+        """
+        existing = Order.objects.filter(
+            buyer=buyer_user, product=product, price=price, status='PENDING'
+        ).first()
+
+        if existing is not None:
+            if StripeService.is_checkout_reusable(existing):
+                return existing
+            creating_since = timezone.now() - existing.created_at
+            if not existing.stripe_checkout_session_id and creating_since < StripeService.CHECKOUT_REUSE_MARGIN:
+                # Another request is creating its session right now
+                return existing
+            update_fields = ['status']
+            if existing.stripe_checkout_session_id:
+                StripeService.expire_checkout_session(existing.stripe_checkout_session_id)
+                existing.checkout_expires_at = timezone.now()
+                update_fields.append('checkout_expires_at')
+            existing.status = 'CANCELLED'
+            existing.save(update_fields=update_fields)
+
+        fees = StripeService.calculate_fees(price)
+        try:
+            with transaction.atomic():
+                return Order.objects.create(
+                    product=product,
+                    buyer=buyer_user,
+                    seller=seller_user,
+                    price=price,
+                    platform_fee=fees['platform_fee'],
+                    seller_amount=fees['seller_amount'],
+                    status='PENDING'
+                )
+        except IntegrityError:
+            # Lost the race against a concurrent request - use its order
+            return Order.objects.get(
+                buyer=buyer_user, product=product, price=price, status='PENDING'
+            )
+
+    @staticmethod
+    def expire_checkout_session(session_id: str) -> None:
+        """
+        Make sure a checkout session can no longer be paid.
+
+        Raises:
+            stripe.error.StripeError: If the session is still open or was completed
+        """
+        try:
+            stripe.checkout.Session.expire(session_id)
+        except stripe.error.InvalidRequestError:
+            # Stripe refuses to expire a session that is no longer open
+            if stripe.checkout.Session.retrieve(session_id).status != 'expired':
+                raise
+
+    @staticmethod
+    def is_checkout_reusable(order: Order) -> bool:
+        """Whether the order's checkout session is still open long enough to be handed out again"""
+        if not order.stripe_checkout_session_id or not order.stripe_checkout_url:
+            return False
+        expires_at = order.checkout_expires_at
+        if expires_at is None:
+            # Sessions created before expires_at was tracked use Stripe's 24h default
+            expires_at = order.created_at + timedelta(hours=24)
+        return expires_at - timezone.now() > StripeService.CHECKOUT_REUSE_MARGIN
+
+    @staticmethod
+    def _checkout_response(order: Order, reused: bool) -> Dict[str, Any]:
+        return {
+            'session_id': order.stripe_checkout_session_id,
+            'url': order.stripe_checkout_url,
+            'order_id': order.id,
+            'reused': reused
+        }
+
+    @staticmethod
+    def _create_session_for_order(order: Order, **session_params) -> Dict[str, Any]:
+        """
+        Create the Stripe Checkout session for a fresh order and store its reference.
+
+        The idempotency key is derived from the order, so a retried or concurrent
+        request for the same order gets the same session back from Stripe instead
+        of a new one. Stripe rejects a reused key with different parameters, so the
+        expiry is derived from the order as well.
+        """
+        expires_at = order.created_at + StripeService.CHECKOUT_SESSION_LIFETIME
+
+        try:
+            session = stripe.checkout.Session.create(
+                expires_at=int(expires_at.timestamp()),
+                idempotency_key=f'checkout-order-{order.id}',
+                **session_params
+            )
+        except stripe.error.StripeError:
+            # If Stripe fails, fail the order so it no longer blocks a new checkout
+            order.status = 'FAILED'
+            order.save(update_fields=['status'])
+            raise
+
+        order.stripe_checkout_session_id = session.id
+        order.stripe_checkout_url = session.url
+        order.checkout_expires_at = expires_at
+        order.save(update_fields=['stripe_checkout_session_id', 'stripe_checkout_url', 'checkout_expires_at'])
+
+        return StripeService._checkout_response(order, reused=False)
+
     @staticmethod
     def create_checkout_session(
         product: Product,
@@ -68,80 +196,55 @@ class StripeService:
         if product.seller == buyer_user:
             raise ValueError('Cannot purchase your own product')
 
-        # Calculate fees
-        fees = StripeService.calculate_fees(product.price)
-
-        # Create Order record
-        order = Order.objects.create(
-            product=product,
-            buyer=buyer_user,
-            seller=product.seller,
-            price=product.price,
-            platform_fee=fees['platform_fee'],
-            seller_amount=fees['seller_amount'],
-            status='PENDING'
+        order = StripeService.get_or_create_pending_order(
+            product, buyer_user, product.seller, product.price
         )
-
-        try:
-            # Get product image URL (handle both absolute and relative URLs)
-            product_images = []
-            if product.image:
-                image_url = product.image.url
-                # If it's a relative URL, we need to make it absolute
-                if not image_url.startswith('http'):
-                    # For production, you'd use your actual domain
-                    # For now, we'll skip the image if it's relative
-                    pass
-                else:
-                    product_images = [image_url]
-
-            # Create Stripe Checkout Session
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price_data': {
-                        'currency': 'eur',
-                        'unit_amount': int(product.price * 100),  # Convert to cents
-                        'product_data': {
-                            'name': product.title,
-                            'description': product.description[:500] if product.description else '',
-                        },
+        if StripeService.is_checkout_reusable(order):
+            return StripeService._checkout_response(order, reused=True)
+
+        # Get product image URL (handle both absolute and relative URLs)
+        product_images = []
+        if product.image:
+            image_url = product.image.url
+            # If it's a relative URL, we need to make it absolute
+            if not image_url.startswith('http'):
+                # For production, you'd use your actual domain
+                # For now, we'll skip the image if it's relative
+                pass
+            else:
+                product_images = [image_url]
+
+        return StripeService._create_session_for_order(
+            order,
+            payment_method_types=['card'],
+            line_items=[{
+                'price_data': {
+                    'currency': 'eur',
+                    'unit_amount': int(product.price * 100),  # Convert to cents
+                    'product_data': {
+                        'name': product.title,
+                        'description': product.description[:500] if product.description else '',
                     },
-                    'quantity': 1,
-                }],
-                mode='payment',
-                success_url=success_url,
-                cancel_url=cancel_url,
-                customer_email=buyer_user.email if buyer_user.email else None,
-                metadata={
+                },
+                'quantity': 1,
+            }],
+            mode='payment',
+            success_url=success_url,
+            cancel_url=cancel_url,
+            customer_email=buyer_user.email if buyer_user.email else None,
+            metadata={
+                'order_id': str(order.id),
+                'product_id': str(product.id),
+                'buyer_id': str(buyer_user.id),
+                'seller_id': str(product.seller.id),
+            },
+            payment_intent_data={
+                'metadata': {
                     'order_id': str(order.id),
                     'product_id': str(product.id),
-                    'buyer_id': str(buyer_user.id),
-                    'seller_id': str(product.seller.id),
-                },
-                payment_intent_data={
-                    'metadata': {
-                        'order_id': str(order.id),
-                        'product_id': str(product.id),
-                    }
                 }
-            )
-
-            # Update order with session ID
-            order.stripe_checkout_session_id = session.id
-            order.save(update_fields=['stripe_checkout_session_id'])
-
-            return {
-                'session_id': session.id,
-                'url': session.url,
-                'order_id': order.id
             }
-
-        except stripe.error.StripeError as e:
-            # If Stripe fails, cancel the order
-            order.status = 'FAILED'
-            order.save(update_fields=['status'])
-            raise
+        )
 
     @staticmethod
     def handle_checkout_session_completed(session_data: Dict[str, Any]) -> Optional[Order]:
@@ -180,6 +283,7 @@ class StripeService:
         product.buyer = order.buyer
         product.sold_at = timezone.now()
         product.save(update_fields=['status', 'buyer', 'sold_at'])
+        record_sale(order)
 
         # Update offer status if this was an offer-based purchase
         offer_id = metadata.get('offer_id')
@@ -232,11 +336,28 @@ class StripeService:
             # Payment might not exist yet if checkout.session.completed hasn't fired
             return None
 
+    @staticmethod
+    def pollable_orders(created_since):
+        """
+        Orders whose payment status may still change on Stripe: PENDING ones,
+        and CANCELLED ones whose session was not known to be expired, e.g.
+        duplicates cancelled by migration 0017.
+        """
+        return Order.objects.filter(
+            Q(status='PENDING') | Q(
+                Q(checkout_expires_at__isnull=True) | Q(checkout_expires_at__gt=timezone.now()),
+                status='CANCELLED', stripe_checkout_session_id__isnull=False
+            ),
+            created_at__gte=created_since
+        )
+
     @staticmethod
     def poll_checkout_session_status(order: Order) -> Dict[str, Any]:
         """
         Poll Stripe API for checkout session status and update order if paid.
         Used in VPN environments where webhooks cannot reach the backend.
+        CANCELLED orders are polled too while their session may still be paid
+        (see StripeService.pollable_orders).
 
         Args:
             order: Order object to check
@@ -269,7 +390,7 @@ class StripeService:
             payment_status = session.payment_status  # 'paid', 'unpaid', 'no_payment_required'
 
             # If paid, use existing handler for idempotent processing
-            if payment_status == 'paid' and order.status == 'PENDING':
+            if payment_status == 'paid' and order.status in ('PENDING', 'CANCELLED'):
                 StripeService.handle_checkout_session_completed(session)
                 return {
                     'order_id': order.id,
@@ -291,6 +412,11 @@ class StripeService:
                     'updated': True
                 }
 
+            # A cancelled order's session is settled once expired: stop polling it
+            elif session.status == 'expired' and order.status == 'CANCELLED':
+                order.checkout_expires_at = timezone.now()
+                order.save(update_fields=['checkout_expires_at'])
+
             # No change
             return {
                 'order_id': order.id,
@@ -345,74 +471,48 @@ class StripeService:
         if product.status != 'AVAILABLE':
             raise ValueError('Product is not available for purchase')
 
-        # Use offer amount for fees calculation
+        # Use offer amount, not product.price
         amount = offer.amount
-        fees = StripeService.calculate_fees(amount)
-
-        # Create Order record with offer amount
-        order = Order.objects.create(
-            product=product,
-            buyer=offer.buyer,
-            seller=offer.seller,
-            price=amount,  # Use offer amount, not product.price
-            platform_fee=fees['platform_fee'],
-            seller_amount=fees['seller_amount'],
-            status='PENDING'
+        order = StripeService.get_or_create_pending_order(
+            product, offer.buyer, offer.seller, amount
         )
-
-        try:
-            # Create Stripe Checkout Session
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price_data': {
-                        'currency': 'eur',
-                        'unit_amount': int(amount * 100),  # Convert to cents
-                        'product_data': {
-                            'name': product.title,
-                            'description': f'Negotiated price: €{amount} (Original: €{product.price})',
-                        },
+        if StripeService.is_checkout_reusable(order):
+            return StripeService._checkout_response(order, reused=True)
+
+        # Update offer status to PAID will happen in webhook handler
+        return StripeService._create_session_for_order(
+            order,
+            payment_method_types=['card'],
+            line_items=[{
+                'price_data': {
+                    'currency': 'eur',
+                    'unit_amount': int(amount * 100),  # Convert to cents
+                    'product_data': {
+                        'name': product.title,
+                        'description': f'Negotiated price: €{amount} (Original: €{product.price})',
                     },
-                    'quantity': 1,
-                }],
-                mode='payment',
-                success_url=success_url,
-                cancel_url=cancel_url,
-                customer_email=offer.buyer.email if offer.buyer.email else None,
-                metadata={
+                },
+                'quantity': 1,
+            }],
+            mode='payment',
+            success_url=success_url,
+            cancel_url=cancel_url,
+            customer_email=offer.buyer.email if offer.buyer.email else None,
+            metadata={
+                'order_id': str(order.id),
+                'product_id': str(product.id),
+                'offer_id': str(offer.id),
+                'buyer_id': str(offer.buyer.id),
+                'seller_id': str(offer.seller.id),
+            },
+            payment_intent_data={
+                'metadata': {
                     'order_id': str(order.id),
                     'product_id': str(product.id),
                     'offer_id': str(offer.id),
-                    'buyer_id': str(offer.buyer.id),
-                    'seller_id': str(offer.seller.id),
-                },
-                payment_intent_data={
-                    'metadata': {
-                        'order_id': str(order.id),
-                        'product_id': str(product.id),
-                        'offer_id': str(offer.id),
-                    }
                 }
-            )
-
-            # Update order with session ID
-            order.stripe_checkout_session_id = session.id
-            order.save(update_fields=['stripe_checkout_session_id'])
-
-            # Update offer status to PAID will happen in webhook handler
-            # For now, we just return the checkout URL
-
-            return {
-                'session_id': session.id,
-                'url': session.url,
-                'order_id': order.id
             }
-
-        except stripe.error.StripeError as e:
-            # If Stripe fails, cancel the order
-            order.status = 'FAILED'
-            order.save(update_fields=['status'])
-            raise
+        )
 
     @staticmethod
     def verify_webhook_signature(payload: bytes, sig_header: str) -> Dict[str, Any]:
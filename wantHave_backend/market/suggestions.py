@@ -0,0 +1,421 @@
+"""
+Search box autocomplete from a memory-mapped prefix index.
+Suggestions are the normalized titles of available listings (one per distinct
+title, weighted by listings, watchers and clicks) and category names (weighted
+by the listings under them). Every word start of a suggestion is a key; the
+keys are a sorted fixed-width byte array, so a prefix is a binary search to a
+range of keys. The top suggestions of every prefix of up to SHORT_PREFIX_BYTES
+bytes are precomputed, because those ranges are the largest.
+
+The arrays are written to one snapshot file (SUGGEST_INDEX_PATH) that every
+worker process maps read-only, sharing the pages; a process reloads it when the
+file is replaced. Product saves and deletes are applied to a small in-process
+overlay right away and make the process rebuild the snapshot in the background,
+at most every SUGGEST_REBUILD_INTERVAL seconds.
+
+market.signals imports this module at startup, so numpy is only imported by
+the functions that build or read the arrays.
+"""
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count
+
+from .category_matcher import TOKEN_RE
+from .models import Category, Product, ProductEngagement, WatchlistItem
+
+logger = logging.getLogger('market.suggestions')
+
+MAX_SUGGESTIONS = 20
+KEY_BYTES = 32  # Keys are cut to this many UTF-8 bytes
+MAX_KEY_WORDS = 4  # Keys start at each of the first words of a suggestion
+SHORT_PREFIX_BYTES = 3  # Prefixes up to this long are answered from precomputed lists
+RELOAD_CHECK_INTERVAL = 2  # Seconds between checks for a replaced snapshot file
+
+# Popularity of a title suggestion, summed over its available listings
+LISTING_WEIGHT = 1
+WATCHER_WEIGHT = 1
+CLICK_WEIGHT = 0.1
+
+TITLE, CATEGORY = 0, 1
+KINDS = {TITLE: 'title', CATEGORY: 'category'}
+
+MAGIC = b'WHSUGG1\n'
+ALIGNMENT = 64
+
+
+def normalize(text):
+    """Lowercase words without accents, separated by single spaces"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ' '.join(TOKEN_RE.findall(''.join(char for char in text if not unicodedata.combining(char))))
+
+
+def _aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def _key(text):
+    return text.encode()[:KEY_BYTES]
+
+
+def build_arrays():
+    """Snapshot arrays of the current catalog"""
+    return index_arrays(*catalog_suggestions())
+
+
+def catalog_suggestions():
+    """
+    Suggestions of the current catalog.
+
+    Returns:
+        Lists texts, kinds, category ids (-1 for titles), weights and available listings
+    """
+    watchers = dict(WatchlistItem.objects.values('product_id').annotate(count=Count('id')).values_list('product_id', 'count'))
+    clicks = dict(ProductEngagement.objects.filter(clicks__gt=0).values_list('product_id', 'clicks'))
+    texts, kinds, category_ids, weights, listings = [], [], [], [], []
+    by_title = {}
+    listings_per_category = defaultdict(int)
+    for product_id, title, category_id in Product.objects.filter(status='AVAILABLE').values_list(
+        'id', 'title', 'category_id'
+    ).iterator(chunk_size=5000):
+        if category_id is not None:
+            listings_per_category[category_id] += 1
+        normalized = normalize(title)
+        if not normalized:
+            continue
+        weight = LISTING_WEIGHT + WATCHER_WEIGHT * watchers.get(product_id, 0) + CLICK_WEIGHT * clicks.get(product_id, 0)
+        index = by_title.get(normalized)
+        if index is None:
+            by_title[normalized] = len(texts)
+            texts.append(title.strip())
+            kinds.append(TITLE)
+            category_ids.append(-1)
+            weights.append(weight)
+            listings.append(1)
+        else:
+            weights[index] += weight
+            listings[index] += 1
+
+    # Categories count the listings of their whole subtree
+    categories = list(Category.objects.values_list('id', 'name', 'parent_id'))
+    parents = {category_id: parent_id for category_id, _, parent_id in categories}
+    subtree_listings = defaultdict(int)
+    for category_id, count in listings_per_category.items():
+        seen = set()
+        while category_id is not None and category_id not in seen:
+            seen.add(category_id)
+            subtree_listings[category_id] += count
+            category_id = parents.get(category_id)
+    for category_id, name, _ in categories:
+        if normalize(name):
+            texts.append(name)
+            kinds.append(CATEGORY)
+            category_ids.append(category_id)
+            weights.append(LISTING_WEIGHT * subtree_listings[category_id])
+            listings.append(subtree_listings[category_id])
+    return texts, kinds, category_ids, weights, listings
+
+
+def index_arrays(texts, kinds, category_ids, weights, listings):
+    """Snapshot arrays of suggestions: their data, sorted keys and short prefix lists"""
+    import numpy as np
+
+    keys, key_suggestions = [], []
+    for index, text in enumerate(texts):
+        words = normalize(text).split(' ')
+        for start in range(min(len(words), MAX_KEY_WORDS)):
+            keys.append(_key(' '.join(words[start:])))
+            key_suggestions.append(index)
+    keys = np.array(keys, dtype=f'S{KEY_BYTES}')
+    order = np.argsort(keys, kind='stable')
+    arrays = {
+        'keys': keys[order],
+        'key_suggestions': np.array(key_suggestions, dtype=np.int32)[order],
+        'weights': np.array(weights, dtype=np.float32),
+        'listings': np.array(listings, dtype=np.int32),
+        'kinds': np.array(kinds, dtype=np.int8),
+        'category_ids': np.array(category_ids, dtype=np.int32),
+    }
+    # Position of each suggestion by weight, then index: ties never need a second sort key
+    by_weight = np.lexsort((np.arange(len(weights)), -arrays['weights']))
+    arrays['ranks'] = np.empty(len(weights), dtype=np.int32)
+    arrays['ranks'][by_weight] = np.arange(len(weights), dtype=np.int32)
+    encoded = [text.encode() for text in texts]
+    arrays['text_offsets'] = np.concatenate([[0], np.cumsum([len(text) for text in encoded], dtype=np.int64)])
+    arrays['text_bytes'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    arrays.update(_short_prefix_arrays(arrays))
+    return arrays
+
+
+def _top(suggestions, ranks, count):
+    """Best `count` distinct suggestions of an index array, by rank"""
+    import numpy as np
+
+    # A suggestion has at most MAX_KEY_WORDS keys in a range, so the best distinct
+    # ones are among the best this many entries
+    keep = count * MAX_KEY_WORDS
+    if len(suggestions) > keep:
+        entry_ranks = ranks[suggestions]
+        suggestions = suggestions[entry_ranks <= np.partition(entry_ranks, keep - 1)[keep - 1]]
+    suggestions = np.unique(suggestions)
+    return suggestions[np.argsort(ranks[suggestions])][:count]
+
+
+def _short_prefix_arrays(arrays):
+    import numpy as np
+
+    keys, key_suggestions, ranks = arrays['keys'], arrays['key_suggestions'], arrays['ranks']
+    prefixes, lists = [], []
+    for length in range(1, SHORT_PREFIX_BYTES + 1):
+        cut = keys.astype(f'S{length}')
+        starts = np.concatenate([[0], np.flatnonzero(cut[1:] != cut[:-1]) + 1]) if len(cut) else []
+        ends = np.append(starts[1:], len(cut)) if len(cut) else []
+        for start, end in zip(starts, ends):
+            prefixes.append(cut[start])
+            lists.append(_top(key_suggestions[start:end], ranks, MAX_SUGGESTIONS))
+    prefixes = np.array(prefixes, dtype=f'S{SHORT_PREFIX_BYTES}')
+    order = np.argsort(prefixes, kind='stable')
+    lengths = np.array([len(lists[index]) for index in order], dtype=np.int64)
+    return {
+        'short_prefixes': prefixes[order],
+        'short_offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        'short_suggestions': (np.concatenate([lists[index] for index in order]) if lists else np.zeros(0)).astype(np.int32),
+    }
+
+
+def write_snapshot(path, arrays, built_at):
+    """Write the arrays to path atomically; mapped copies of the old file stay valid"""
+    import numpy as np
+
+    header, offset = {'built_at': built_at, 'arrays': {}}, 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += _aligned(array.nbytes)
+    header_bytes = json.dumps(header).encode()
+    data_start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.suggest-')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(MAGIC + len(header_bytes).to_bytes(8, 'little') + header_bytes)
+            for name, array in arrays.items():
+                file.seek(data_start + header['arrays'][name]['offset'])
+                file.write(np.ascontiguousarray(array).tobytes())
+            file.truncate(data_start + offset)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class Snapshot:
+    """Read-only arrays mapped from a snapshot file"""
+
+    def __init__(self, path):
+        import numpy as np
+
+        with open(path, 'rb') as file:
+            self.stat = os.fstat(file.fileno())
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a suggestion index snapshot')
+        header_length = int.from_bytes(self._map[len(MAGIC):len(MAGIC) + 8], 'little')
+        header = json.loads(self._map[len(MAGIC) + 8:len(MAGIC) + 8 + header_length])
+        data_start = _aligned(len(MAGIC) + 8 + header_length)
+        self.built_at = header['built_at']
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape'], dtype=np.int64))
+            setattr(self, name, np.frombuffer(self._map, dtype=dtype, count=count, offset=data_start + spec['offset']))
+
+    def text(self, index):
+        return bytes(self.text_bytes[self.text_offsets[index]:self.text_offsets[index + 1]]).decode()
+
+    def lookup(self, prefix, count):
+        """
+        Best suggestions for a normalized prefix.
+
+        Returns:
+            Array of suggestion indexes, best first
+        """
+        import numpy as np
+
+        key = _key(prefix)
+        if len(key) <= SHORT_PREFIX_BYTES:
+            at = np.searchsorted(self.short_prefixes, key)
+            if at == len(self.short_prefixes) or self.short_prefixes[at] != key:
+                return self.short_suggestions[:0]
+            return self.short_suggestions[self.short_offsets[at]:self.short_offsets[at + 1]][:count]
+        start = np.searchsorted(self.keys, key, side='left')
+        if len(key) == KEY_BYTES:
+            end = np.searchsorted(self.keys, key, side='right')  # Longer keys are cut to this one
+        else:
+            end = np.searchsorted(self.keys, key + b'\xff', side='left')  # 0xff never occurs in UTF-8
+        return _top(self.key_suggestions[start:end], self.ranks, count)
+
+
+class SuggestionIndex:
+    """
+    The mapped snapshot plus this process's changes since it was built. Each
+    overlay entry is (time, normalized title, title, listings gained or lost).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='suggestions')
+        self._snapshot = None
+        self._checked_at = 0
+        self._overlay = []
+        self._dirty = False
+        self._rebuilding = False
+        self._rebuilt_at = None
+
+    def invalidate(self):
+        """Forget the mapped snapshot and pending changes, e.g. after the settings changed"""
+        with self._lock:
+            self._snapshot = None
+            self._overlay = []
+            self._dirty = False
+
+    def rebuild(self):
+        """Build a snapshot from the database, write it and map it"""
+        built_at = time.time()
+        arrays = build_arrays()
+        write_snapshot(settings.SUGGEST_INDEX_PATH, arrays, built_at)
+        self._load(force=True)
+        logger.info('Suggestion index rebuilt: %s suggestions, %s keys', len(arrays['weights']), len(arrays['keys']))
+
+    def _load(self, force=False):
+        """Map the snapshot file if it was replaced; builds it when there is none"""
+        now = time.monotonic()
+        if not force and self._snapshot is not None and now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        with self._load_lock:
+            self._checked_at = now
+            path = settings.SUGGEST_INDEX_PATH
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.rebuild()
+                return
+            current = self._snapshot
+            if current is not None and (current.stat.st_ino, current.stat.st_mtime_ns) == (stat.st_ino, stat.st_mtime_ns):
+                return
+            snapshot = Snapshot(path)
+            with self._lock:
+                self._snapshot = snapshot
+                # Changes committed before the build started are in the snapshot
+                self._overlay = [change for change in self._overlay if change[0] >= snapshot.built_at]
+                self._dirty = bool(self._overlay)
+
+    def suggest(self, prefix, count=8):
+        """
+        Suggestions for what the user has typed so far.
+
+        Returns:
+            List of dicts with text, kind ('title' or 'category') and, for categories, category_id
+        """
+        prefix = normalize(prefix) + (' ' if prefix[-1:].isspace() else '')
+        if not prefix.strip():
+            return []
+        self._load()
+        self._maybe_rebuild()
+        with self._lock:
+            snapshot, overlay = self._snapshot, list(self._overlay)
+
+        changes = defaultdict(int)  # Listings gained or lost per normalized title
+        titles = {}
+        for _, normalized, title, change in overlay:
+            changes[normalized] += change
+            titles[normalized] = title
+        found = {}
+        # Extra rows make up for titles the overlay removes
+        for index in snapshot.lookup(prefix, count + len(changes)).tolist():
+            text = snapshot.text(index)
+            kind = int(snapshot.kinds[index])
+            normalized = normalize(text)
+            change = changes.pop(normalized, 0) if kind == TITLE else 0
+            if kind == TITLE and snapshot.listings[index] + change <= 0:
+                continue  # Its last listing was sold, renamed or deleted
+            item = {'text': text, 'kind': KINDS[kind]}
+            if kind == CATEGORY:
+                item['category_id'] = int(snapshot.category_ids[index])
+            found[(kind, normalized)] = (float(snapshot.weights[index]) + LISTING_WEIGHT * change, item)
+        for normalized, change in changes.items():
+            words = normalized.split(' ')
+            if change > 0 and any(' '.join(words[start:]).startswith(prefix) for start in range(len(words))):
+                found.setdefault((TITLE, normalized), (LISTING_WEIGHT * change, {'text': titles[normalized], 'kind': 'title'}))
+        ranked = sorted(found.values(), key=lambda entry: (-entry[0], entry[1]['text']))
+        return [item for _, item in ranked[:count]]
+
+    def product_changed(self, old, new):
+        """
+        Apply a committed product change.
+
+        Args:
+            old: Title of the product as an available listing before the change, or None
+            new: Its title as an available listing after the change, or None
+        """
+        if old != new:
+            self._apply([(old, -1), (new, 1)])
+
+    def products_listed(self, titles):
+        """Apply committed new listings, e.g. of a bulk import"""
+        self._apply([(title, 1) for title in titles])
+
+    def _apply(self, changes):
+        now = time.time()
+        with self._lock:
+            if self._snapshot is None:
+                return  # Nothing mapped yet: the first lookup loads a current snapshot
+            for title, change in changes:
+                if title and normalize(title):
+                    self._overlay.append((now, normalize(title), title.strip(), change))
+            self._dirty = True
+        self._maybe_rebuild()
+
+    def categories_changed(self):
+        """Category names or the tree changed; rebuild soon"""
+        with self._lock:
+            if self._snapshot is None:
+                return
+            self._dirty = True
+        self._maybe_rebuild()
+
+    def _maybe_rebuild(self):
+        with self._lock:
+            due = self._dirty and not self._rebuilding and (
+                self._rebuilt_at is None or time.monotonic() - self._rebuilt_at >= settings.SUGGEST_REBUILD_INTERVAL
+            )
+            if due:
+                self._rebuilding = True
+        if due:
+            self._executor.submit(self._run_rebuild)
+
+    def _run_rebuild(self):
+        close_old_connections()
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Rebuilding the suggestion index failed')
+        finally:
+            with self._lock:
+                self._rebuilding = False
+                self._rebuilt_at = time.monotonic()
+            close_old_connections()
+
+
+suggestion_index = SuggestionIndex()
@@ -1,16 +1,62 @@
 """
-Unit tests for AI autofill feature.
-Uses mocking to avoid consuming actual API quota.
+Unit tests for the market app.
+Uses mocking to avoid consuming actual AI quota or Stripe API calls.
 """
 from unittest.mock import patch, MagicMock
-from django.test import TestCase
+from collections import defaultdict
+from concurrent.futures import Future
+from datetime import timedelta
+import datetime
+from decimal import Decimal
+from io import StringIO
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
-from rest_framework.test import APIClient
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework import status
 from io import BytesIO
 from PIL import Image
+import stripe
 
-from .models import Category
+from . import change_log, geo_grid, image_hashing, json_backend
+from .ai_jobs import autofill_jobs
+from .ai_service import QuotaLimiter, build_autofill_suggestion, prepare_image_for_model, quota_limiter
+from .category_matcher import category_matcher
+from .duplicate_images import DuplicateImageIndex, duplicate_image_index
+from .engagement import COUNTERS, TRENDING_HALF_LIFE, EngagementCounters, engagement_counters, log2_add, trending_value
+from .fast_serializers import compile_serializer, serialize_queryset
+from .models import (
+    AutofillCacheEntry, Category, CategoryPriceStats, Conversation, Message, Offer, Order, Product, ProductChange,
+    ProductEmbedding, ProductEngagement, SavedSearch, SimilarProduct, WatchlistItem
+)
+from .offline_classifier import catalog_index
+from .parsers import FastJSONParser
+from .price_stats import RELATIVE_ACCURACY, PriceSketch, price_bands
+from .product_search import product_search_index
+from .saved_searches import saved_search_percolator
+from .similar_listings import build as build_similar_listings
+from .suggestions import SuggestionIndex, suggestion_index
+from .watch_notifications import WatcherFanout, watcher_fanout
+from .renderers import FastJSONRenderer
+from .serializers import ProductSerializer, WatchlistItemSerializer
+from .stripe_service import StripeService
 
 
 class AIAutofillTestCase(TestCase):
@@ -85,9 +131,8 @@ class AIAutofillTestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
     @patch('market.ai_service.analyze_product_image')
-    def test_ai_autofill_creates_new_category(self, mock_analyze):
-        """Test that a new category is created if it doesn't exist."""
-        # Mock the function return value with a new category
+    def test_ai_autofill_does_not_create_category(self, mock_analyze):
+        """Test that an unknown category suggestion is left unmatched instead of created."""
         mock_analyze.return_value = {
             'title': 'Test Product',
             'description': 'Test description',
@@ -95,9 +140,7 @@ class AIAutofillTestCase(TestCase):
             'price_min': 10,
             'price_max': 20
         }
-
-        # Ensure category doesn't exist
-        self.assertFalse(Category.objects.filter(name='NewTestCategory').exists())
+        category_count = Category.objects.count()
 
         image = self._create_test_image()
         response = self.client.post(
@@ -107,8 +150,28 @@ class AIAutofillTestCase(TestCase):
         )
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        # Category should now exist
-        self.assertTrue(Category.objects.filter(name='NewTestCategory').exists())
+        self.assertIsNone(response.data['category_id'])
+        self.assertEqual(Category.objects.count(), category_count)
+        self.assertFalse(Category.objects.filter(name='NewTestCategory').exists())
+
+    @patch('market.ai_service.analyze_product_image')
+    def test_ai_autofill_matches_existing_leaf_category(self, mock_analyze):
+        """Test that a loosely worded suggestion maps to the closest seeded leaf category."""
+        mock_analyze.return_value = {
+            'title': 'Phone', 'description': '', 'category_suggestion': 'smartphone',
+            'price_min': 100, 'price_max': 200
+        }
+
+        response = self.client.post(
+            '/api/market/products/autofill/',
+            {'image': self._create_test_image()},
+            format='multipart'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['category_id'], Category.objects.get(name='Smartphones').id)
+        self.assertEqual(response.data['category_name'], 'Smartphones')
+        self.assertGreaterEqual(response.data['category_confidence'], 0.9)
 
     @patch('market.ai_service.analyze_product_image')
     def test_ai_autofill_api_error(self, mock_analyze):
@@ -125,3 +188,2258 @@ class AIAutofillTestCase(TestCase):
 
         self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
         self.assertIn('error', response.data)
+
+
+class CheckoutSessionReuseTestCase(TestCase):
+    """Test cases for checkout session reuse and order idempotency."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.buyer = User.objects.create_user(username='buyer', password='testpass123')
+        self.product = Product.objects.create(
+            seller=self.seller,
+            title='Bike',
+            description='City bike',
+            price=Decimal('120.00'),
+            image='product_images/bike.jpg'
+        )
+        self.client.force_authenticate(user=self.buyer)
+        self.url = f'/api/market/products/{self.product.id}/create_checkout_session/'
+        self.payload = {
+            'success_url': 'http://localhost:4200/checkout/success',
+            'cancel_url': 'http://localhost:4200/checkout/cancel'
+        }
+
+    def _mock_session(self, mock_create, session_id='cs_test_1'):
+        mock_create.return_value = MagicMock(id=session_id, url=f'https://checkout.stripe.com/{session_id}')
+
+    @patch('market.stripe_service.stripe.checkout.Session.create')
+    def test_repeated_checkout_reuses_open_session(self, mock_create):
+        """A second checkout for the same product returns the open session without calling Stripe."""
+        self._mock_session(mock_create)
+
+        first = self.client.post(self.url, self.payload, format='json')
+        second = self.client.post(self.url, self.payload, format='json')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertTrue(second.data['reused'])
+        self.assertEqual(first.data['order_id'], second.data['order_id'])
+        self.assertEqual(second.data['session_id'], 'cs_test_1')
+        self.assertEqual(mock_create.call_count, 1)
+        self.assertEqual(Order.objects.filter(status='PENDING').count(), 1)
+
+    @patch('market.stripe_service.stripe.checkout.Session.create')
+    def test_checkout_passes_order_idempotency_key(self, mock_create):
+        """Stripe receives an idempotency key derived from the order."""
+        self._mock_session(mock_create)
+
+        response = self.client.post(self.url, self.payload, format='json')
+
+        kwargs = mock_create.call_args.kwargs
+        self.assertEqual(kwargs['idempotency_key'], f"checkout-order-{response.data['order_id']}")
+        self.assertIn('expires_at', kwargs)
+
+    @patch('market.stripe_service.stripe.checkout.Session.expire')
+    @patch('market.stripe_service.stripe.checkout.Session.create')
+    def test_expired_session_is_replaced(self, mock_create, mock_expire):
+        """An order whose session has (almost) expired is cancelled once Stripe expired the session."""
+        self._mock_session(mock_create)
+        first = self.client.post(self.url, self.payload, format='json')
+        Order.objects.filter(id=first.data['order_id']).update(
+            checkout_expires_at=timezone.now() + timedelta(minutes=1)
+        )
+
+        self._mock_session(mock_create, session_id='cs_test_2')
+        second = self.client.post(self.url, self.payload, format='json')
+
+        mock_expire.assert_called_once_with('cs_test_1')
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(first.data['order_id'], second.data['order_id'])
+        self.assertEqual(Order.objects.get(id=first.data['order_id']).status, 'CANCELLED')
+        self.assertEqual(Order.objects.filter(status='PENDING').count(), 1)
+
+    @patch('market.stripe_service.stripe.checkout.Session.retrieve')
+    @patch('market.stripe_service.stripe.checkout.Session.expire')
+    @patch('market.stripe_service.stripe.checkout.Session.create')
+    def test_session_that_cannot_be_expired_keeps_its_order(self, mock_create, mock_expire, mock_retrieve):
+        """A session Stripe refuses to expire (e.g. just paid) is not cancelled; an already expired one is."""
+        self._mock_session(mock_create)
+        first = self.client.post(self.url, self.payload, format='json')
+        Order.objects.filter(id=first.data['order_id']).update(
+            checkout_expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        mock_expire.side_effect = stripe.error.InvalidRequestError('Session is not open', None)
+
+        mock_retrieve.return_value = MagicMock(status='complete')
+        response = self.client.post(self.url, self.payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(Order.objects.get(id=first.data['order_id']).status, 'PENDING')
+
+        mock_retrieve.return_value = MagicMock(status='expired')
+        self._mock_session(mock_create, session_id='cs_test_2')
+        response = self.client.post(self.url, self.payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.get(id=first.data['order_id']).status, 'CANCELLED')
+
+    @patch('market.management.commands.poll_stripe_payments.time.sleep')
+    @patch('market.stripe_service.stripe.checkout.Session.retrieve')
+    def test_polling_records_payment_of_cancelled_order(self, mock_retrieve, mock_sleep):
+        """A CANCELLED order whose session was never expired is polled until its session is settled."""
+        fields = {
+            'product': self.product, 'buyer': self.buyer, 'seller': self.seller,
+            'price': self.product.price, 'seller_amount': Decimal('108.00'),
+        }
+        paid = Order.objects.create(status='CANCELLED', stripe_checkout_session_id='cs_paid', **fields)
+        expired = Order.objects.create(status='CANCELLED', stripe_checkout_session_id='cs_expired', **fields)
+        Order.objects.create(
+            status='CANCELLED', stripe_checkout_session_id='cs_settled',
+            checkout_expires_at=timezone.now(), **fields
+        )
+
+        def retrieve(session_id, **kwargs):
+            paid_session = session_id == 'cs_paid'
+            return stripe.checkout.Session.construct_from({
+                'id': session_id, 'payment_intent': 'pi_1', 'metadata': {},
+                'status': 'complete' if paid_session else 'expired',
+                'payment_status': 'paid' if paid_session else 'unpaid',
+            }, 'sk_test')
+        mock_retrieve.side_effect = retrieve
+
+        call_command('poll_stripe_payments')
+
+        self.assertEqual(sorted(call.args[0] for call in mock_retrieve.call_args_list), ['cs_expired', 'cs_paid'])
+        self.assertEqual(Order.objects.get(id=paid.id).status, 'PAID')
+        self.assertIsNotNone(Order.objects.get(id=expired.id).checkout_expires_at)
+        self.assertFalse(StripeService.pollable_orders(timezone.now() - timedelta(hours=1)).filter(status='CANCELLED'))
+
+    def test_database_rejects_duplicate_pending_order(self):
+        """The partial unique constraint allows only one PENDING order per buyer/product/price."""
+        fields = {
+            'product': self.product, 'buyer': self.buyer, 'seller': self.seller,
+            'price': self.product.price, 'seller_amount': Decimal('108.00'),
+        }
+        Order.objects.create(status='PENDING', **fields)
+        Order.objects.create(status='FAILED', **fields)
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Order.objects.create(status='PENDING', **fields)
+
+
+class InlineExecutor:
+    """Runs submitted work immediately so background jobs can be asserted synchronously."""
+
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+class AIAutofillJobTestCase(TestCase):
+    """Test cases for the AI autofill job API and quota limiting."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+
+        patcher = patch.multiple(autofill_jobs, _executor=InlineExecutor(), _jobs={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Worker threads manage their own connections; the test connection must stay open
+        patcher = patch('market.ai_jobs.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create_test_image(self):
+        image_io = BytesIO()
+        Image.new('RGB', (100, 100), color='blue').save(image_io, 'JPEG')
+        image_io.seek(0)
+        image_io.name = 'test_image.jpg'
+        return image_io
+
+    @patch('market.ai_service.analyze_product_image')
+    def test_submit_and_poll_job(self, mock_analyze):
+        """A submitted job is accepted and its result is readable from the status endpoint."""
+        mock_analyze.return_value = {
+            'title': 'Desk Lamp',
+            'description': 'Adjustable desk lamp.',
+            'category_suggestion': 'Furniture',
+            'price_min': 15,
+            'price_max': 25
+        }
+
+        response = self.client.post(
+            '/api/market/products/autofill/jobs/', {'image': self._create_test_image()}, format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIn('status_url', response.data)
+
+        status_response = self.client.get(f"/api/market/products/autofill/jobs/{response.data['id']}/")
+        self.assertEqual(status_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(status_response.data['status'], 'done')
+        self.assertEqual(status_response.data['result']['title'], 'Desk Lamp')
+
+    @patch('market.ai_service.analyze_product_image')
+    def test_job_is_private_to_owner(self, mock_analyze):
+        """Other users cannot read someone else's job."""
+        mock_analyze.return_value = {'title': 'X', 'description': '', 'category_suggestion': '', 'price_min': 0, 'price_max': 0}
+        response = self.client.post(
+            '/api/market/products/autofill/jobs/', {'image': self._create_test_image()}, format='multipart'
+        )
+
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_authenticate(user=other)
+        status_response = self.client.get(f"/api/market/products/autofill/jobs/{response.data['id']}/")
+
+        self.assertEqual(status_response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_submit_fails_fast_when_queue_is_full(self):
+        """Jobs beyond the pending limit are rejected with 429."""
+        with patch.object(autofill_jobs, 'max_pending', 0):
+            response = self.client.post(
+                '/api/market/products/autofill/jobs/', {'image': self._create_test_image()}, format='multipart'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @patch.dict('os.environ', {'GEMINI_API_KEY': 'test-key'})
+    def test_autofill_returns_429_when_quota_exhausted(self):
+        """The synchronous endpoint fails fast once the quota is used up."""
+        with patch.object(quota_limiter, 'acquire', return_value=(False, 42)):
+            response = self.client.post(
+                '/api/market/products/autofill/', {'image': self._create_test_image()}, format='multipart'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '42')
+
+    def test_quota_limiter_enforces_minute_and_day_windows(self):
+        """The limiter admits up to the per-minute and per-day limits and reports retry times."""
+        limiter = QuotaLimiter(per_minute=2, per_day=3)
+
+        self.assertEqual(limiter.acquire(), (True, 0))
+        self.assertEqual(limiter.acquire(), (True, 0))
+        acquired, retry_after = limiter.acquire()
+        self.assertFalse(acquired)
+        self.assertGreater(retry_after, 0)
+
+        limiter._minute.clear()
+        self.assertEqual(limiter.acquire(), (True, 0))
+        acquired, retry_after = limiter.acquire(timeout=120)
+        self.assertFalse(acquired)
+        self.assertGreater(retry_after, 3600)
+
+
+class AIAutofillCacheTestCase(TestCase):
+    """Test cases for the content-addressed AI autofill cache."""
+
+    RESULT = {
+        'title': 'Road Bike',
+        'description': 'Lightweight road bike.',
+        'category_suggestion': 'Sports',
+        'price_min': 200,
+        'price_max': 300
+    }
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+
+    def _image(self, size=256, extent=(-2, -1.5, 1, 1.5), quality=90):
+        """Create a structured test image (flat colours all share the same perceptual hash)."""
+        image = Image.effect_mandelbrot((256, 256), extent, 100).resize((size, size))
+        image_io = BytesIO()
+        image.convert('RGB').save(image_io, 'JPEG', quality=quality)
+        image_io.seek(0)
+        image_io.name = 'test_image.jpg'
+        return image_io
+
+    def _autofill(self, image):
+        return self.client.post('/api/market/products/autofill/', {'image': image}, format='multipart')
+
+    @patch('market.ai_service.analyze_product_image')
+    def test_exact_repeat_is_served_from_cache(self, mock_analyze):
+        mock_analyze.return_value = dict(self.RESULT)
+
+        first = self._autofill(self._image())
+        second = self._autofill(self._image())
+
+        self.assertEqual(first.data['cache'], {'status': 'miss'})
+        self.assertEqual(second.data['cache']['match'], 'exact')
+        self.assertEqual(second.data['title'], 'Road Bike')
+        self.assertEqual(mock_analyze.call_count, 1)
+
+    @patch('market.ai_service.analyze_product_image')
+    def test_resized_copy_is_perceptual_hit(self, mock_analyze):
+        mock_analyze.return_value = dict(self.RESULT)
+
+        self._autofill(self._image())
+        response = self._autofill(self._image(size=180, quality=60))
+
+        self.assertEqual(response.data['cache']['status'], 'hit')
+        self.assertEqual(response.data['cache']['match'], 'perceptual')
+        self.assertEqual(mock_analyze.call_count, 1)
+        self.assertEqual(AutofillCacheEntry.objects.get().hit_count, 1)
+
+    @patch('market.ai_service.analyze_product_image')
+    def test_different_image_misses(self, mock_analyze):
+        mock_analyze.return_value = dict(self.RESULT)
+
+        self._autofill(self._image())
+        response = self._autofill(self._image(extent=(-0.8, 0.0, -0.6, 0.2)))
+
+        self.assertEqual(response.data['cache'], {'status': 'miss'})
+        self.assertEqual(mock_analyze.call_count, 2)
+
+    @patch('market.ai_service.analyze_product_image')
+    def test_expired_entries_are_ignored(self, mock_analyze):
+        mock_analyze.return_value = dict(self.RESULT)
+
+        self._autofill(self._image())
+        AutofillCacheEntry.objects.update(created_at=timezone.now() - timedelta(days=30))
+        with self.settings(AI_AUTOFILL_CACHE_TTL=3600):
+            response = self._autofill(self._image())
+
+        self.assertEqual(response.data['cache'], {'status': 'miss'})
+        self.assertEqual(mock_analyze.call_count, 2)
+
+    @patch('market.ai_service.analyze_product_image')
+    def test_errors_are_not_cached(self, mock_analyze):
+        mock_analyze.return_value = {'error': 'AI analysis failed: boom', 'title': '', 'description': '',
+                                     'category_suggestion': '', 'price_min': 0, 'price_max': 0}
+
+        self._autofill(self._image())
+
+        self.assertFalse(AutofillCacheEntry.objects.exists())
+
+
+class BatchModel:
+    """Stand-in Gemini model answering single-image and batch prompts."""
+
+    def __init__(self):
+        self.calls = []
+
+    def generate_content(self, parts):
+        images = len(parts) - 1
+        self.calls.append(images)
+        item = {'title': 'Item', 'description': '', 'category_suggestion': 'Books', 'price_min': 5, 'price_max': 10}
+        payload = item if images == 1 else [dict(item, title=f'Item {i}') for i in range(images)]
+        return MagicMock(text=json.dumps(payload))
+
+
+@patch.dict(os.environ, {'GEMINI_API_KEY': 'test-key'})
+class AIAutofillBatchTestCase(TestCase):
+    """Test cases for the streamed multi-image autofill endpoint."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+        quota_limiter.reset()
+        self.model = BatchModel()
+        patcher = patch('market.ai_service.get_generative_model', return_value=self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _images(self, count):
+        """Distinct structured images (flat colours would be perceptual cache hits of each other)."""
+        images = []
+        for i in range(count):
+            extent = (-2 + 0.3 * i, -1.5, 1 - 0.2 * i, 1.5 - 0.4 * i)
+            image_io = BytesIO()
+            Image.effect_mandelbrot((128, 128), extent, 100).convert('RGB').save(image_io, 'JPEG')
+            image_io.seek(0)
+            image_io.name = f'photo_{i}.jpg'
+            images.append(image_io)
+        return images
+
+    def _batch(self, images, **extra):
+        return self.client.post('/api/market/products/autofill/batch/', {'images': images}, format='multipart', **extra)
+
+    def _ndjson(self, response):
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    @override_settings(AI_AUTOFILL_BATCH_SIZE=4)
+    def test_images_are_packed_into_few_model_calls(self):
+        response = self._batch(self._images(5))
+        records = self._ndjson(response)
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(self.model.calls, [4, 1])
+        self.assertEqual(sorted(record['index'] for record in records), [0, 1, 2, 3, 4])
+        self.assertTrue(all(record['status'] == 200 for record in records))
+        self.assertEqual(records[1]['filename'], 'photo_1.jpg')
+        self.assertEqual(records[1]['result']['title'], 'Item 1')
+        self.assertEqual(AutofillCacheEntry.objects.count(), 5)
+
+    def test_cache_hits_are_streamed_without_model_calls(self):
+        self._ndjson(self._batch(self._images(2)))
+        self.model.calls.clear()
+
+        records = self._ndjson(self._batch(self._images(3)))
+
+        self.assertEqual(self.model.calls, [1])
+        self.assertEqual([record['index'] for record in records], [0, 1, 2])
+        self.assertEqual([record['result']['cache']['status'] for record in records], ['hit', 'hit', 'miss'])
+
+    def test_event_stream_format(self):
+        response = self._batch(self._images(2), HTTP_ACCEPT='text/event-stream')
+        events = b''.join(response.streaming_content).decode().split('\n\n')
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(len([event for event in events if event]), 2)
+        self.assertTrue(events[0].startswith('data: '))
+        self.assertEqual(json.loads(events[0][len('data: '):])['status'], 200)
+
+    def test_quota_errors_are_reported_per_image(self):
+        exhausted = QuotaLimiter(per_minute=1, per_day=1)
+        exhausted.acquire()
+        with patch('market.ai_service.quota_limiter', exhausted):
+            records = self._ndjson(self._batch(self._images(2)))
+
+        self.assertEqual(self.model.calls, [])
+        self.assertEqual([record['status'] for record in records], [429, 429])
+        self.assertIn('retry_after', records[0]['result'])
+
+    @override_settings(AI_AUTOFILL_MAX_BATCH_IMAGES=2)
+    def test_rejects_missing_and_too_many_images(self):
+        self.assertEqual(self._batch([]).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self._batch(self._images(3))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('error', json.loads(response.content))
+
+    def test_single_image_endpoint_uses_the_same_pipeline(self):
+        response = self.client.post(
+            '/api/market/products/autofill/', {'image': self._images(1)[0]}, format='multipart'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], 'Item')
+        self.assertEqual(self.model.calls, [1])
+
+
+class ImagePreprocessingTestCase(TestCase):
+    """Test cases for shrinking images before they are sent to the model."""
+
+    def _jpeg(self, size, orientation=None):
+        exif = Image.Exif()
+        exif[0x010F] = 'Test Camera'
+        if orientation:
+            exif[0x0112] = orientation
+        image_io = BytesIO()
+        Image.new('RGB', size, color='green').save(image_io, 'JPEG', exif=exif)
+        return image_io.getvalue()
+
+    def test_large_image_is_bounded_and_stripped(self):
+        blob = prepare_image_for_model(self._jpeg((4000, 3000)))
+
+        image = Image.open(BytesIO(blob['data']))
+        self.assertEqual(blob['mime_type'], 'image/jpeg')
+        self.assertEqual(image.size, (1024, 768))
+        self.assertEqual(len(image.getexif()), 0)
+
+    def test_exif_orientation_is_applied(self):
+        # Orientation 6 = rotated 90° clockwise; the model should see the upright image
+        blob = prepare_image_for_model(self._jpeg((2000, 1000), orientation=6))
+
+        self.assertEqual(Image.open(BytesIO(blob['data'])).size, (512, 1024))
+
+    def test_small_image_is_not_upscaled(self):
+        blob = prepare_image_for_model(self._jpeg((300, 200)))
+
+        self.assertEqual(Image.open(BytesIO(blob['data'])).size, (300, 200))
+
+
+class StartupImportTimeTestCase(SimpleTestCase):
+    """Guards Django startup (migrate, CronJobs, daphne boot) against heavy imports."""
+
+    # Must only be loaded when a payment, AI or image request needs them
+    LAZY_MODULES = ('stripe', 'google.genai', 'google.generativeai', 'PIL')
+    # daphne's autobahn imports numpy itself when it is installed, so our modules must just not bind it
+    UNBOUND_MODULES = LAZY_MODULES + ('numpy',)
+    STARTUP = '''
+import json, sys, types
+import django
+django.setup()
+import wantHave_com.urls
+
+def origin(value):
+    return value.__name__ if isinstance(value, types.ModuleType) else getattr(value, '__module__', None) or ''
+
+bound = {}
+for name, module in list(sys.modules.items()):
+    if module is not None and name.split('.')[0] in ('market', 'chat', 'wantHave_com'):
+        bound[name] = sorted({origin(value) for value in vars(module).values()})
+print(json.dumps({'modules': sorted(sys.modules), 'bound': bound}))
+'''
+
+    def _startup(self):
+        """Modules loaded by Django setup and URL loading in a fresh interpreter, and what our modules bind"""
+        result = subprocess.run(
+            [sys.executable, '-c', self.STARTUP],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'wantHave_com.settings'},
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        return json.loads(result.stdout.splitlines()[-1])
+
+    @staticmethod
+    def _within(name, packages):
+        return any(name == package or name.startswith(package + '.') for package in packages)
+
+    def test_startup_does_not_import_heavy_modules(self):
+        startup = self._startup()
+
+        for module in self.LAZY_MODULES:
+            self.assertFalse(module in startup['modules'], f'{module} is imported during Django startup')
+        for name, origins in startup['bound'].items():
+            heavy = [origin for origin in origins if self._within(origin, self.UNBOUND_MODULES)]
+            self.assertEqual(heavy, [], f'{name} imports {heavy} at module level')
+
+
+class OfflineAutofillFallbackTestCase(TestCase):
+    """Test cases for the offline catalog classifier used when Gemini is unavailable."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = self.settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        catalog_index.invalidate()
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='seller', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+
+        self.bikes = Category.objects.create(name='Bikes')
+        self.books = Category.objects.create(name='Books')
+        for i, price in enumerate(['100.00', '150.00', '200.00']):
+            self._product(f'Red road bike {i}', price, self.bikes, self._image('red', i))
+        for i, price in enumerate(['5.00', '8.00', '10.00']):
+            self._product(f'Blue paperback novel {i}', price, self.books, self._image('blue', i))
+
+    def _image(self, color, variant=0, name='photo.jpg'):
+        image = Image.new('RGB', (120, 120), color=color)
+        image.paste((255, 255, 255), (10 + variant * 5, 10, 60, 60))
+        image_io = BytesIO()
+        image.save(image_io, 'JPEG')
+        return SimpleUploadedFile(name, image_io.getvalue(), content_type='image/jpeg')
+
+    def _product(self, title, price, category, image):
+        return Product.objects.create(
+            seller=self.user, title=title, description='', price=Decimal(price), category=category, image=image
+        )
+
+    def test_index_build_is_incremental(self):
+        out = StringIO()
+        call_command('build_autofill_index', stdout=out)
+        self.assertIn('Embedded 6 of 6', out.getvalue())
+
+        out = StringIO()
+        call_command('build_autofill_index', stdout=out)
+        self.assertIn('Embedded 0 of 0', out.getvalue())
+
+        self._product('Red bike 4', '120.00', self.bikes, self._image('red', 4))
+        out = StringIO()
+        call_command('build_autofill_index', stdout=out)
+        self.assertIn('Embedded 1 of 1', out.getvalue())
+        self.assertEqual(ProductEmbedding.objects.count(), 7)
+
+    def test_removed_image_drops_its_embedding(self):
+        call_command('build_autofill_index', stdout=StringIO())
+        product = Product.objects.filter(category=self.bikes).first()
+        Product.objects.filter(pk=product.pk).update(image='')
+
+        out = StringIO()
+        call_command('build_autofill_index', stdout=out)
+
+        self.assertIn('deleted 1 embeddings', out.getvalue())
+        self.assertFalse(ProductEmbedding.objects.filter(product=product).exists())
+
+    def test_product_edits_reload_the_index(self):
+        call_command('build_autofill_index', stdout=StringIO())
+        catalog_index._ensure_fresh()
+        product = Product.objects.filter(category=self.bikes).first()
+        product.title = 'Renamed tandem'
+        product.save()
+
+        catalog_index._checked_at = 0  # Skip INDEX_CHECK_INTERVAL
+        catalog_index._ensure_fresh()
+
+        self.assertIn('Renamed tandem', catalog_index.titles)
+
+    @patch.dict('os.environ', {}, clear=True)
+    def test_missing_api_key_falls_back_to_catalog(self):
+        call_command('build_autofill_index', stdout=StringIO())
+
+        response = self.client.post(
+            '/api/market/products/autofill/', {'image': self._image('red', 2, 'upload.jpg')}, format='multipart'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['source'], 'offline')
+        self.assertEqual(response.data['category_id'], self.bikes.id)
+        self.assertGreaterEqual(response.data['price_min'], 100)
+        self.assertLessEqual(response.data['price_max'], 200)
+        self.assertIn('bike', response.data['keywords'])
+
+    @patch.dict('os.environ', {}, clear=True)
+    def test_empty_index_keeps_error(self):
+        response = self.client.post(
+            '/api/market/products/autofill/', {'image': self._image('red', name='upload.jpg')}, format='multipart'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class CategoryMatcherTestCase(TestCase):
+    """Test cases for mapping free-text category suggestions onto the seeded tree."""
+
+    def setUp(self):
+        category_matcher.invalidate()
+
+    def test_matches_plurals_and_typos(self):
+        """Test that plural, singular and misspelled names find the same leaf."""
+        laptops = Category.objects.get(name='Laptops')
+        for text in ('Laptops', 'laptop', 'Laptp'):
+            self.assertEqual(category_matcher.match(text).category_id, laptops.id, text)
+
+    def test_never_suggests_parent_or_giveaway_categories(self):
+        """Test that only sellable leaf categories are returned."""
+        leaf_ids = set(Category.objects.filter(children__isnull=True).values_list('id', flat=True))
+        giveaway_ids = set(Category.objects.filter(parent__name__iexact='To give away').values_list('id', flat=True))
+        for text in ('Electronics', 'Clothing', 'Furniture', 'Books', 'Home & Garden', 'Toys'):
+            match = category_matcher.match(text)
+            if match:
+                self.assertIn(match.category_id, leaf_ids - giveaway_ids, text)
+
+    def test_unrelated_text_has_no_match(self):
+        """Test that nonsense below the confidence threshold returns None."""
+        self.assertIsNone(category_matcher.match('qzxv'))
+        self.assertIsNone(category_matcher.match(''))
+
+    def test_rebuild_swaps_in_a_new_index(self):
+        """Test that a rebuild leaves the index a concurrent match() is reading untouched."""
+        index = category_matcher._ensure_loaded()
+        leaves = dict(index.leaves)
+        category_matcher.invalidate()
+        Category.objects.create(name='Drones', parent=Category.objects.get(name='Laptops').parent)
+
+        self.assertIsNot(category_matcher._ensure_loaded(), index)
+        self.assertEqual(index.leaves, leaves)
+        self.assertEqual(category_matcher.match('Drones').name, 'Drones')
+
+    def test_index_loads_once_and_refreshes_on_category_change(self):
+        """Test that matching is query-free once loaded and sees new categories after a save."""
+        category_matcher.match('Laptops')
+        with self.assertNumQueries(0):
+            for text in ('Smartphones', 'Jewellery', 'Furnitur'):
+                category_matcher.match(text)
+
+        parent = Category.objects.get(name='Laptops').parent
+        drones = Category.objects.create(name='Camera drones', parent=parent)
+        self.assertEqual(category_matcher.match('camera drone').category_id, drones.id)
+
+
+class PriceBandTestCase(TestCase):
+    """Test cases for the historical per-category price bands."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.buyer = User.objects.create_user(username='buyer', password='testpass123')
+        self.laptops = Category.objects.get(name='Laptops')
+        price_bands.invalidate()
+
+    def _paid_order(self, price, category=None):
+        """Complete a checkout the way the Stripe webhook does."""
+        product = Product.objects.create(
+            seller=self.seller, title='Laptop', description='', price=Decimal(price),
+            category=category or self.laptops, image='product_images/laptop.jpg'
+        )
+        order = Order.objects.create(
+            product=product, buyer=self.buyer, seller=self.seller, price=Decimal(price),
+            seller_amount=Decimal(price), stripe_checkout_session_id=f'cs_{product.id}'
+        )
+        StripeService.handle_checkout_session_completed({
+            'id': order.stripe_checkout_session_id, 'payment_intent': f'pi_{product.id}', 'metadata': {}
+        })
+        return order
+
+    def test_sketch_quantiles_are_within_relative_accuracy(self):
+        values = [1.5 * i for i in range(1, 2001)]
+        sketch = PriceSketch()
+        for value in values:
+            sketch.add(value)
+        restored = PriceSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+
+        for q in (0.1, 0.5, 0.9):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(restored.quantile(q), exact, delta=exact * RELATIVE_ACCURACY)
+
+    def test_paid_orders_update_category_and_ancestors(self):
+        for price in ('200', '400', '600', '800', '1000'):
+            self._paid_order(price)
+
+        band = self.client.get(f'/api/market/categories/{self.laptops.id}/price-band/').data
+        parent_band = self.client.get(f'/api/market/categories/{self.laptops.parent_id}/price-band/').data
+
+        self.assertEqual(band['sold']['count'], 5)
+        self.assertAlmostEqual(band['sold']['p50'], 600, delta=6)
+        self.assertEqual(band['suggested']['source'], 'sold')
+        self.assertEqual(parent_band['sold']['count'], 5)
+
+    def test_autofill_suggestion_uses_band_without_queries(self):
+        for price in ('300', '350', '400', '450', '500'):
+            self._paid_order(price)
+        result = {'title': 'Laptop', 'description': '', 'category_suggestion': 'laptop',
+                  'price_min': 1, 'price_max': 2}
+        build_autofill_suggestion(result)  # Warm the category and price snapshots
+
+        with self.assertNumQueries(0):
+            suggestion = build_autofill_suggestion(result)
+
+        self.assertEqual(suggestion['price_band']['count'], 5)
+        self.assertAlmostEqual(suggestion['price_band']['p50'], 400, delta=4)
+
+    def test_no_suggestion_below_min_samples(self):
+        self._paid_order('100')
+
+        response = self.client.get(f'/api/market/categories/{self.laptops.id}/price-band/')
+
+        self.assertEqual(response.data['sold']['count'], 1)
+        self.assertIsNone(response.data['suggested'])
+
+    def test_unknown_category_is_404(self):
+        for category_id in ('999999', 'abc', '-1'):
+            response = self.client.get(f'/api/market/categories/{category_id}/price-band/')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, category_id)
+
+    def test_rebuild_matches_incremental_updates(self):
+        for price in ('120', '80', '95'):
+            self._paid_order(price)
+        incremental = CategoryPriceStats.objects.get(category=self.laptops).sold_sketch
+
+        call_command('rebuild_price_stats', stdout=StringIO())
+
+        self.assertEqual(CategoryPriceStats.objects.get(category=self.laptops).sold_sketch, incremental)
+
+
+class ProductClusterTestCase(TestCase):
+    """Test cases for server-side map marker clustering."""
+
+    AUSTRIA = '9.5,46.3,17.2,49.1'
+    VIENNA = (48.2082, 16.3738)
+    GRAZ = (47.0707, 15.4395)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+
+    def _product(self, location, price='10.00', **extra):
+        return Product.objects.create(
+            seller=self.seller, title='Item', description='', price=Decimal(price),
+            image='product_images/item.jpg', latitude=location[0], longitude=location[1], **extra
+        )
+
+    def _clusters(self, bbox=AUSTRIA, zoom=7):
+        return self.client.get('/api/market/products/clusters/', {'bbox': bbox, 'zoom': zoom})
+
+    def test_grid_cells_nest_across_zoom_levels(self):
+        cell = geo_grid.cell_for(*self.VIENNA)
+        for zoom in (0, 5, 12, geo_grid.GRID_ZOOM):
+            tiles = geo_grid.tiles_in_bbox(self.VIENNA[1], self.VIENNA[0], self.VIENNA[1], self.VIENNA[0], zoom)
+            self.assertEqual(tiles, [geo_grid.tile_of_cell(cell, zoom)])
+
+    def test_clusters_aggregate_available_products(self):
+        for index, price in enumerate(('30.00', '12.50', '99.00', '45.00')):
+            self._product((self.VIENNA[0] + index * 0.001, self.VIENNA[1]), price=price)
+        self._product(self.VIENNA, price='1.00', status='SOLD')
+        self._product(self.GRAZ, price='20.00')
+
+        response = self._clusters()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 5)
+        clusters = sorted(response.data['clusters'], key=lambda cluster: -cluster['count'])
+        self.assertEqual([cluster['count'] for cluster in clusters], [4, 1])
+        self.assertEqual(clusters[0]['min_price'], Decimal('12.50'))
+        self.assertEqual(len(clusters[0]['sample_ids']), 3)
+        self.assertAlmostEqual(clusters[0]['latitude'], self.VIENNA[0] + 0.0015, places=4)
+
+    def test_payload_stays_flat_as_catalog_grows(self):
+        self._product(self.VIENNA)
+        small = self._clusters().data
+
+        for index in range(60):
+            self._product((self.VIENNA[0] + index * 0.0001, self.VIENNA[1] + index * 0.0001))
+        large = self._clusters().data
+
+        self.assertEqual(len(large['clusters']), len(small['clusters']))
+        self.assertEqual(large['count'], 61)
+
+    def test_repeat_requests_are_served_from_cache(self):
+        self._product(self.VIENNA)
+        self._clusters()
+
+        with self.assertNumQueries(0):
+            response = self._clusters()
+        self.assertEqual(response.data['count'], 1)
+
+    def test_changed_products_invalidate_their_tiles(self):
+        product = self._product(self.GRAZ)
+        self._clusters()
+
+        product.latitude, product.longitude = self.VIENNA
+        product.save()
+        self._product(self.VIENNA)
+        clusters = self._clusters().data['clusters']
+
+        self.assertEqual([cluster['count'] for cluster in clusters], [2])
+        self.assertEqual(clusters[0]['cell'] // 16, geo_grid.tile_of_cell(geo_grid.cell_for(*self.VIENNA), 7))
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self._clusters(bbox='1,2,3').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._clusters(bbox='17,49,9,46').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._clusters(bbox='-180,-85,180,85', zoom=10).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkProductImportExportTestCase(TestCase):
+    """Test cases for streaming bulk import and export of listings."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = self.settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media_root, 'product_images'))
+        with open(os.path.join(self.media_root, 'product_images', 'lamp.jpg'), 'wb') as f:
+            f.write(self._jpeg())
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='seller', password='testpass123')
+        self.user.profile.latitude, self.user.profile.longitude = 48.2082, 16.3738
+        self.user.profile.save()
+        self.client.force_authenticate(user=self.user)
+        self.laptops = Category.objects.get(name='Laptops')
+
+    def _jpeg(self):
+        image_io = BytesIO()
+        Image.new('RGB', (32, 32), color='green').save(image_io, 'JPEG')
+        return image_io.getvalue()
+
+    def _import(self, name, content, **extra):
+        upload = SimpleUploadedFile(name, content.encode())
+        response = self.client.post('/api/market/products/import/', {'file': upload, **extra}, format='multipart')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_csv_import_reports_errors_per_row(self):
+        category_path = ' > '.join([self.laptops.parent.name, self.laptops.name])
+        content = (
+            'title,description,price,category,image,city\n'
+            f'Desk lamp,Warm light,15.50,,product_images/lamp.jpg,\n'
+            f'ThinkPad,Used,300,{category_path},product_images/lamp.jpg,Graz\n'
+            'Broken price,,abc,,product_images/lamp.jpg,\n'
+            'No category,,10,Does not exist,product_images/lamp.jpg,\n'
+            'Missing image,,10,,product_images/nope.jpg,\n'
+        )
+
+        results = self._import('listings.csv', content)
+
+        self.assertEqual([result.get('status') for result in results[:-1]],
+                         ['created', 'created', 'error', 'error', 'error'])
+        self.assertIn('price', results[2]['errors'])
+        self.assertIn('category', results[3]['errors'])
+        self.assertIn('image', results[4]['errors'])
+        self.assertEqual(results[-1], {'summary': {'created': 2, 'failed': 3}})
+
+        lamp = Product.objects.get(id=results[0]['id'])
+        self.assertEqual(lamp.seller, self.user)
+        self.assertEqual(lamp.grid_cell, geo_grid.cell_for(48.2082, 16.3738))
+        self.assertEqual(Product.objects.get(id=results[1]['id']).category, self.laptops)
+
+    def test_ndjson_import_with_zip_images(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('photos/bike.jpg', self._jpeg())
+        archive.seek(0)
+        content = (
+            '{"title": "Bike", "price": 120, "image": "photos/bike.jpg", "category": "laptops"}\n'
+            'not json\n'
+        )
+
+        results = self._import('listings.ndjson', content,
+                               images=SimpleUploadedFile('images.zip', archive.getvalue()))
+
+        self.assertEqual(results[0]['status'], 'created', results)
+        self.assertEqual(results[1]['status'], 'error')
+        bike = Product.objects.get(id=results[0]['id'])
+        self.assertTrue(bike.image.name.startswith('product_images/bike'))
+        self.assertTrue(os.path.exists(bike.image.path))
+
+    def test_rows_are_written_in_batches(self):
+        content = 'title,price,image\n' + ''.join(f'Item {i},{i},product_images/lamp.jpg\n' for i in range(5))
+
+        with CaptureQueriesContext(connection) as queries:
+            results = self._import('listings.csv', content, batch_size=2)
+
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "market_product"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(results[-1], {'summary': {'created': 5, 'failed': 0}})
+
+    @override_settings(BULK_IMPORT_MAX_BATCH_SIZE=100)
+    def test_invalid_batch_size_is_rejected_before_streaming(self):
+        for batch_size in ('abc', '1.5', '-1', '101'):
+            upload = SimpleUploadedFile('listings.csv', b'title,price,image\nLamp,1,product_images/lamp.jpg\n')
+            response = self.client.post(
+                '/api/market/products/import/', {'file': upload, 'batch_size': batch_size}, format='multipart'
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, batch_size)
+            self.assertIn('batch_size', response.data['detail'])
+        self.assertFalse(Product.objects.exists())
+
+    def test_export_round_trips_through_import(self):
+        self._import('listings.csv', 'title,price,category,image\nLamp,15.50,Laptops,product_images/lamp.jpg\n')
+
+        response = self.client.get('/api/market/products/export/')
+        exported = b''.join(response.streaming_content).decode()
+        results = self._import('export.csv', exported)
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(results[-1], {'summary': {'created': 1, 'failed': 0}})
+        self.assertEqual(Product.objects.filter(title='Lamp', category=self.laptops).count(), 2)
+
+    def test_export_ndjson_and_scopes(self):
+        other = User.objects.create_user(username='other', password='testpass123')
+        Product.objects.create(seller=other, title='Other', description='', price=1, image='product_images/lamp.jpg')
+        Product.objects.create(seller=self.user, title='Mine', description='', price=2, image='product_images/lamp.jpg')
+
+        response = self.client.get('/api/market/products/export/', {'format': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['title'] for row in rows], ['Mine'])
+        self.assertEqual(self.client.get('/api/market/products/export/', {'scope': 'all'}).status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/market/products/export/', {'format': 'ndjson', 'scope': 'all'})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 2)
+
+
+class ProductSparseFieldsTestCase(TestCase):
+    """Test cases for ?fields= sparse fieldsets and the card view of products."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.buyer = User.objects.create_user(username='buyer', password='testpass123')
+        self.laptops = Category.objects.get(name='Laptops')
+        for index in range(3):
+            Product.objects.create(
+                seller=self.seller, title=f'Laptop {index}', description='Long description ' * 50,
+                price=Decimal('100.00'), image='product_images/laptop.jpg', category=self.laptops,
+                latitude=48.2, longitude=16.37, city='Vienna'
+            )
+
+    def test_full_representation_is_unchanged(self):
+        response = self.client.get('/api/market/products/')
+
+        self.assertEqual(set(response.data[0]), {
+            'id', 'title', 'description', 'price', 'image', 'status', 'created_at', 'seller_id',
+            'seller_username', 'category', 'buyer', 'sold_at', 'latitude', 'longitude', 'city', 'is_watched'
+        })
+        self.assertEqual(response.data[0]['seller_username'], 'seller')
+        self.assertEqual(response.data[0]['category']['name'], 'Laptops')
+
+    def test_fields_param_selects_fields(self):
+        response = self.client.get('/api/market/products/', {'fields': 'id,title,price,unknown'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([set(product) for product in response.data], [{'id', 'title', 'price'}] * 3)
+
+    def test_card_view_skips_detail_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/market/products/', {'view': 'card'})
+
+        product = response.data[0]
+        self.assertNotIn('description', product)
+        self.assertNotIn('latitude', product)
+        self.assertEqual(product['seller_username'], 'seller')
+        self.assertEqual(product['category']['name'], 'Laptops')
+        # One joined query for all products, without the description column
+        product_queries = [query['sql'] for query in queries if 'FROM "market_product"' in query['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertNotIn('"description"', product_queries[0])
+        self.assertIn('JOIN "auth_user"', product_queries[0])
+
+    def test_fields_narrow_the_card_view(self):
+        response = self.client.get('/api/market/products/', {'view': 'card', 'fields': 'id,description'})
+
+        self.assertEqual(set(response.data[0]), {'id'})
+
+    def test_listings_and_purchases_accept_fields(self):
+        profile = self.seller.profile
+        response = self.client.get(f'/api/market/profiles/{profile.id}/listings/', {'fields': 'id,title'})
+        self.assertEqual(set(response.data[0]), {'id', 'title'})
+
+        Product.objects.filter(title='Laptop 0').update(buyer=self.buyer, status='SOLD', sold_at=timezone.now())
+        self.client.force_authenticate(user=self.buyer)
+        response = self.client.get('/api/market/profiles/purchases/', {'view': 'card'})
+        self.assertEqual(len(response.data), 1)
+        self.assertNotIn('description', response.data[0])
+
+    def test_watchlist_renders_nested_card(self):
+        self.client.force_authenticate(user=self.buyer)
+        self.client.post('/api/market/watchlist/', {'product_id': Product.objects.first().id})
+
+        response = self.client.get('/api/market/watchlist/', {'view': 'card'})
+
+        self.assertIn('added_at', response.data[0])
+        self.assertNotIn('description', response.data[0]['product'])
+        self.assertEqual(response.data[0]['product']['seller_username'], 'seller')
+
+
+class FastSerializerParityTestCase(TestCase):
+    """The fast list path must render byte-identical JSON to the DRF serializers."""
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='testpass123', email='s@example.com')
+        self.buyer = User.objects.create_user(username='buyer', password='testpass123')
+        self.seller.profile.profile_picture = 'profile_pictures/seller.jpg'
+        self.seller.profile.save()
+        laptops = Category.objects.get(name='Laptops')
+        self.products = [
+            Product.objects.create(
+                seller=self.seller, title='Laptop', description='Fast', price=Decimal('999.90'),
+                image='product_images/laptop.jpg', category=laptops, latitude=48.2082, longitude=16.3738, city='Vienna'
+            ),
+            Product.objects.create(
+                seller=self.seller, title='Ünicode "quoted"', description='', price=Decimal('0.00'),
+                image='product_images/free item (1).jpg', city=''
+            ),
+            Product.objects.create(
+                seller=self.buyer, title='Sold', description='x', price=Decimal('5'), image='product_images/sold.jpg',
+                category=Category.objects.get(name='Electronics'), status='SOLD', buyer=self.seller,
+                sold_at=timezone.now(), latitude=-33.0, longitude=151.25
+            ),
+        ]
+        self.request = Request(APIRequestFactory().get('/api/market/products/'))
+
+    def _assert_parity(self, queryset, serializer_class, **kwargs):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True, **kwargs).data)
+        actual = JSONRenderer().render(serialize_queryset(queryset, serializer_class(**kwargs)))
+        self.assertEqual(actual, expected)
+
+    def test_product_parity(self):
+        products = Product.objects.order_by('id')
+        self._assert_parity(products, ProductSerializer)
+        self._assert_parity(products, ProductSerializer, context={'request': self.request})
+        self._assert_parity(products, ProductSerializer, fields=ProductSerializer.Meta.views['card'])
+        self._assert_parity(products, ProductSerializer, fields=['id', 'price', 'category', 'sold_at'])
+
+    @override_settings(TIME_ZONE='Europe/Vienna')
+    def test_product_parity_outside_utc(self):
+        self._assert_parity(Product.objects.order_by('id'), ProductSerializer, context={'request': self.request})
+
+    def test_watchlist_parity(self):
+        for product in self.products:
+            WatchlistItem.objects.create(user=self.buyer, product=product)
+        items = WatchlistItem.objects.filter(user=self.buyer).order_by('-added_at')
+        self._assert_parity(items, WatchlistItemSerializer, context={'request': self.request})
+
+        card = Request(APIRequestFactory().get('/api/market/watchlist/', {'view': 'card'}))
+        self._assert_parity(items, WatchlistItemSerializer, context={'request': card})
+
+    def test_conversation_parity(self):
+        from chat.fast_serializers import conversation_list_data
+        from chat.serializers import ConversationSerializer
+        from chat.views import ConversationViewSet
+
+        third = User.objects.create_user(username='third', password='testpass123')
+        with_messages = Conversation.objects.create(product=self.products[0])
+        with_messages.participants.add(third, self.seller, self.buyer)
+        Message.objects.create(conversation=with_messages, sender=self.buyer, content='Hi')
+        Message.objects.create(conversation=with_messages, sender=self.seller, content='Hello "there"')
+        empty = Conversation.objects.create()
+        empty.participants.add(self.buyer)
+
+        request = Request(APIRequestFactory().get('/api/chat/conversations/'))
+        request.user = self.buyer
+        view = ConversationViewSet(request=request, format_kwarg=None)
+        conversations = view.get_queryset()
+
+        expected = JSONRenderer().render(ConversationSerializer(conversations, many=True, context={'request': request}).data)
+        with CaptureQueriesContext(connection) as queries:
+            actual = JSONRenderer().render(conversation_list_data(conversations, request))
+        self.assertEqual(actual, expected)
+        self.assertEqual(len(queries), 4)
+
+    def test_list_endpoints_use_constant_queries(self):
+        client = APIClient()
+        client.force_authenticate(user=self.buyer)
+        for product in self.products:
+            WatchlistItem.objects.create(user=self.buyer, product=product)
+
+        for url in ('/api/market/products/', '/api/market/watchlist/',
+                    f'/api/market/profiles/{self.seller.profile.id}/listings/'):
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            list_queries = [query for query in queries if 'market_product' in query['sql']]
+            self.assertEqual(len(list_queries), 1, url)
+
+    def test_method_fields_are_rejected(self):
+        from chat.serializers import ConversationSerializer
+
+        with self.assertRaises(TypeError):
+            compile_serializer(ConversationSerializer())
+
+
+class JSONBackendTestCase(TestCase):
+    """Golden-output tests: the fast JSON backend must match DRF's JSONRenderer byte for byte."""
+
+    GOLDEN = {
+        'price': Decimal('12.50'),
+        'at': datetime.datetime(2026, 1, 2, 3, 4, 5, 123456, tzinfo=datetime.timezone.utc),
+        'local': datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(timedelta(hours=1))),
+        'day': datetime.date(2026, 1, 2),
+        'title': 'Grüße "quoted" \u2028',
+        'ids': (1, 2),
+        'counts': {7: 1},
+        'empty': None,
+    }
+    GOLDEN_BYTES = (
+        '{"price":12.5,"at":"2026-01-02T03:04:05.123456Z","local":"2026-01-02T03:04:05+01:00",'
+        '"day":"2026-01-02","title":"Grüße \\"quoted\\" \\u2028","ids":[1,2],"counts":{"7":1},"empty":null}'
+    ).encode()
+
+    def _backends(self):
+        yield 'orjson'
+        with patch.object(json_backend, 'orjson', None):
+            yield 'stdlib'
+
+    def test_golden_output(self):
+        for backend in self._backends():
+            with self.subTest(backend=backend):
+                self.assertEqual(json_backend.dumps(self.GOLDEN), self.GOLDEN_BYTES)
+                self.assertEqual(FastJSONRenderer().render(self.GOLDEN), JSONRenderer().render(self.GOLDEN))
+
+    def test_serializer_output_matches_drf(self):
+        seller = User.objects.create_user(username='seller', password='testpass123')
+        Product.objects.create(
+            seller=seller, title='Laptop', description='Fast', price=Decimal('999.90'),
+            image='product_images/laptop.jpg', category=Category.objects.get(name='Laptops'), latitude=48.2
+        )
+        data = ProductSerializer(Product.objects.all(), many=True).data
+        for backend in self._backends():
+            with self.subTest(backend=backend):
+                self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_big_integers_fall_back_to_stdlib(self):
+        self.assertEqual(json_backend.dumps({'n': 2 ** 70}), b'{"n":1180591620717411303424}')
+        self.assertEqual(json_backend.loads(b'{"n":1180591620717411303424}'), {'n': 2 ** 70})
+
+    def test_indent_uses_drf_renderer(self):
+        rendered = FastJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        self.assertEqual(rendered, b'{\n  "a": 1\n}')
+
+    def test_parser(self):
+        for backend in self._backends():
+            with self.subTest(backend=backend):
+                parsed = FastJSONParser().parse(BytesIO('{"title":"Grüße","price":"1.50"}'.encode()))
+                self.assertEqual(parsed, {'title': 'Grüße', 'price': '1.50'})
+                for invalid in (b'{"a":', b'{"a":NaN}', b''):
+                    with self.assertRaises(ParseError):
+                        FastJSONParser().parse(BytesIO(invalid))
+
+    def test_api_uses_fast_renderer_and_parser(self):
+        client = APIClient()
+        user = User.objects.create_user(username='seller', password='testpass123')
+        client.force_authenticate(user=user)
+
+        response = client.post(
+            '/api/market/products/', json.dumps({'title': 'Lamp', 'description': 'Grüße', 'price': '15.50'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)  # Image is required
+        self.assertIn('image', response.json())
+
+        response = client.get('/api/market/products/')
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+
+    def test_chat_consumer_frames(self):
+        import asyncio
+        from chat.consumers import ChatConsumer
+
+        consumer = ChatConsumer()
+        consumer.room_name = '5'
+        consumer.send = MagicMock(side_effect=lambda text_data: asyncio.sleep(0, text_data))
+        asyncio.run(consumer.chat_message({
+            'message': 'Grüße', 'sender_id': 1, 'sender_username': 'seller',
+            'sender_profile_picture': None, 'timestamp': '2026-01-02 03:04:05+00:00'
+        }))
+
+        frame = consumer.send.call_args.kwargs['text_data']
+        self.assertIsInstance(frame, str)
+        self.assertEqual(json.loads(frame), {
+            'type': 'message', 'message': 'Grüße', 'sender_id': 1, 'sender_username': 'seller',
+            'sender_profile_picture': None, 'timestamp': '2026-01-02 03:04:05+00:00', 'conversation': '5'
+        })
+
+
+class WatchlistFlagTestCase(TestCase):
+    """Test cases for the watchlist queries and the is_watched flag on products."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        seller = User.objects.create_user(username='seller', password='testpass123')
+        laptops = Category.objects.get(name='Laptops')
+        self.products = [
+            Product.objects.create(
+                seller=seller, title=f'Laptop {index}', description='', price=Decimal('100.00'),
+                image='product_images/laptop.jpg', category=laptops
+            )
+            for index in range(3)
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def _flags(self):
+        return {product['id']: product['is_watched'] for product in self.client.get('/api/market/products/').data}
+
+    def test_list_flags_watched_products_from_cached_set(self):
+        WatchlistItem.objects.create(user=self.user, product=self.products[1])
+
+        self.assertEqual(self._flags(), {
+            self.products[0].id: False, self.products[1].id: True, self.products[2].id: False
+        })
+        with CaptureQueriesContext(connection) as queries:
+            self._flags()
+        self.assertFalse([query for query in queries if 'market_watchlistitem' in query['sql']])
+
+    def test_add_and_remove_update_the_flag(self):
+        product = self.products[0]
+        self._flags()  # Caches the empty set
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/market/watchlist/', {'product_id': product.id})
+        self.assertTrue(self._flags()[product.id])
+        self.assertTrue(self.client.get(f'/api/market/products/{product.id}/').data['is_watched'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/market/watchlist/{product.id}/')
+        self.assertFalse(self._flags()[product.id])
+
+    def test_anonymous_users_watch_nothing(self):
+        WatchlistItem.objects.create(user=self.user, product=self.products[0])
+        self.client.force_authenticate(user=None)
+
+        self.assertEqual(set(self._flags().values()), {False})
+
+    def test_watchlist_queryset_joins_products(self):
+        for product in self.products:
+            WatchlistItem.objects.create(user=self.user, product=product)
+        from .views import WatchlistViewSet
+        request = Request(APIRequestFactory().get('/api/market/watchlist/'))
+        request.user = self.user
+        items = WatchlistViewSet(request=request, format_kwarg=None).get_queryset()
+
+        with CaptureQueriesContext(connection) as queries:
+            data = WatchlistItemSerializer(items, many=True).data
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(data[0]['product']['category']['name'], 'Laptops')
+
+
+class RecordingChannelLayer:
+    """Channel layer stand-in that records group_send calls."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message))
+
+
+class QueuedExecutor:
+    """Holds submitted work until run_all(), to observe coalescing."""
+
+    def __init__(self):
+        self.queue = []
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self.queue.append((future, fn, args, kwargs))
+        return future
+
+    def run_all(self):
+        while self.queue:
+            future, fn, args, kwargs = self.queue.pop(0)
+            if future.set_running_or_notify_cancel():
+                future.set_result(fn(*args, **kwargs))
+
+
+class WatcherFanoutTestCase(TestCase):
+    """Test cases for price drop and status change notifications to watchers."""
+
+    def setUp(self):
+        self.layer = RecordingChannelLayer()
+        patcher = patch('market.watch_notifications.get_channel_layer', return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.executor_patch = patch.object(watcher_fanout, '_executor', InlineExecutor())
+        self.executor_patch.start()
+        self.addCleanup(self.executor_patch.stop)
+        self.addCleanup(watcher_fanout.reset)
+
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.product = Product.objects.create(
+            seller=self.seller, title='Laptop', description='', price=Decimal('100.00'), image='product_images/laptop.jpg'
+        )
+        self.watchers = [User.objects.create_user(username=f'watcher{index}', password='x') for index in range(5)]
+        for user in self.watchers:
+            WatchlistItem.objects.create(user=user, product=self.product)
+
+    def _save(self, **fields):
+        for field, value in fields.items():
+            setattr(self.product, field, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+
+    def test_price_drop_notifies_every_watcher_once(self):
+        self._save(price=Decimal('80.00'))
+
+        self.assertEqual(sorted(group for group, _ in self.layer.sent), sorted(f'user_{user.id}' for user in self.watchers))
+        self.assertEqual(self.layer.sent[0][1], {
+            'type': 'watchlist.update',
+            'product': {'id': self.product.id, 'title': 'Laptop', 'price': '80.00', 'status': 'AVAILABLE'},
+            'changes': {'price': {'old': '100.00', 'new': '80.00'}},
+        })
+
+    def test_price_increase_and_other_fields_are_silent(self):
+        self._save(price=Decimal('120.00'))
+        self._save(title='Laptop (boxed)')
+
+        self.assertEqual(self.layer.sent, [])
+
+    def test_status_change_notifies(self):
+        self._save(status='SOLD')
+
+        self.assertEqual(len(self.layer.sent), 5)
+        self.assertEqual(self.layer.sent[0][1]['changes'], {'status': {'old': 'AVAILABLE', 'new': 'SOLD'}})
+
+    def test_changes_are_coalesced_until_the_job_runs(self):
+        executor = QueuedExecutor()
+        with patch.object(watcher_fanout, '_executor', executor):
+            self._save(price=Decimal('90.00'))
+            self._save(price=Decimal('70.00'), status='SOLD')
+            self.assertEqual(len(executor.queue), 1)
+            executor.run_all()
+
+        self.assertEqual(len(self.layer.sent), 5)
+        self.assertEqual(self.layer.sent[0][1]['changes'], {
+            'price': {'old': '100.00', 'new': '70.00'}, 'status': {'old': 'AVAILABLE', 'new': 'SOLD'}
+        })
+
+    def test_changes_of_a_cancelled_job_are_sent_by_the_next_one(self):
+        executor = QueuedExecutor()
+        with patch.object(watcher_fanout, '_executor', executor):
+            self._save(price=Decimal('90.00'))
+            executor.queue[0][0].cancel()  # E.g. dropped at interpreter shutdown
+            self._save(price=Decimal('80.00'))
+            self.assertEqual(len(executor.queue), 2)
+            executor.run_all()
+
+        self.assertEqual(len(self.layer.sent), 5)
+        self.assertEqual(self.layer.sent[0][1]['changes'], {'price': {'old': '100.00', 'new': '80.00'}})
+
+    def test_reset_forgets_pending_changes(self):
+        executor = QueuedExecutor()
+        with patch.object(watcher_fanout, '_executor', executor):
+            self._save(price=Decimal('90.00'))
+            watcher_fanout.reset()
+            self._save(price=Decimal('80.00'))
+            executor.run_all()
+
+        self.assertEqual(len(self.layer.sent), 5)
+        self.assertEqual(self.layer.sent[0][1]['changes'], {'price': {'old': '90.00', 'new': '80.00'}})
+
+    def test_watchers_are_streamed_in_chunks_within_the_time_budget(self):
+        fanout = WatcherFanout(chunk_size=2, time_budget=30)
+        fanout._executor = InlineExecutor()
+        fanout.product_changed(self.product.id, {'price': (Decimal('100.00'), Decimal('50.00'))})
+        self.assertEqual(len(self.layer.sent), 5)
+
+        self.layer.sent.clear()
+        fanout.time_budget = 0
+        with self.assertLogs('market.watch_notifications', level='WARNING'):
+            fanout.product_changed(self.product.id, {'price': (Decimal('100.00'), Decimal('50.00'))})
+        self.assertEqual(len(self.layer.sent), 2)  # The first chunk always goes out
+
+    def test_notification_consumer_joins_the_user_group(self):
+        import asyncio
+        from channels.layers import InMemoryChannelLayer
+        from channels.testing import WebsocketCommunicator
+        from rest_framework_simplejwt.tokens import AccessToken
+        from .consumers import NotificationConsumer
+
+        layer = InMemoryChannelLayer()
+        user = self.watchers[0]
+
+        async def exchange():
+            anonymous = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/')
+            rejected, _ = await anonymous.connect()
+
+            communicator = WebsocketCommunicator(
+                NotificationConsumer.as_asgi(), f'/ws/notifications/?token={AccessToken.for_user(user)}'
+            )
+            connected, _ = await communicator.connect()
+            await layer.group_send(f'user_{user.id}', {
+                'type': 'watchlist.update', 'product': {'id': 1}, 'changes': {'status': {'old': 'AVAILABLE', 'new': 'SOLD'}}
+            })
+            frame = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return rejected, connected, frame
+
+        with patch('channels.consumer.get_channel_layer', return_value=layer):
+            rejected, connected, frame = asyncio.run(exchange())
+
+        self.assertFalse(rejected)
+        self.assertTrue(connected)
+        self.assertEqual(frame['type'], 'watchlist_update')
+        self.assertEqual(frame['changes']['status']['new'], 'SOLD')
+
+
+class SavedSearchTestCase(TestCase):
+    """Test cases for saved searches and their percolation against new listings."""
+
+    VIENNA = (48.2082, 16.3738)
+    LINZ = (48.3069, 14.2858)
+
+    def setUp(self):
+        saved_search_percolator.invalidate()
+        self.addCleanup(saved_search_percolator.invalidate)
+        self.layer = RecordingChannelLayer()
+        for patcher in (
+            patch('market.saved_searches.get_channel_layer', return_value=self.layer),
+            patch.object(saved_search_percolator, '_executor', InlineExecutor()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.buyer = User.objects.create_user(username='buyer', password='testpass123')
+        self.laptops = Category.objects.get(name='Laptops')
+        self.books = Category.objects.create(name='Books')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.buyer)
+
+    def _search(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return SavedSearch.objects.create(user=fields.pop('user', self.buyer), **fields)
+
+    def _list(self, location=VIENNA, **fields):
+        fields = {'title': 'ThinkPad X1 laptop', 'price': Decimal('400.00'), 'category': self.laptops, **fields}
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(
+                seller=fields.pop('seller', self.seller), description='Barely used', image='product_images/x1.jpg',
+                latitude=location[0], longitude=location[1], **fields
+            )
+
+    def _notified(self):
+        return [(group, sorted(search['id'] for search in event['searches'])) for group, event in self.layer.sent]
+
+    def test_api_manages_own_searches(self):
+        response = self.client.post('/api/market/saved-searches/', {
+            'name': 'Laptops nearby', 'category': self.laptops.id, 'max_price': '500',
+            'latitude': self.VIENNA[0], 'longitude': self.VIENNA[1], 'radius_km': 25, 'keywords': 'thinkpad',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        SavedSearch.objects.create(user=self.seller, keywords='bike')
+
+        response = self.client.get('/api/market/saved-searches/')
+        self.assertEqual([search['name'] for search in response.data], ['Laptops nearby'])
+
+        response = self.client.post('/api/market/saved-searches/', {'radius_km': 10}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('radius_km', response.data)
+        response = self.client.post('/api/market/saved-searches/', {'min_price': '50', 'max_price': '10'}, format='json')
+        self.assertIn('max_price', response.data)
+
+    def test_new_listing_is_pushed_to_matching_searches(self):
+        subtree = self._search(category=self.laptops.parent, keywords='laptops')  # Plural folded
+        nearby = self._search(latitude=self.VIENNA[0], longitude=self.VIENNA[1], radius_km=20, max_price=Decimal('500'))
+        self._search(category=self.books)
+        self._search(latitude=self.LINZ[0], longitude=self.LINZ[1], radius_km=50)
+        self._search(min_price=Decimal('450'))
+        self._search(keywords='macbook')
+        self._search(user=self.seller)  # Own listings are not pushed
+
+        product = self._list()
+
+        self.assertEqual(self._notified(), [(f'user_{self.buyer.id}', sorted([subtree.id, nearby.id]))])
+        self.assertEqual(self.layer.sent[0][1]['type'], 'saved_search.match')
+        self.assertEqual(self.layer.sent[0][1]['product']['id'], product.id)
+
+    def test_index_follows_search_changes(self):
+        search = self._search(keywords='thinkpad')
+        self._list()
+        self.assertEqual(len(self.layer.sent), 1)
+
+        search.keywords = 'macbook'
+        with self.captureOnCommitCallbacks(execute=True):
+            search.save()
+        self._list()
+        self.assertEqual(len(self.layer.sent), 1)
+
+        other = self._search(keywords='thinkpad')
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self._list()
+        self.assertEqual(len(self.layer.sent), 1)
+
+    def test_candidates_come_from_category_and_tile_buckets(self):
+        anywhere = self._search()
+        subtree = self._search(category=self.laptops.parent)
+        nearby = self._search(latitude=self.VIENNA[0], longitude=self.VIENNA[1], radius_km=10)
+        self._search(category=self.books)
+        self._search(latitude=self.LINZ[0], longitude=self.LINZ[1], radius_km=10)
+
+        product = Product(seller=self.seller, title='Laptop', description='', price=Decimal('1'),
+                          category=self.laptops, latitude=self.VIENNA[0], longitude=self.VIENNA[1])
+        self.assertEqual(saved_search_percolator.candidates(product), {anywhere.id, subtree.id, nearby.id})
+
+    def test_bulk_import_percolates_new_listings(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        os.makedirs(os.path.join(media_root, 'product_images'))
+        Image.new('RGB', (8, 8)).save(os.path.join(media_root, 'product_images', 't14.jpg'), 'JPEG')
+        self._search(keywords='thinkpad')
+
+        self.client.force_authenticate(user=self.seller)
+        csv_data = 'title,description,price,category,image\nThinkPad T14,,300,,product_images/t14.jpg\n'
+        with self.settings(MEDIA_ROOT=media_root), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/market/products/import/', {'file': SimpleUploadedFile('products.csv', csv_data.encode())}
+            )
+            self.assertIn(b'"created"', b''.join(response.streaming_content))
+        self.assertEqual(len(self.layer.sent), 1)
+
+
+class EngagementCounterTestCase(TestCase):
+    """Test cases for the write-behind product engagement counters."""
+
+    def setUp(self):
+        for attribute, value in (
+            ('_pending', defaultdict(lambda: [0] * len(COUNTERS))), ('_trending', {}), ('_pending_total', 0)
+        ):
+            patcher = patch.object(engagement_counters, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.products = [
+            Product.objects.create(seller=self.seller, title=f'Item {index}', description='', price=Decimal('10.00'),
+                                   image='product_images/item.jpg')
+            for index in range(3)
+        ]
+        self.client = APIClient()
+
+    def _engagement(self, product):
+        return self.client.get(f'/api/market/products/{product.id}/detail/').data['engagement']
+
+    def test_requests_only_buffer_counts(self):
+        product = self.products[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/api/market/products/{product.id}/detail/')
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries))
+        self.client.get('/api/market/products/')
+        response = self.client.post(f'/api/market/products/{product.id}/click/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.post('/api/market/products/999999/click/').status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertFalse(ProductEngagement.objects.exists())
+        self.assertEqual(self._engagement(product), {'views': 2, 'impressions': 1, 'clicks': 1})
+
+    def test_detail_with_sparse_fields_counts_the_view(self):
+        product = self.products[0]
+        response = self.client.get(f'/api/market/products/{product.id}/detail/', {'fields': 'title'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], 'Item 0')
+        self.assertEqual(response.data['engagement'], {'views': 1, 'impressions': 0, 'clicks': 0})
+
+    @override_settings(ENGAGEMENT_LIST_IMPRESSIONS=2)
+    def test_list_counts_impressions_of_the_leading_products(self):
+        response = self.client.get('/api/market/products/')
+
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(
+            set(engagement_counters.pending([product.id for product in self.products])),
+            {item['id'] for item in response.data[:2]}
+        )
+
+    def test_flush_writes_all_products_in_one_update(self):
+        engagement_counters.record('impressions', [product.id for product in self.products])
+        engagement_counters.record('views', [self.products[0].id, self.products[0].id])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(engagement_counters.flush(), 3)
+        updates = [query['sql'].split()[1] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(updates, ['"market_productengagement"', '"market_product"'])  # Counters, then view scores
+
+        engagement_counters.record('views', [self.products[0].id])
+        engagement_counters.flush()
+        self.assertEqual(
+            dict(ProductEngagement.objects.values_list('product_id', 'views')),
+            {self.products[0].id: 3, self.products[1].id: 0, self.products[2].id: 0}
+        )
+        self.assertEqual(engagement_counters.flush(), 0)
+
+        # Saving a listing leaves its counts alone
+        self.products[0].title = 'Renamed'
+        self.products[0].save()
+        self.assertEqual(self._engagement(self.products[0]), {'views': 4, 'impressions': 1, 'clicks': 0})
+
+    def test_failed_flush_keeps_counts_and_deleted_products_are_dropped(self):
+        engagement_counters.record('clicks', [self.products[0].id, self.products[1].id])
+        with patch.object(engagement_counters, '_write', side_effect=RuntimeError('database is locked')):
+            with self.assertLogs('market.engagement', level='ERROR'):
+                self.assertEqual(engagement_counters.flush(), 0)
+        self.assertEqual(engagement_counters.pending([self.products[0].id]), {
+            self.products[0].id: {'views': 0, 'impressions': 0, 'clicks': 1}
+        })
+
+        self.products[1].delete()
+        self.assertEqual(engagement_counters.flush(), 1)
+        self.assertEqual(list(ProductEngagement.objects.values_list('product_id', 'clicks')), [(self.products[0].id, 1)])
+
+    def test_full_buffer_wakes_the_flusher(self):
+        counters = EngagementCounters(flush_interval=60, max_pending=3)
+        counters.record('impressions', [1, 2])
+        self.assertFalse(counters._wake.is_set())
+        counters.record('views', [1])
+        self.assertTrue(counters._wake.is_set())
+
+    def test_seller_profile_sums_listing_counts(self):
+        engagement_counters.record('views', [self.products[0].id, self.products[1].id])
+        engagement_counters.flush()
+        engagement_counters.record('clicks', [self.products[2].id])
+
+        response = self.client.get(f'/api/market/profiles/{self.seller.profile.id}/')
+        self.assertEqual(response.data['listing_engagement'], {'views': 2, 'impressions': 0, 'clicks': 1})
+
+    def test_listing_totals_take_constant_queries(self):
+        def totals_queries():
+            with CaptureQueriesContext(connection) as queries:
+                totals = engagement_counters.totals(self.seller.products.all())
+            return totals, len(queries)
+
+        engagement_counters.record('views', [product.id for product in self.products])
+        engagement_counters.flush()
+        engagement_counters.record('clicks', [self.products[0].id])
+        totals, count = totals_queries()
+        for index in range(20):
+            Product.objects.create(seller=self.seller, title=f'More {index}', description='', price=Decimal('1.00'),
+                                   image='product_images/item.jpg')
+
+        self.assertEqual(totals, {'views': 3, 'impressions': 0, 'clicks': 1})
+        self.assertEqual(count, 2)  # Stored sums, then which buffered products are listed
+        self.assertEqual(totals_queries(), (totals, count))
+
+
+class TrendingOrderingTestCase(TestCase):
+    """Test cases for the incrementally maintained trending score and ?ordering=trending."""
+
+    def setUp(self):
+        for attribute, value in (
+            ('_pending', defaultdict(lambda: [0] * len(COUNTERS))), ('_trending', {}), ('_pending_total', 0)
+        ):
+            patcher = patch.object(engagement_counters, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.buyer = User.objects.create_user(username='buyer', password='testpass123')
+        self.products = [
+            Product.objects.create(seller=self.seller, title=f'Item {index}', description='', price=Decimal('10.00'),
+                                   image='product_images/item.jpg')
+            for index in range(4)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.buyer)
+
+    def _trending_ids(self, **params):
+        response = self.client.get('/api/market/products/', {'ordering': 'trending', **params})
+        return [product['id'] for product in response.data]
+
+    def test_scores_decay_without_rewrites(self):
+        now = 1_800_000_000
+        # An offer (weight 10) one half-life ago counts as much as a watchlist add (5) now
+        self.assertAlmostEqual(trending_value('offers', now - TRENDING_HALF_LIFE), trending_value('watchlist_adds', now))
+        two_views = log2_add(trending_value('views', now), trending_value('views', now))
+        self.assertAlmostEqual(two_views, trending_value('views', now) + 1)
+        self.assertIsNone(log2_add(None, None))
+
+    def test_events_update_scores_and_ordering(self):
+        first, second, third, unseen = self.products
+        with self.captureOnCommitCallbacks(execute=True):
+            WatchlistItem.objects.create(user=self.buyer, product=second)
+            response = self.client.post('/api/chat/conversations/', {'user_id': self.seller.id, 'product_id': first.id})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            Offer.objects.create(conversation=Conversation.objects.get(product=first), product=first,
+                                 buyer=self.buyer, seller=self.seller, amount=Decimal('8.00'))
+        engagement_counters.record('views', [third.id])
+        self.assertEqual(self._trending_ids(), [])  # Scores are written by the flush
+
+        engagement_counters.flush()
+        self.assertEqual(self._trending_ids(), [first.id, second.id, third.id])
+        self.assertNotIn(unseen.id, self._trending_ids())
+
+        with self.settings(TRENDING_LIMIT=2):
+            self.assertEqual(self._trending_ids(), [first.id, second.id])
+        third.status = 'SOLD'
+        third.save()
+        self.assertEqual(self._trending_ids(), [first.id, second.id])
+
+    def test_saving_a_loaded_product_keeps_its_score(self):
+        product = Product.objects.get(pk=self.products[0].pk)
+        engagement_counters.record_trending('offers', product.id)
+        engagement_counters.flush()
+
+        product.title = 'Renamed'
+        product.save()  # Its in-memory trending_score is still None
+        product.refresh_from_db()
+        self.assertEqual(product.title, 'Renamed')
+        self.assertIsNotNone(product.trending_score)
+
+
+class SimilarListingsTestCase(TestCase):
+    """Test cases for the precomputed similar listings and GET /products/<id>/similar/."""
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.buyer = User.objects.create_user(username='buyer', password='testpass123')
+        computers = Category.objects.create(name='Test Computers')
+        self.laptops = Category.objects.create(name='Test Laptops', parent=computers)
+        self.monitors = Category.objects.create(name='Test Monitors', parent=computers)
+        self.bikes = Category.objects.create(name='Test Bikes')
+        self.thinkpad = self._product('ThinkPad T480 laptop', self.laptops, '400.00')
+        self.other_thinkpad = self._product('ThinkPad X1 Carbon laptop', self.laptops, '650.00')
+        self.gaming = self._product('Gaming laptop', self.laptops, '900.00')
+        self.monitor = self._product('Dell monitor 27 inch', self.monitors, '150.00')
+        self.bike = self._product('Road bike', self.bikes, '300.00')
+        self.client = APIClient()
+
+    def _product(self, title, category, price, **fields):
+        return Product.objects.create(seller=self.seller, title=title, description='', price=Decimal(price),
+                                      category=category, image='product_images/item.jpg', **fields)
+
+    def _similar_ids(self, product):
+        response = self.client.get(f'/api/market/products/{product.id}/similar/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.data]
+
+    def test_neighbours_ranked_by_title_and_category(self):
+        self.assertEqual(build_similar_listings(), (5, Product.objects.count()))
+        similar = self._similar_ids(self.thinkpad)
+        self.assertEqual(similar[:2], [self.other_thinkpad.id, self.gaming.id])
+        # Candidates share a title term, a category or users; self and unrelated products are not
+        self.assertNotIn(self.thinkpad.id, similar)
+        self.assertNotIn(self.bike.id, similar)
+
+    def test_users_in_common_add_similarity(self):
+        build_similar_listings()
+        self.assertEqual(self._similar_ids(self.bike), [])
+        for index in range(3):
+            user = User.objects.create_user(username=f'watcher{index}', password='testpass123')
+            WatchlistItem.objects.create(user=user, product=self.bike)
+            WatchlistItem.objects.create(user=user, product=self.monitor)
+        build_similar_listings()
+        self.assertEqual(self._similar_ids(self.bike)[0], self.monitor.id)
+        self.assertEqual(self._similar_ids(self.monitor)[0], self.bike.id)
+
+    def test_endpoint_reads_two_queries_and_hides_sold(self):
+        build_similar_listings()
+        with self.assertNumQueries(2):
+            similar = self._similar_ids(self.thinkpad)
+        self.assertEqual(similar, [self.other_thinkpad.id, self.gaming.id])
+        self.other_thinkpad.status = 'SOLD'
+        self.other_thinkpad.save()
+        self.assertNotIn(self.other_thinkpad.id, self._similar_ids(self.thinkpad))
+
+    def test_unknown_product_is_404(self):
+        for product_id in ('999999', 'abc'):
+            response = self.client.get(f'/api/market/products/{product_id}/similar/')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, product_id)
+
+    def test_incremental_build_refreshes_affected_products_only(self):
+        build_similar_listings()
+        self.assertEqual(build_similar_listings(), (0, Product.objects.count()))
+
+        new = self._product('ThinkPad T14 laptop', self.laptops, '500.00')
+        refreshed, _ = build_similar_listings()
+        self.assertIn(self.thinkpad.id, self._similar_ids(new))
+        self.assertIn(new.id, self._similar_ids(self.thinkpad))  # Offered to its own neighbours
+        self.assertLess(refreshed, Product.objects.count())
+
+        Product.objects.filter(pk=self.gaming.pk).update(status='SOLD')
+        build_similar_listings()
+        self.assertFalse(SimilarProduct.objects.filter(neighbour=self.gaming).exclude(product=self.gaming).exists())
+
+    def test_build_command(self):
+        out = StringIO()
+        call_command('build_similar_listings', '--rebuild', stdout=out)
+        self.assertIn('Refreshed similar listings of 5 of 5 products', out.getvalue())
+        self.assertEqual(SimilarProduct.objects.filter(product=self.thinkpad, rank=0).get().neighbour, self.other_thinkpad)
+
+
+class DuplicateImageTestCase(TestCase):
+    """Test cases for perceptual hashes of listing photos and the near-duplicate index."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = self.settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        duplicate_image_index.invalidate()
+        self.addCleanup(duplicate_image_index.invalidate)
+
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.seller)
+        self.original = self._product('Mandelbrot print', self._image())
+
+    def _image(self, size=256, extent=(-2, -1.5, 1, 1.5), quality=90):
+        """Structured test image (flat colours all share the same perceptual hash)"""
+        image = Image.effect_mandelbrot((256, 256), extent, 100).resize((size, size))
+        image_io = BytesIO()
+        image.convert('RGB').save(image_io, 'JPEG', quality=quality)
+        return SimpleUploadedFile('print.jpg', image_io.getvalue(), content_type='image/jpeg')
+
+    def _product(self, title, image, **fields):
+        return Product.objects.create(seller=self.seller, title=title, description='', price=Decimal('20.00'),
+                                      image=image, **fields)
+
+    def test_uploads_are_hashed_on_save(self):
+        self.assertIsNotNone(self.original.image_hash)
+        stored = Product.objects.get(pk=self.original.pk)
+        with stored.image.open('rb') as image:
+            self.assertEqual(image_hashing.stored_dhash(image), self.original.image_hash)
+
+        by_path = self._product('Existing image', 'product_images/item.jpg')
+        self.assertIsNone(by_path.image_hash)
+        stored.title = 'Renamed'
+        stored.save()  # An already stored image is not hashed again
+        self.assertEqual(Product.objects.get(pk=stored.pk).image_hash, self.original.image_hash)
+
+    def test_finds_reencoded_copies_within_radius(self):
+        copy = self._product('Mandelbrot print (repost)', self._image(size=180, quality=40))
+        other = self._product('Other print', self._image(extent=(-0.8, 0, -0.4, 0.4)))
+        sold = self._product('Sold print', self._image(size=200), status='SOLD')
+
+        value = image_hashing.from_signed(self.original.image_hash)
+        matches = duplicate_image_index.find(value, exclude=self.original.pk)
+        self.assertEqual([product_id for product_id, _ in matches], [copy.pk])
+        self.assertLessEqual(matches[0][1], settings.DUPLICATE_IMAGE_MAX_DISTANCE)
+        self.assertNotIn(sold.pk, dict(duplicate_image_index.find(value, max_distance=64)))
+        self.assertEqual(set(duplicate_image_index.duplicates()), {self.original.pk, copy.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.delete()
+            other.status = 'SOLD'
+            other.save()
+        self.assertEqual(duplicate_image_index.find(value, exclude=self.original.pk), [])
+
+    def test_index_matches_linear_scan(self):
+        index = DuplicateImageIndex()
+        index._loaded = True
+        rng = random.Random(7)
+        hashes = [rng.getrandbits(64) for _ in range(2000)]
+        for product_id, value in enumerate(hashes):
+            index._add(product_id, value)
+        for max_distance in (0, 3, 6, 9):
+            for value in hashes[:20]:
+                expected = sorted(
+                    (image_hashing.hamming_distance(value, other), product_id)
+                    for product_id, other in enumerate(hashes)
+                    if image_hashing.hamming_distance(value, other) <= max_distance
+                )
+                found = index.find(value, max_distance)
+                self.assertEqual([(distance, product_id) for product_id, distance in found], expected)
+
+    def test_create_warns_about_duplicates(self):
+        response = self.client.post('/api/market/products/', {
+            'title': 'Mandelbrot poster', 'description': 'Reposted', 'price': '25.00', 'image': self._image(size=300),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [(item['id'], item['title'], item['seller_id']) for item in response.data['possible_duplicates']],
+            [(self.original.pk, 'Mandelbrot print', self.seller.pk)]
+        )
+
+        with self.settings(DUPLICATE_IMAGE_WARNING_LIMIT=0):
+            response = self.client.post('/api/market/products/', {
+                'title': 'Another poster', 'description': 'Reposted', 'price': '25.00', 'image': self._image(size=300),
+            }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['possible_duplicates'], [])
+
+    def test_create_with_sparse_fields(self):
+        response = self.client.post('/api/market/products/?fields=title', {
+            'title': 'Mandelbrot poster', 'description': 'Reposted', 'price': '25.00', 'image': self._image(size=300),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['title'], 'Mandelbrot poster')
+        self.assertNotIn('id', response.data)
+        self.assertEqual([item['id'] for item in response.data['possible_duplicates']], [self.original.pk])
+
+    def test_admin_report(self):
+        copy = self._product('Mandelbrot print (repost)', self._image(size=180, quality=40))
+        self._product('Other print', self._image(extent=(-0.8, 0, -0.4, 0.4)))
+        admin_user = User.objects.create_superuser(username='admin', password='testpass123')
+        self.client.force_login(admin_user)
+
+        response = self.client.get('/admin/market/product/', {'duplicates': 'yes'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({product.pk for product in response.context['cl'].result_list}, {self.original.pk, copy.pk})
+        self.assertContains(response, f'/admin/market/product/{copy.pk}/change/')
+
+    def test_backfill_command(self):
+        Product.objects.filter(pk=self.original.pk).update(image_hash=None)
+        out = StringIO()
+        call_command('hash_product_images', stdout=out)
+        self.assertIn('Hashed 1 of 1 product images', out.getvalue())
+        self.assertIn('Restart the backend', out.getvalue())
+        self.assertEqual(Product.objects.get(pk=self.original.pk).image_hash, self.original.image_hash)
+
+
+class SuggestionIndexTestCase(TestCase):
+    """Test cases for search box autocomplete and GET /products/suggest/."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        override = self.settings(SUGGEST_INDEX_PATH=os.path.join(directory, 'suggest_index.bin'),
+                                 SUGGEST_REBUILD_INTERVAL=3600)
+        override.enable()
+        self.addCleanup(override.disable)
+        suggestion_index.invalidate()
+        self.addCleanup(suggestion_index.invalidate)
+        self.executor = QueuedExecutor()
+        # Other background jobs of product saves run inline so they leave no pending state behind
+        for target, executor in ((suggestion_index, self.executor), (saved_search_percolator, InlineExecutor()),
+                                 (watcher_fanout, InlineExecutor())):
+            patcher = patch.object(target, '_executor', executor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.gear = Category.objects.create(name='Roadgoing gear')
+        self.bikes = [self._product('Road bike'), self._product('road  BIKE')]
+        self.helmet = self._product('Road helmet')
+        self._product('Floor pump')
+        for index in range(2):
+            watcher = User.objects.create_user(username=f'watcher{index}', password='testpass123')
+            WatchlistItem.objects.create(user=watcher, product=self.helmet)
+        self._product('Road trip cooler', status='SOLD')
+        self._product('Café racer jacket', category=None)
+
+    def _product(self, title, **fields):
+        fields.setdefault('category', self.gear)
+        return Product.objects.create(seller=self.seller, title=title, description='', price=Decimal('50.00'),
+                                      image='product_images/item.jpg', **fields)
+
+    def _texts(self, prefix, count=8):
+        return [item['text'] for item in suggestion_index.suggest(prefix, count)]
+
+    def test_ranks_titles_and_categories_by_popularity(self):
+        suggestions = suggestion_index.suggest('road')
+        # Category: 4 listings under it; helmet: 1 listing + 2 watchers; bike: 2 listings
+        self.assertEqual([item['text'] for item in suggestions], ['Roadgoing gear', 'Road helmet', 'Road bike'])
+        self.assertEqual(suggestions[0], {'text': 'Roadgoing gear', 'kind': 'category', 'category_id': self.gear.id})
+        self.assertEqual(suggestions[2], {'text': 'Road bike', 'kind': 'title'})
+        self.assertEqual(self._texts('road', 1), ['Roadgoing gear'])
+        self.assertEqual(self._texts('road '), ['Road helmet', 'Road bike'])
+        self.assertEqual(self._texts('road t'), [])  # Sold listings are not suggested
+
+    def test_matches_word_starts_without_accents(self):
+        self.assertEqual(self._texts('bik'), ['Road bike'])
+        self.assertEqual(self._texts('racer'), ['Café racer jacket'])
+        self.assertEqual(self._texts('CAFE R'), ['Café racer jacket'])
+        self.assertEqual(self._texts('cafés'), [])
+        self.assertEqual(self._texts('  '), [])
+
+    def test_changes_apply_before_the_snapshot_is_rebuilt(self):
+        self.assertEqual(self._texts('tandem'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self._product('Tandem bicycle')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.helmet.title = 'Road racing helmet'
+            self.helmet.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            for bike in self.bikes:
+                bike.status = 'SOLD'
+                bike.save()
+        self.assertEqual(self._texts('tandem'), ['Tandem bicycle'])
+        self.assertEqual(self._texts('road '), ['Road racing helmet'])
+        self.assertEqual(self._texts('bike'), [])
+        self.assertEqual(len(self.executor.queue), 1)  # One rebuild for all changes
+
+        self.executor.run_all()
+        self.assertEqual(suggestion_index._overlay, [])
+        self.assertEqual(self._texts('tandem'), ['Tandem bicycle'])
+        self.assertEqual(self._texts('road '), ['Road racing helmet'])
+        self.assertEqual(self._texts('bike'), [])
+
+    def test_processes_map_a_rebuilt_snapshot(self):
+        self.assertEqual(self._texts('tandem'), [])
+        Product.objects.create(seller=self.seller, title='Tandem bicycle', description='', price=Decimal('90.00'),
+                               image='product_images/item.jpg')
+        other_process = SuggestionIndex()
+        other_process.rebuild()
+        self.assertEqual(self._texts('tandem'), [])  # Until the file is checked again
+        suggestion_index._checked_at = 0
+        self.assertEqual(self._texts('tandem'), ['Tandem bicycle'])
+
+    def test_suggest_endpoint(self):
+        client = APIClient()
+        response = client.get('/api/market/products/suggest/', {'prefix': 'Road h'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{'text': 'Road helmet', 'kind': 'title'}])
+        self.assertEqual(len(client.get('/api/market/products/suggest/', {'prefix': 'r', 'limit': 2}).data), 2)
+        self.assertEqual(client.get('/api/market/products/suggest/').data, [])
+        response = client.get('/api/market/products/suggest/', {'prefix': 'r', 'limit': 'many'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_lookups_match_a_linear_scan(self):
+        out = StringIO()
+        call_command('benchmark_suggestions', suggestions=3000, lookups=200, stdout=out)
+        self.assertIn('Same suggestions', out.getvalue())
+
+
+class ProductSearchTestCase(TestCase):
+    """Test cases for the trigram product search index, ?search= and the admin search."""
+
+    def setUp(self):
+        product_search_index.invalidate()
+        self.addCleanup(product_search_index.invalidate)
+        # Background jobs of product saves run inline so they leave no pending state behind
+        for target in (saved_search_percolator, watcher_fanout):
+            patcher = patch.object(target, '_executor', InlineExecutor())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.shoes = Category.objects.create(name='Test Shoes')
+        self.sneakers = self._product('Adidas Superstar sneakers', category=self.shoes)
+        self.jacket = self._product('Adidas rain jacket')
+        self.described = self._product('Running shoes', description='Barely worn adidas, size 42',
+                                       category=self.shoes)
+        self.sold = self._product('Adidas Gazelle', status='SOLD')
+        self._product('Nike Air Max')
+
+    def _product(self, title, description='Good condition', **fields):
+        return Product.objects.create(seller=self.seller, title=title, description=description,
+                                      price=Decimal('40.00'), image='product_images/item.jpg', **fields)
+
+    def _ids(self, query, **kwargs):
+        return [product_id for product_id, _ in product_search_index.search(query, **kwargs)]
+
+    def test_misspelled_queries_rank_by_similarity(self):
+        self.assertEqual(self._ids('addidas sneakrs')[0], self.sneakers.id)
+        self.assertEqual(self._ids('adidsa')[-1], self.described.id)  # Description matches count half
+        self.assertEqual(set(self._ids('adidsa')), {self.sneakers.id, self.jacket.id, self.described.id})
+        self.assertIn(self.sold.id, self._ids('adidas gazele', available_only=False))
+        self.assertNotIn(self.sold.id, self._ids('adidas gazele'))
+        self.assertEqual(self._ids('xyz'), [])
+        self.assertEqual(self._ids('  '), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.assertEqual(self._ids('reebok'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            reebok = self._product('Reebok Classic')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jacket.title = 'Patagonia rain jacket'
+            self.jacket.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sneakers.status = 'SOLD'
+            self.sneakers.save()
+        self.assertEqual(self._ids('rebok'), [reebok.id])
+        self.assertEqual(self._ids('adidas'), [self.described.id])
+        self.assertEqual(self._ids('patagonia'), [self.jacket.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reebok.delete()
+        self.assertEqual(self._ids('reebok', available_only=False), [])
+
+    def test_candidates_are_bounded(self):
+        for index in range(30):
+            self._product(f'Adidas cap {index}')
+        self.assertEqual(len(self._ids('adidas', max_candidates=10)), 10)
+        self.assertEqual(len(self._ids('adidas', limit=5)), 5)
+
+    def test_search_parameter_orders_the_list(self):
+        client = APIClient()
+        response = client.get('/api/market/products/', {'search': 'adidas sneakres'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['id'], self.sneakers.id)
+        self.assertNotIn(self.sold.id, [item['id'] for item in response.data])
+        response = client.get('/api/market/products/', {'search': 'adiddas', 'category': self.shoes.id})
+        self.assertEqual([item['id'] for item in response.data], [self.sneakers.id, self.described.id])
+        self.assertEqual(client.get('/api/market/products/', {'search': 'qqqq'}).data, [])
+
+    def test_admin_search_uses_the_index(self):
+        admin_user = User.objects.create_superuser(username='admin', password='testpass123')
+        self.client.force_login(admin_user)
+        response = self.client.get('/admin/market/product/', {'q': 'gazele'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'/admin/market/product/{self.sold.pk}/change/')
+        self.assertNotContains(response, f'/admin/market/product/{self.jacket.pk}/change/')
+        response = self.client.get('/admin/market/product/', {'q': 'seller'})
+        self.assertContains(response, '5 products')
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_product_search', products=2000, queries=50, stdout=out)
+        self.assertIn('trigram index', out.getvalue())
+
+
+class AvailableProductIndexTestCase(TestCase):
+    """Test cases for the partial indexes that keep SOLD products out of the feed's reads."""
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.buyer = User.objects.create_user(username='buyer', password='testpass123')
+        self.category = Category.objects.create(name='Test Lamps')
+        self.available = [self._product(f'Lamp {index}') for index in range(3)]
+        self.sold = [
+            self._product(f'Sold lamp {index}', status='SOLD', buyer=self.buyer, sold_at=timezone.now())
+            for index in range(5)
+        ]
+        self.client = APIClient()
+
+    def _product(self, title, **fields):
+        return Product.objects.create(seller=self.seller, title=title, description='', price=Decimal('25.00'),
+                                      category=self.category, image='product_images/item.jpg', **fields)
+
+    def _feed_plan(self, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/market/products/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sql = next(query['sql'] for query in queries if query['sql'].startswith('SELECT') and 'FROM "market_product"' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return ' '.join(row[-1] for row in cursor.fetchall())
+
+    def test_feed_reads_the_available_product_indexes(self):
+        self.assertIn('USING INDEX product_avail_created_idx', self._feed_plan({}))
+        self.assertIn('USING INDEX product_avail_category_idx', self._feed_plan({'category': self.category.id}))
+        self.assertIn('USING INDEX product_avail_trending_idx', self._feed_plan({'ordering': 'trending'}))
+
+    def test_sold_products_are_still_read_from_the_same_table(self):
+        feed = [item['id'] for item in self.client.get('/api/market/products/').data]
+        self.assertEqual(feed, [product.id for product in reversed(self.available)])
+
+        self.client.force_authenticate(user=self.buyer)
+        purchases = self.client.get('/api/market/profiles/purchases/').data
+        self.assertEqual({item['id'] for item in purchases}, {product.id for product in self.sold})
+        listings = self.client.get(f'/api/market/profiles/{self.seller.profile.id}/listings/').data
+        self.assertEqual(len(listings), 8)
+        self.assertEqual(self.client.get(f'/api/market/products/{self.sold[0].id}/').data['status'], 'SOLD')
+
+
+class ProductChangeFeedTestCase(TestCase):
+    """Test cases for the product change log and GET /products/changes/."""
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='testpass123')
+        self.products = [self._product(f'Chair {index}') for index in range(3)]
+        self.client = APIClient()
+
+    def _product(self, title, **fields):
+        return Product.objects.create(seller=self.seller, title=title, description='', price=Decimal('30.00'),
+                                      image='product_images/item.jpg', **fields)
+
+    def _changes(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        response = self.client.get('/api/market/products/changes/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_changes_since_a_token(self):
+        start = self._changes()
+        self.assertEqual((start['changed'], start['deleted'], start['has_more']), ([], [], False))
+
+        chair, stool, table = self.products
+        new = self._product('Sofa')
+        stool.price = Decimal('25.00')
+        stool.save()
+        table.status = 'SOLD'
+        table.save()
+        chair_id = chair.id
+        chair.delete()
+
+        changes = self._changes(start['next'])
+        self.assertEqual([item['id'] for item in changes['changed']], [new.id, stool.id, table.id])
+        self.assertEqual(changes['changed'][1]['price'], '25.00')
+        self.assertEqual(changes['changed'][2]['status'], 'SOLD')
+        self.assertEqual(changes['deleted'], [chair_id])
+        self.assertEqual(list(ProductChange.objects.values_list('action', flat=True))[-4:],
+                         [ProductChange.CREATED, ProductChange.UPDATED, ProductChange.SOLD, ProductChange.DELETED])
+        self.assertEqual(self._changes(changes['next'])['changed'], [])
+
+        sparse = self._changes(start['next'], fields='title')
+        self.assertEqual(sparse['changed'][0], {'id': new.id, 'title': 'Sofa'})
+
+    @override_settings(CHANGE_FEED_PAGE_SIZE=2)
+    def test_pages_through_many_changes(self):
+        token = self._changes()['next']
+        created = [self._product(f'Lamp {index}').id for index in range(5)]
+        seen, pages = [], 0
+        while True:
+            changes = self._changes(token)
+            seen += [item['id'] for item in changes['changed']]
+            token, pages = changes['next'], pages + 1
+            if not changes['has_more']:
+                break
+        self.assertEqual(seen, created)
+        self.assertEqual(pages, 3)
+
+    def test_invalid_and_expired_tokens(self):
+        for since in ('yesterday', '1.100000000000000000000', '1.-100', '1.99999999999999'):
+            response = self.client.get('/api/market/products/changes/', {'since': since})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, since)
+        old = change_log.make_token(0, timezone.now() - timedelta(days=settings.CHANGE_LOG_RETENTION_DAYS + 1))
+        response = self.client.get('/api/market/products/changes/', {'since': old})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_compaction_keeps_what_clients_need(self):
+        token = self._changes()['next']
+        chair, stool, _ = self.products
+        for price in ('28.00', '26.00', '24.00'):
+            chair.price = Decimal(price)
+            chair.save()
+        stool_id = stool.id
+        stool.delete()
+        ProductChange.objects.filter(id__lte=int(token.split('.')[0])).update(
+            created_at=timezone.now() - timedelta(days=settings.CHANGE_LOG_RETENTION_DAYS + 1)
+        )
+
+        out = StringIO()
+        call_command('compact_product_changes', batch_size=2, stdout=out)
+        self.assertIn('Dropped 2 superseded and 3 expired entries', out.getvalue())
+        self.assertEqual(
+            list(ProductChange.objects.values_list('product_id', 'action')),
+            [(chair.id, ProductChange.UPDATED), (stool_id, ProductChange.DELETED)]
+        )
+        changes = self._changes(token)
+        self.assertEqual([(item['id'], item['price']) for item in changes['changed']], [(chair.id, '24.00')])
+        self.assertEqual(changes['deleted'], [stool_id])
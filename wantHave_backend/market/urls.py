@@ -3,8 +3,8 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     UserProfileViewSet, ProductViewSet, ProductDetailView,
     CategoryViewSet, RegisterView, OrderViewSet, stripe_webhook,
-    UserViewSet, AIAutofillView, ChangePasswordView, ChangeEmailView, ChangeUsernameView,
-    WatchlistViewSet
+    UserViewSet, AIAutofillView, AIAutofillBatchView, AIAutofillJobView, AIAutofillJobStatusView,
+    ChangePasswordView, ChangeEmailView, ChangeUsernameView, WatchlistViewSet, SavedSearchViewSet
 )
 
 router = DefaultRouter()
@@ -14,9 +14,13 @@ router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'users', UserViewSet, basename='user')
 router.register(r'watchlist', WatchlistViewSet, basename='watchlist')
+router.register(r'saved-searches', SavedSearchViewSet, basename='saved-search')
 
 urlpatterns = [
     path('products/autofill/', AIAutofillView.as_view(), name='product-autofill'),
+    path('products/autofill/batch/', AIAutofillBatchView.as_view(), name='product-autofill-batch'),
+    path('products/autofill/jobs/', AIAutofillJobView.as_view(), name='product-autofill-jobs'),
+    path('products/autofill/jobs/<str:job_id>/', AIAutofillJobStatusView.as_view(), name='product-autofill-job'),
     path('', include(router.urls)),
     path('products/<int:pk>/detail/', ProductDetailView.as_view(), name='product-detail'),
     path('register/', RegisterView.as_view(), name='register'),
@@ -2,21 +2,32 @@ from rest_framework import viewsets, permissions, status, generics, views, parse
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from django.db import models as django_models
 from django.utils import timezone
-import stripe
 
 from .serializers import (
     UserProfileSerializer, UserProfileUpdateSerializer,
     ProductSerializer, MyTokenObtainPairSerializer, CategorySerializer,
     RegisterSerializer, OrderSerializer, CheckoutSessionSerializer,
-    WatchlistItemSerializer
+    WatchlistItemSerializer, SavedSearchSerializer, requested_fields
 )
-from .models import UserProfile, Product, Category, Order, StripeWebhookEvent, WatchlistItem
-from .stripe_service import StripeService
+from .models import UserProfile, Product, Category, Order, StripeWebhookEvent, WatchlistItem, SavedSearch
+from .renderers import NDJSONRenderer, EventStreamRenderer, CSVRenderer
+from .fast_serializers import FastListMixin, serialize_queryset
+from . import change_log
+from .duplicate_images import possible_duplicates
+from .engagement import engagement_counters
+from .product_search import product_search_index
+from .suggestions import MAX_SUGGESTIONS, suggestion_index
+import os
+import zipfile
 import requests
 
 
@@ -56,7 +67,7 @@ class RegisterView(generics.CreateAPIView):
     permission_classes = [permissions.AllowAny]
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(FastListMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all().order_by('-created_at')
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -79,8 +90,110 @@ class ProductViewSet(viewsets.ModelViewSet):
             category_ids = category.descendant_ids(include_self=True)
             queryset = queryset.filter(category_id__in=category_ids)
 
+        search = self.request.query_params.get('search', '').strip() if self.action == 'list' else ''
+        if search:
+            # Typo-tolerant: best trigram matches first (see market.product_search)
+            product_ids = [product_id for product_id, _ in product_search_index.search(search[:200])]
+            queryset = queryset.filter(id__in=product_ids).order_by(
+                django_models.Case(*(django_models.When(id=product_id, then=rank)
+                                     for rank, product_id in enumerate(product_ids)))
+            ) if product_ids else queryset.none()
+
+        trending = self.action == 'list' and self.request.query_params.get('ordering') == 'trending'
+        if trending:
+            # Products without any event are not trending
+            queryset = queryset.filter(trending_score__isnull=False).order_by('-trending_score')
+
+        if self.action in ('list', 'retrieve'):
+            queryset = ProductSerializer.optimize_queryset(
+                queryset, requested_fields(self.request, ProductSerializer)
+            )
+
+        if trending:
+            # Top-K read along the trending_score index
+            queryset = queryset[:settings.TRENDING_LIMIT]
+
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        items = response.data.get('results', []) if isinstance(response.data, dict) else response.data
+        # The list is not paginated: only its first screens are actually seen
+        seen = items[:settings.ENGAGEMENT_LIST_IMPRESSIONS]
+        engagement_counters.record('impressions', [item['id'] for item in seen if 'id' in item])
+        return response
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.AllowAny])
+    def click(self, request, pk=None):
+        """Count a click-through from a product list to the product"""
+        product = self.get_object()
+        engagement_counters.record('clicks', [product.id])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def create(self, request, *args, **kwargs):
+        """Create a listing; possible_duplicates lists available listings with the same photo"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        # From the saved instance: ?fields= may leave id out of the response
+        data = serializer.data
+        data['possible_duplicates'] = possible_duplicates(
+            serializer.instance.id, settings.DUPLICATE_IMAGE_WARNING_LIMIT
+        )
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def suggest(self, request):
+        """
+        Search box autocomplete (GET /products/suggest/?prefix=...&limit=8): listing
+        titles and category names starting with the prefix or with a word of it, most popular first.
+        """
+        try:
+            limit = min(max(int(request.query_params.get('limit', 8)), 1), MAX_SUGGESTIONS)
+        except ValueError:
+            return Response({'detail': 'limit must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(suggestion_index.suggest(request.query_params.get('prefix', '')[:100], limit))
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def changes(self, request):
+        """
+        Incremental sync (GET /products/changes/?since=<token>): products created, updated
+        or sold since the token in their current state, ids of deleted ones, and the token
+        to pass next. Without since, only the current token: take it before loading the list.
+        A 410 means the token is too old and the client should reload the list.
+        """
+        since = request.query_params.get('since')
+        if not since:
+            return Response({'changed': [], 'deleted': [], 'next': change_log.current_token(), 'has_more': False})
+        try:
+            changed, deleted, next_token, has_more = change_log.changes_since(since)
+        except ValueError:
+            return Response({'detail': 'Invalid sync token.'}, status=status.HTTP_400_BAD_REQUEST)
+        except change_log.ExpiredSyncToken:
+            return Response({'detail': 'Sync token expired, reload the product list.'}, status=status.HTTP_410_GONE)
+        fields = requested_fields(request, ProductSerializer)
+        if fields is not None:
+            fields = fields | {'id'}  # Clients merge changes into their cache by id
+        queryset = ProductSerializer.optimize_queryset(Product.objects.filter(id__in=changed), fields)
+        order = {product_id: position for position, product_id in enumerate(changed)}
+        products = sorted(
+            serialize_queryset(queryset, self.get_serializer(fields=fields)), key=lambda item: order[item['id']]
+        )
+        return Response({'changed': products, 'deleted': deleted, 'next': next_token, 'has_more': has_more})
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """
+        Available listings similar to the product (GET /products/<id>/similar/), most similar first.
+        Neighbours are precomputed by build_similar_listings; products not built yet have none.
+        """
+        product = self.get_object()
+        queryset = ProductSerializer.optimize_queryset(
+            Product.objects.filter(similar_to__product=product, status='AVAILABLE').order_by('similar_to__rank'),
+            requested_fields(request, ProductSerializer)
+        )
+        return Response(serialize_queryset(queryset, self.get_serializer()))
+
     def perform_create(self, serializer):
         # Auto-populate location from seller's profile if not provided
         user = self.request.user
@@ -149,6 +262,111 @@ class ProductViewSet(viewsets.ModelViewSet):
             )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False, methods=['post'], url_path='import', permission_classes=[permissions.IsAuthenticated],
+        parser_classes=[parsers.MultiPartParser], renderer_classes=[NDJSONRenderer]
+    )
+    def bulk_import(self, request):
+        """
+        Bulk-create listings for the current user (POST /products/import/).
+
+        Multipart fields: 'file' (.csv or .ndjson), optional 'images' (.zip whose member
+        names rows may use as image) and 'batch_size'. Streams one NDJSON result per row.
+        """
+        from django.core.files.uploadhandler import TemporaryFileUploadHandler
+        from .bulk_products import ProductImporter
+
+        # Must be set before request.FILES is first accessed
+        request.upload_handlers = [TemporaryFileUploadHandler(request._request)]
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'detail': 'No file provided.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = os.path.splitext(upload.name)[1].lower().lstrip('.')
+        if file_format == 'jsonl':
+            file_format = 'ndjson'
+        if file_format not in ('csv', 'ndjson'):
+            return Response({'detail': 'File must be .csv or .ndjson.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            batch_size = int(request.data.get('batch_size') or settings.BULK_IMPORT_BATCH_SIZE)
+        except ValueError:
+            batch_size = 0
+        if not 1 <= batch_size <= settings.BULK_IMPORT_MAX_BATCH_SIZE:
+            return Response(
+                {'detail': f'batch_size must be a whole number from 1 to {settings.BULK_IMPORT_MAX_BATCH_SIZE}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            importer = ProductImporter(request.user, images_zip=request.FILES.get('images'), batch_size=batch_size)
+        except zipfile.BadZipFile:
+            return Response({'detail': 'images must be a zip archive.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        records = (NDJSONRenderer().render(result) for result in importer.run(upload, file_format))
+        return StreamingHttpResponse(_stream_for_server(request, records), content_type=NDJSONRenderer.media_type)
+
+    @action(
+        detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=[CSVRenderer, NDJSONRenderer]
+    )
+    def export(self, request):
+        """
+        Stream listings as CSV or NDJSON (GET /products/export/?format=csv|ndjson).
+        Exports the current user's listings; staff may pass scope=all for the whole catalog.
+        """
+        from .bulk_products import iter_export
+
+        if request.query_params.get('scope') == 'all':
+            if not request.user.is_staff:
+                return Response({'detail': 'Only staff can export the whole catalog.'}, status=status.HTTP_403_FORBIDDEN)
+            queryset = Product.objects.all()
+        else:
+            queryset = Product.objects.filter(seller=request.user)
+
+        file_format = request.accepted_renderer.format
+        response = StreamingHttpResponse(
+            _stream_for_server(request, iter_export(queryset, file_format)),
+            content_type=f'{request.accepted_renderer.media_type}; charset=utf-8'
+        )
+        response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def clusters(self, request):
+        """
+        Map marker clusters of available products (GET /products/clusters/?bbox=&zoom=).
+
+        bbox is min_lng,min_lat,max_lng,max_lat; zoom is the map's Web Mercator zoom.
+        Each cluster has count, centroid, min_price and a few sample product ids.
+        """
+        from .map_clusters import MAX_ZOOM, clusters_for_bbox
+        from . import geo_grid
+
+        try:
+            min_lng, min_lat, max_lng, max_lat = (float(value) for value in request.query_params['bbox'].split(','))
+            zoom = int(request.query_params['zoom'])
+        except (KeyError, ValueError):
+            return Response(
+                {'detail': 'bbox (min_lng,min_lat,max_lng,max_lat) and zoom are required.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not (-180 <= min_lng < max_lng <= 180 and -90 <= min_lat < max_lat <= 90):
+            return Response({'detail': 'Invalid bbox.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        zoom = max(0, min(zoom, MAX_ZOOM))
+        if geo_grid.tile_count_in_bbox(min_lng, min_lat, max_lng, max_lat, zoom) > settings.PRODUCT_CLUSTER_MAX_TILES:
+            return Response(
+                {'detail': 'Bounding box too large for this zoom level.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        clusters = clusters_for_bbox(min_lng, min_lat, max_lng, max_lat, zoom)
+        return Response({
+            'zoom': zoom,
+            'count': sum(cluster['count'] for cluster in clusters),
+            'clusters': clusters
+        })
+
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def create_checkout_session(self, request, pk=None):
         """
@@ -160,6 +378,10 @@ class ProductViewSet(viewsets.ModelViewSet):
             "cancel_url": "http://localhost:4200/checkout/cancel"
         }
         """
+        # Stripe SDK is imported on first use - it dominates Django startup time
+        from .stripe_service import StripeService
+        import stripe
+
         product = self.get_object()
 
         # Validate product availability
@@ -195,7 +417,9 @@ class ProductViewSet(viewsets.ModelViewSet):
             )
 
             serializer = CheckoutSessionSerializer(session_data)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            # A still-open session for the same purchase is handed out again
+            response_status = status.HTTP_200_OK if session_data['reused'] else status.HTTP_201_CREATED
+            return Response(serializer.data, status=response_status)
 
         except ValueError as e:
             return Response(
@@ -211,12 +435,14 @@ class ProductViewSet(viewsets.ModelViewSet):
 
 
 
-class WatchlistViewSet(viewsets.ModelViewSet):
+class WatchlistViewSet(FastListMixin, viewsets.ModelViewSet):
     serializer_class = WatchlistItemSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return WatchlistItem.objects.filter(user=self.request.user).order_by('-added_at')
+        return WatchlistItem.objects.filter(user=self.request.user).select_related(
+            'product__seller', 'product__category'
+        ).order_by('-added_at')
 
     def perform_create(self, serializer):
         # Check if already in watchlist
@@ -254,6 +480,20 @@ class WatchlistViewSet(viewsets.ModelViewSet):
         except WatchlistItem.DoesNotExist:
             return Response({'detail': 'Not found in watchlist.'}, status=status.HTTP_404_NOT_FOUND)
 
+class SavedSearchViewSet(viewsets.ModelViewSet):
+    """
+    The user's saved searches; new matching listings are pushed over
+    ws/notifications/ (see market.saved_searches).
+    """
+    serializer_class = SavedSearchSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return SavedSearch.objects.filter(user=self.request.user).order_by('-created_at')
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
 class UserViewSet(viewsets.ModelViewSet):
     """
     Admin-only viewset for managing users.
@@ -292,17 +532,43 @@ class UserViewSet(viewsets.ModelViewSet):
 
 
 
+def _autofill_outcome(result):
+    """
+    Map an analysis result to the autofill HTTP outcome.
+
+    Returns:
+        Tuple (status_code, payload, headers)
+    """
+    from .ai_service import build_autofill_suggestion
+
+    # Quota exhausted - fail fast instead of holding the request
+    if result.get('error_code') == 'rate_limited':
+        return (
+            status.HTTP_429_TOO_MANY_REQUESTS,
+            {'error': result['error'], 'retry_after': result['retry_after']},
+            {'Retry-After': str(result['retry_after'])}
+        )
+
+    # Check for errors from AI service
+    if 'error' in result and result.get('title') == '':
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {'error': result['error']}, {}
+
+    return status.HTTP_200_OK, build_autofill_suggestion(result), {}
+
+
 class AIAutofillView(views.APIView):
     """
     AI-powered auto-fill for product listings.
     Accepts an image upload, analyzes it with Gemini Pro,
     and returns suggested title, description, category, and price range.
+    Repeat uploads of an already analyzed photo are answered from the cache.
+    Single-image form of AIAutofillBatchView.
     """
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [parsers.MultiPartParser, parsers.FormParser]
 
     def post(self, request):
-        from .ai_service import analyze_product_image
+        from .ai_service import analyze_product_image_cached
         
         # Check if image was uploaded
         if 'image' not in request.FILES:
@@ -311,46 +577,17 @@ class AIAutofillView(views.APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        image_file = request.FILES['image']
-        
         # Analyze the image with AI
         try:
-            result = analyze_product_image(image_file)
+            result = analyze_product_image_cached(request.FILES['image'])
         except Exception as e:
             return Response(
                 {'error': f'AI service error: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-        
-        # Check for errors from AI service
-        if 'error' in result and result.get('title') == '':
-            return Response(
-                {'error': result['error']},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-        
-        # Try to match or create the suggested category
-        category_name = result.get('category_suggestion', '')
-        category_id = None
-        
-        if category_name:
-            # Try to find existing category (case-insensitive)
-            category = Category.objects.filter(name__iexact=category_name).first()
-            
-            if not category:
-                # Create new category if it doesn't exist
-                category = Category.objects.create(name=category_name)
-            
-            category_id = category.id
-        
-        return Response({
-            'title': result.get('title', ''),
-            'description': result.get('description', ''),
-            'category_id': category_id,
-            'category_name': category_name,
-            'price_min': result.get('price_min', 0),
-            'price_max': result.get('price_max', 0)
-        }, status=status.HTTP_200_OK)
+
+        status_code, payload, headers = _autofill_outcome(result)
+        return Response(payload, status=status_code, headers=headers)
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def buy(self, request, pk=None):
@@ -377,16 +614,171 @@ class AIAutofillView(views.APIView):
 
         return Response(ProductSerializer(product).data)
 
+
+class AIAutofillBatchView(views.APIView):
+    """
+    AI autofill for several images in one request (POST /products/autofill/batch/, field 'images').
+    Uploads are spooled to temporary files and cache misses share model calls.
+    One record per image is streamed back as soon as it is known: NDJSON by default,
+    server-sent events for 'Accept: text/event-stream'.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [parsers.MultiPartParser, parsers.FormParser]
+    renderer_classes = [NDJSONRenderer, EventStreamRenderer]
+
+    def post(self, request):
+        from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+        # Must be set before request.FILES is first accessed
+        request.upload_handlers = [TemporaryFileUploadHandler(request._request)]
+        images = request.FILES.getlist('images')
+
+        if not images:
+            return Response(
+                {'error': 'No images provided. Please upload one or more images.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(images) > settings.AI_AUTOFILL_MAX_BATCH_IMAGES:
+            return Response(
+                {'error': f'At most {settings.AI_AUTOFILL_MAX_BATCH_IMAGES} images per request.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        records = self._records(images, request.accepted_renderer)
+        response = StreamingHttpResponse(
+            _stream_for_server(request, records),
+            content_type=request.accepted_renderer.media_type
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Ask proxies not to buffer the stream
+        return response
+
+    @staticmethod
+    def _records(images, renderer):
+        from .ai_service import analyze_product_images_cached
+
+        remaining = set(range(len(images)))
+        try:
+            for index, result in analyze_product_images_cached(images):
+                status_code, payload, _ = _autofill_outcome(result)
+                remaining.discard(index)
+                yield renderer.render(
+                    {'index': index, 'filename': images[index].name, 'status': status_code, 'result': payload}
+                )
+        except Exception as e:
+            for index in sorted(remaining):
+                yield renderer.render({
+                    'index': index, 'filename': images[index].name,
+                    'status': status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    'result': {'error': f'AI service error: {str(e)}'}
+                })
+
+
+def _stream_for_server(request, iterator):
+    """
+    Adapt a sync iterator to the server: Django buffers sync iterators completely
+    under ASGI (daphne), so there each step is run via sync_to_async instead.
+    """
+    if not isinstance(request._request, ASGIRequest):
+        return iterator
+
+    async def stream():
+        while True:
+            chunk = await sync_to_async(next)(iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    return stream()
+
+
+class AIAutofillJobView(views.APIView):
+    """
+    Submit an AI autofill job (REST-conform: POST /products/autofill/jobs/).
+    The image is analyzed on a background worker; poll the returned status_url for the result.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [parsers.MultiPartParser, parsers.FormParser]
+
+    def post(self, request):
+        from .ai_jobs import autofill_jobs, AutofillQueueFull
+
+        if 'image' not in request.FILES:
+            return Response(
+                {'error': 'No image provided. Please upload an image.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            job = autofill_jobs.submit(request.user.id, request.FILES['image'])
+        except AutofillQueueFull:
+            return Response(
+                {'error': 'Too many AI requests in progress, please try again shortly.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': '10'}
+            )
+
+        job['status_url'] = reverse('product-autofill-job', kwargs={'job_id': job['id']}, request=request)
+        return Response(job, status=status.HTTP_202_ACCEPTED)
+
+
+class AIAutofillJobStatusView(views.APIView):
+    """Get the status of an AI autofill job (in-memory lookup, no database access)"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id):
+        from .ai_jobs import autofill_jobs
+
+        job = autofill_jobs.get(job_id, request.user.id)
+        if job is None:
+            return Response({'detail': 'Job not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job)
+
+
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.all().order_by('name')
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
 
+    @action(detail=True, methods=['get'], url_path='price-band')
+    def price_band(self, request, pk=None):
+        """
+        Historical p10/p50/p90 of sold prices and accepted offers in this category
+        and its subcategories (GET /categories/{id}/price-band/).
+        Served from the in-memory snapshot; unknown categories cost one lookup.
+        """
+        from .price_stats import price_bands
+
+        try:
+            category_id = int(pk)
+        except ValueError:
+            category_id = None  # Malformed ids are unknown categories
+        bands = price_bands.get(category_id) if category_id is not None else None
+        if bands is None:
+            if category_id is None or not Category.objects.filter(pk=category_id).exists():
+                return Response({'detail': 'Category not found.'}, status=status.HTTP_404_NOT_FOUND)
+            bands = {'sold': None, 'accepted': None}
+
+        return Response({
+            'category_id': category_id,
+            **bands,
+            'suggested': price_bands.suggested(category_id)
+        })
+
 class ProductDetailView(generics.RetrieveAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def retrieve(self, request, *args, **kwargs):
+        """Product with its view, impression and click counts; counts this view"""
+        product = self.get_object()
+        data = self.get_serializer(product).data
+        # By the object's id: ?fields= may leave id out of the payload
+        engagement_counters.record('views', [product.id])
+        data['engagement'] = engagement_counters.counts([product.id])[product.id]
+        return Response(data)
+
 class UserProfileViewSet(viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -436,8 +828,9 @@ class UserProfileViewSet(viewsets.ModelViewSet):
             profile = self.get_object()
             # Show all products (sold and available) for the profile owner
             products = Product.objects.filter(seller=profile.user).order_by('-created_at')
-            serializer = ProductSerializer(products, many=True)
-            return Response(serializer.data)
+            return Response(serialize_queryset(
+                products, ProductSerializer(fields=requested_fields(request, ProductSerializer))
+            ))
         except UserProfile.DoesNotExist:
             return Response(
                 {'detail': 'User not found'},
@@ -448,8 +841,9 @@ class UserProfileViewSet(viewsets.ModelViewSet):
     def purchases(self, request):
         """Get all products bought by the current user"""
         products = Product.objects.filter(buyer=request.user).order_by('-sold_at')
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        return Response(serialize_queryset(
+            products, ProductSerializer(fields=requested_fields(request, ProductSerializer))
+        ))
 
     def perform_create(self, serializer):
         """Prevent direct profile creation via API"""
@@ -504,6 +898,9 @@ def stripe_webhook(request):
     Handle Stripe webhook events.
     This endpoint receives events from Stripe and processes them.
     """
+    from .stripe_service import StripeService
+    import stripe
+
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
 
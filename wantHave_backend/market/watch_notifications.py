@@ -0,0 +1,155 @@
+"""
+Notifications to watchers when a product's price drops or its status changes.
+A product save enqueues one job per product; changes made while the job waits are
+merged into it. The job streams the watchers' user ids in chunks and sends each
+chunk's events to the per-user channel-layer groups concurrently, within a fixed
+time budget.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Product, WatchlistItem
+
+logger = logging.getLogger('market.watch_notifications')
+
+WATCHED_FIELDS = ('price', 'status')
+
+
+def user_group(user_id):
+    """Channel-layer group of a user's notification sockets"""
+    return f'user_{user_id}'
+
+
+def build_event(product, changes):
+    """
+    Channel-layer event for the net changes, or None when watchers need no notice
+    (a price increase alone, or fields changed back).
+    """
+    changes = {field: (old, new) for field, (old, new) in changes.items() if old != new}
+    price = changes.get('price')
+    if price and price[1] > price[0]:
+        del changes['price']
+    if not changes:
+        return None
+    return {
+        'type': 'watchlist.update',
+        'product': {'id': product.id, 'title': product.title, 'price': str(product.price), 'status': product.status},
+        'changes': {field: {'old': str(old), 'new': str(new)} for field, (old, new) in changes.items()},
+    }
+
+
+_SUBMITTING = object()  # Job of a pending entry is being handed to the executor
+
+
+class WatcherFanout:
+    """
+    Runs fan-out jobs on one background thread.
+
+    Pending jobs live in process memory (the backend runs as a single replica);
+    a job that has not started yet absorbs later changes of the same product, so
+    a burst of edits produces one notification per watcher.
+    """
+
+    def __init__(self, chunk_size, time_budget):
+        self.chunk_size = chunk_size
+        self.time_budget = time_budget
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='watch-fanout')
+        self._lock = threading.Lock()
+        self._pending = {}  # Product id -> [merged changes, future of the job that will send them]
+
+    def reset(self):
+        """Forget pending changes, e.g. between tests"""
+        with self._lock:
+            self._pending.clear()
+
+    def product_changed(self, product_id, changes):
+        """
+        Queue notifications for a saved product.
+
+        Args:
+            product_id: Saved product
+            changes: Dict field -> (old value, new value) of WATCHED_FIELDS
+        """
+        with self._lock:
+            pending = self._pending.get(product_id)
+            if pending is not None:
+                merged = pending[0]
+                for field, (old, new) in changes.items():
+                    merged[field] = (merged[field][0] if field in merged else old, new)
+                if self._job_alive(pending[1]):
+                    return
+                # Its job was cancelled or failed before running: a new job sends the merged changes
+                changes = merged
+            entry = [dict(changes), _SUBMITTING]
+            self._pending[product_id] = entry
+        try:
+            future = self._executor.submit(self._run, product_id)
+        except Exception:
+            with self._lock:
+                if self._pending.get(product_id) is entry:
+                    del self._pending[product_id]
+            logger.exception('Watcher notification for product %s could not be queued', product_id)
+            return
+        with self._lock:
+            if self._pending.get(product_id) is entry:
+                entry[1] = future
+
+    @staticmethod
+    def _job_alive(future):
+        """Whether the job owning a pending entry will still run"""
+        return future is _SUBMITTING or (future is not None and not future.done())
+
+    def _run(self, product_id):
+        with self._lock:
+            entry = self._pending.pop(product_id, None)
+        if entry is None:
+            return  # Sent by another job
+        changes = entry[0]
+        close_old_connections()
+        try:
+            product = Product.objects.filter(pk=product_id).first()
+            event = build_event(product, changes) if product else None
+            if event:
+                sent = async_to_sync(self._publish)(product_id, event)
+                logger.info('Product %s changes sent to %s watchers', product_id, sent)
+        except Exception:
+            logger.exception('Watcher notification for product %s failed', product_id)
+        finally:
+            close_old_connections()
+
+    async def _publish(self, product_id, event):
+        """Send the event to every watcher's group; returns the number of watchers reached"""
+        layer = get_channel_layer()
+        if layer is None:
+            return 0
+        deadline = time.monotonic() + self.time_budget
+        # One cursor for the whole job, read chunk by chunk on this job's thread
+        user_ids = WatchlistItem.objects.filter(product_id=product_id).values_list(
+            'user_id', flat=True
+        ).iterator(chunk_size=self.chunk_size)
+        next_chunk = sync_to_async(lambda: list(itertools.islice(user_ids, self.chunk_size)))
+
+        sent = 0
+        while chunk := await next_chunk():
+            if sent and time.monotonic() > deadline:
+                logger.warning(
+                    'Product %s: time budget of %ss used up after %s watchers', product_id, self.time_budget, sent
+                )
+                break
+            await asyncio.gather(*(layer.group_send(user_group(user_id), event) for user_id in chunk))
+            sent += len(chunk)
+        return sent
+
+
+watcher_fanout = WatcherFanout(
+    chunk_size=settings.WATCH_FANOUT_CHUNK_SIZE,
+    time_budget=settings.WATCH_FANOUT_TIME_BUDGET,
+)
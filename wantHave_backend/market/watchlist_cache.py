@@ -0,0 +1,30 @@
+"""
+Cached per-user sets of watched product ids.
+Product lists flag watched items with one set lookup per product instead of a
+query each. A user's set is loaded with one query and dropped whenever one of
+their watchlist items is added or removed.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import WatchlistItem
+
+
+def _cache_key(user_id):
+    return f'watched-products:{user_id}'
+
+
+def watched_product_ids(user):
+    """Ids of the products on the user's watchlist; empty for anonymous users"""
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    key = _cache_key(user.id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(WatchlistItem.objects.filter(user=user).values_list('product_id', flat=True))
+        cache.set(key, ids, timeout=settings.WATCHLIST_CACHE_TTL)
+    return ids
+
+
+def invalidate(user_id):
+    cache.delete(_cache_key(user_id))
@@ -18,12 +18,17 @@ from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import chat.routing
+import market.routing
+from market.engagement import engagement_counters
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AuthMiddlewareStack(
         URLRouter(
-            chat.routing.websocket_urlpatterns
+            chat.routing.websocket_urlpatterns + market.routing.websocket_urlpatterns
         )
     ),
 })
+
+# Write-behind counters are flushed by the serving process
+engagement_counters.start()
@@ -45,6 +45,63 @@ STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
 
+# AI Autofill Configuration (Gemini quota: 10 requests/minute, 20 requests/day)
+AI_AUTOFILL_REQUESTS_PER_MINUTE = int(os.getenv('AI_AUTOFILL_REQUESTS_PER_MINUTE', '10'))
+AI_AUTOFILL_REQUESTS_PER_DAY = int(os.getenv('AI_AUTOFILL_REQUESTS_PER_DAY', '20'))
+AI_AUTOFILL_WORKERS = int(os.getenv('AI_AUTOFILL_WORKERS', '2'))  # Concurrent model calls
+AI_AUTOFILL_MAX_PENDING = int(os.getenv('AI_AUTOFILL_MAX_PENDING', '10'))  # Queued + running jobs
+AI_AUTOFILL_MAX_WAIT = int(os.getenv('AI_AUTOFILL_MAX_WAIT', '60'))  # Seconds a job waits for a quota slot
+AI_AUTOFILL_JOB_TTL = int(os.getenv('AI_AUTOFILL_JOB_TTL', '600'))  # Seconds finished jobs stay readable
+AI_AUTOFILL_CACHE_TTL = int(os.getenv('AI_AUTOFILL_CACHE_TTL', str(7 * 24 * 3600)))  # Seconds a result is reused
+AI_AUTOFILL_CACHE_MAX_DISTANCE = int(os.getenv('AI_AUTOFILL_CACHE_MAX_DISTANCE', '3'))  # dHash bits for near-duplicates
+AI_AUTOFILL_MAX_IMAGE_EDGE = int(os.getenv('AI_AUTOFILL_MAX_IMAGE_EDGE', '1024'))  # Pixels sent to the model
+AI_AUTOFILL_IMAGE_QUALITY = int(os.getenv('AI_AUTOFILL_IMAGE_QUALITY', '85'))  # JPEG quality sent to the model
+AI_AUTOFILL_BATCH_SIZE = int(os.getenv('AI_AUTOFILL_BATCH_SIZE', '4'))  # Images packed into one model call
+AI_AUTOFILL_MAX_BATCH_IMAGES = int(os.getenv('AI_AUTOFILL_MAX_BATCH_IMAGES', '20'))  # Images per batch request
+
+# Price bands from the platform's own sales
+PRICE_BAND_MIN_SAMPLES = int(os.getenv('PRICE_BAND_MIN_SAMPLES', '5'))  # Prices needed before a band is suggested
+
+# Product map clustering
+PRODUCT_CLUSTER_CACHE_TTL = int(os.getenv('PRODUCT_CLUSTER_CACHE_TTL', '300'))  # Seconds a tile's clusters are cached; bounds staleness in other processes
+PRODUCT_CLUSTER_MAX_TILES = int(os.getenv('PRODUCT_CLUSTER_MAX_TILES', '256'))  # Tiles per request at the given zoom
+
+# Bulk product import/export
+BULK_IMPORT_BATCH_SIZE = int(os.getenv('BULK_IMPORT_BATCH_SIZE', '500'))  # Rows per validation chunk and transaction
+BULK_IMPORT_MAX_BATCH_SIZE = int(os.getenv('BULK_IMPORT_MAX_BATCH_SIZE', '2000'))  # Largest batch_size a client may ask for
+BULK_IMPORT_MAX_ROWS = int(os.getenv('BULK_IMPORT_MAX_ROWS', '10000'))  # Rows per import request
+BULK_EXPORT_CHUNK_SIZE = int(os.getenv('BULK_EXPORT_CHUNK_SIZE', '2000'))  # Rows fetched per cursor round trip
+
+# Watchlist
+WATCHLIST_CACHE_TTL = int(os.getenv('WATCHLIST_CACHE_TTL', '3600'))  # Seconds a user's watched product ids are cached
+WATCH_FANOUT_CHUNK_SIZE = int(os.getenv('WATCH_FANOUT_CHUNK_SIZE', '500'))  # Watchers read and notified per batch
+WATCH_FANOUT_TIME_BUDGET = float(os.getenv('WATCH_FANOUT_TIME_BUDGET', '30'))  # Seconds one product's fan-out may take
+
+# Product engagement counters (write-behind, see market.engagement)
+ENGAGEMENT_FLUSH_INTERVAL = float(os.getenv('ENGAGEMENT_FLUSH_INTERVAL', '10'))  # Seconds between flushes to the database
+ENGAGEMENT_MAX_PENDING = int(os.getenv('ENGAGEMENT_MAX_PENDING', '10000'))  # Buffered increments that trigger an early flush
+ENGAGEMENT_LIST_IMPRESSIONS = int(os.getenv('ENGAGEMENT_LIST_IMPRESSIONS', '60'))  # Leading products of a list response counted as seen
+TRENDING_LIMIT = int(os.getenv('TRENDING_LIMIT', '100'))  # Products returned by ?ordering=trending
+
+# Search box autocomplete (see market.suggestions)
+SUGGEST_INDEX_PATH = os.getenv(  # Snapshot mapped by every worker; kept next to the database by default
+    'SUGGEST_INDEX_PATH', str(Path(os.getenv('SQLITE_DB_PATH', BASE_DIR / 'db.sqlite3')).parent / 'suggest_index.bin')
+)
+SUGGEST_REBUILD_INTERVAL = int(os.getenv('SUGGEST_REBUILD_INTERVAL', '60'))  # Minimum seconds between snapshot rebuilds
+
+# Typo-tolerant product search (see market.product_search)
+SEARCH_INDEX_DESCRIPTIONS = os.getenv('SEARCH_INDEX_DESCRIPTIONS', 'True') == 'True'  # Also match description text, at half weight
+SEARCH_MAX_CANDIDATES = int(os.getenv('SEARCH_MAX_CANDIDATES', '2000'))  # Products scored per query, bounds latency
+SEARCH_RESULT_LIMIT = int(os.getenv('SEARCH_RESULT_LIMIT', '100'))  # Products returned by ?search=
+
+# Product change feed for client sync (see market.change_log)
+CHANGE_FEED_PAGE_SIZE = int(os.getenv('CHANGE_FEED_PAGE_SIZE', '500'))  # Log entries read per GET /products/changes/
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv('CHANGE_LOG_RETENTION_DAYS', '30'))  # Older entries are compacted away; older tokens must resync
+
+# Duplicate listing photos (see market.duplicate_images)
+DUPLICATE_IMAGE_MAX_DISTANCE = int(os.getenv('DUPLICATE_IMAGE_MAX_DISTANCE', '6'))  # Differing dHash bits of the same photo
+DUPLICATE_IMAGE_WARNING_LIMIT = int(os.getenv('DUPLICATE_IMAGE_WARNING_LIMIT', '5'))  # Duplicates listed when creating a product, 0 turns the warning off
+
 
 # Application definition
 
@@ -144,6 +201,51 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'market.ai_autofill': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'market.price_stats': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'market.bulk_products': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'market.watch_notifications': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'market.saved_searches': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'market.engagement': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'market.similar_listings': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'market.duplicate_images': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'market.suggestions': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
@@ -195,7 +297,17 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
         'rest_framework.authentication.BasicAuthentication',
-    )
+    ),
+    # orjson-backed JSON with a standard library fallback (market.json_backend)
+    'DEFAULT_RENDERER_CLASSES': (
+        'market.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'market.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 SIMPLE_JWT = {
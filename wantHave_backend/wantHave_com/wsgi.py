@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wantHave_com.settings')
 
 application = get_wsgi_application()
+
+from market.engagement import engagement_counters
+
+# Write-behind counters are flushed by the serving process
+engagement_counters.start()
@@ -23,6 +23,7 @@ import { EffectComposer, RenderPass, BloomEffect, EffectPass, ToneMappingEffect
 import { AiService } from '../../services/ai.service';
 import { CategoryService } from '../../services/category.service';
 import { Category } from '../../interfaces/category';
+import { Product } from '../../interfaces/product';
 
 @Component({
     selector: 'app-create-listing',
@@ -618,9 +619,15 @@ export class CreateListingComponent implements AfterViewInit, OnDestroy {
             formData.append('longitude', approxLng.toString());
         }
 
-        this.http.post('/api/market/products/', formData).subscribe({
-            next: () => {
-                this.snackbar.open('Success!', 'OK', { duration: 3000 });
+        this.http.post<Product>('/api/market/products/', formData).subscribe({
+            next: (product) => {
+                // the listing is created either way; a matching photo is only worth a hint
+                const duplicate = product.possible_duplicates?.[0];
+                if (duplicate) {
+                    this.snackbar.open(`Listed. The photo looks like "${duplicate.title}" - is this a duplicate?`, 'OK', { duration: 8000 });
+                } else {
+                    this.snackbar.open('Success!', 'OK', { duration: 3000 });
+                }
                 this.router.navigate(['/products']);
             },
             error: (err) => {
@@ -40,6 +40,7 @@ export class ProductDetailComponent implements OnInit, AfterViewInit {
   loading = true;
   error = '';
   details: DetailItem[] = [];
+  similarProducts: Product[] = [];
   processingCheckout = false;
   watchlistIds: Set<number> = new Set();
   private profileService = inject(ProfileService);
@@ -52,18 +53,18 @@ export class ProductDetailComponent implements OnInit, AfterViewInit {
   editData: Partial<Product> = {};
 
   // on component initialization, fetch the product based on the route parameter
+  // the component is reused when navigating between products (e.g. similar listings), so follow the route
   ngOnInit() {
-    const id = Number(this.route.snapshot.paramMap.get('id'));
-    if (!Number.isFinite(id) || id <= 0) {
-      this.error = 'Invalid product id.';
-      this.loading = false;
-      return;
-    }
+    this.route.paramMap.subscribe((params) => {
+      const id = Number(params.get('id'));
+      if (!Number.isFinite(id) || id <= 0) {
+        this.error = 'Invalid product id.';
+        this.loading = false;
+        return;
+      }
 
-    this.fetchProduct(id);
-    if (this.auth.isAuthenticated()) {
-      this.fetchWatchlist();
-    }
+      this.fetchProduct(id);
+    });
   }
 
   ngAfterViewInit() {
@@ -118,15 +119,6 @@ export class ProductDetailComponent implements OnInit, AfterViewInit {
     }, 100);
   }
 
-  fetchWatchlist() {
-    this.profileService.getWatchlist().subscribe({
-      next: (items) => {
-        this.watchlistIds = new Set(items.map(item => item.product.id));
-      },
-      error: (err) => console.error('Error loading watchlist', err)
-    });
-  }
-
   toggleWatchlist(event: Event) {
     if (!this.product) return;
     const productId = this.product.id;
@@ -293,10 +285,13 @@ export class ProductDetailComponent implements OnInit, AfterViewInit {
     this.error = '';
     this.product = null;
     this.details = [];
+    this.similarProducts = [];
+    this.fetchSimilar(id);
 
     this.productService.get(id).subscribe({
       next: (product) => {
         this.product = product;
+        this.watchlistIds = new Set(product.is_watched ? [product.id] : []);
         this.details = this.buildDetails(product);
         this.loading = false;
         this.initLocationMap();
@@ -309,6 +304,14 @@ export class ProductDetailComponent implements OnInit, AfterViewInit {
     });
   }
 
+  // fetches the precomputed similar listings; the section stays hidden when there are none
+  private fetchSimilar(id: number) {
+    this.productService.similar(id).subscribe({
+      next: (products) => (this.similarProducts = products),
+      error: (err) => console.error('Failed to load similar products', err),
+    });
+  }
+
   // builds the array of detail items to display for the product
   private buildDetails(product: Product): DetailItem[] {
     const createdAt = product.created_at ? new Date(product.created_at) : null;
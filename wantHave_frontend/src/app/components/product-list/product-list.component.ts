@@ -10,8 +10,9 @@ import { MatInputModule } from '@angular/material/input';
 import { MatIconModule } from '@angular/material/icon';
 import { MatSidenavModule } from '@angular/material/sidenav';
 import { RouterLink } from '@angular/router';
+import { Subject, debounceTime, distinctUntilChanged, of, switchMap } from 'rxjs';
 import { Category } from '../../interfaces/category';
-import { Product } from '../../interfaces/product';
+import { Product, Suggestion } from '../../interfaces/product';
 import { CategoryService } from '../../services/category.service';
 import { ProductService } from '../../services/product.service';
 import { ProfileService } from '../../services/profile.service';
@@ -46,8 +47,13 @@ export class ProductListComponent implements OnInit {
   categoryLoading = true;
   categoryError = '';
   selectedCategoryId: number | null = null;
-  sortBy: 'newest' | 'price_asc' | 'price_desc' = 'newest';
+  sortBy: 'newest' | 'trending' | 'price_asc' | 'price_desc' = 'newest';
+  showingTrending = false;
   searchQuery = '';
+  suggestions: Suggestion[] = [];
+  // server-side search ranks (product id -> position), null until the current query is answered
+  private searchRanks: Map<number, number> | null = null;
+  private searchInput = new Subject<string>();
   minPrice: number | null = null;
   maxPrice: number | null = null;
   cityFilter = '';
@@ -71,9 +77,27 @@ export class ProductListComponent implements OnInit {
     this.checkMobile();
     this.fetchCategories();
     this.fetchProducts();
-    if (this.authService.isAuthenticated()) {
-      this.fetchWatchlist();
-    }
+    this.searchInput.pipe(
+      debounceTime(150),
+      distinctUntilChanged(),
+      switchMap(prefix => prefix.trim() ? this.productService.suggest(prefix) : of([]))
+    ).subscribe({
+      next: (suggestions) => this.suggestions = suggestions,
+      error: () => this.suggestions = []
+    });
+    this.searchInput.pipe(
+      debounceTime(300),
+      distinctUntilChanged(),
+      switchMap(query => query.trim() ? this.productService.list(null, undefined, query.trim()) : of(null))
+    ).subscribe({
+      next: (matches) => this.searchRanks = matches && new Map(matches.map((product, rank) => [product.id, rank])),
+      error: () => this.searchRanks = null
+    });
+  }
+
+  onSearchInput(query: string) {
+    this.searchRanks = null;
+    this.searchInput.next(query);
   }
 
   @HostListener('window:resize')
@@ -98,6 +122,7 @@ export class ProductListComponent implements OnInit {
 
   clearAllFilters() {
     this.searchQuery = '';
+    this.onSearchInput('');
     this.minPrice = null;
     this.maxPrice = null;
     this.cityFilter = '';
@@ -105,15 +130,6 @@ export class ProductListComponent implements OnInit {
     this.fetchProducts(null);
   }
 
-  fetchWatchlist() {
-    this.profileService.getWatchlist().subscribe({
-      next: (items) => {
-        this.watchlistIds = new Set(items.map(item => item.product.id));
-      },
-      error: (err) => console.error('Error loading watchlist', err)
-    });
-  }
-
   toggleWatchlist(event: Event, product: Product) {
     event.stopPropagation();
     event.preventDefault();
@@ -131,13 +147,21 @@ export class ProductListComponent implements OnInit {
     }
   }
 
+  recordClick(product: Product) {
+    this.productService.recordClick(product.id).subscribe({
+      error: (err) => console.error('Error recording click', err)
+    });
+  }
+
   fetchProducts(categoryId: number | null = this.selectedCategoryId) {
     this.loading = true;
     this.error = '';
 
-    this.productService.list(categoryId).subscribe({
+    this.productService.list(categoryId, this.sortBy === 'trending' ? 'trending' : undefined).subscribe({
       next: (products) => {
         this.products = products;
+        this.showingTrending = this.sortBy === 'trending';
+        this.watchlistIds = new Set(products.filter(product => product.is_watched).map(product => product.id));
         this.sortProducts();
         this.loading = false;
       },
@@ -155,6 +179,8 @@ export class ProductListComponent implements OnInit {
 
   sortProducts() {
     switch (this.sortBy) {
+      case 'trending':
+        break; // Already in score order from the server
       case 'newest':
         this.products.sort((a, b) => {
           const dateA = new Date(a.created_at || 0).getTime();
@@ -181,8 +207,13 @@ export class ProductListComponent implements OnInit {
   }
 
   onSortChange() {
+    // Trending is its own (top) set of products rather than a re-sort of the list
+    const refetch = this.sortBy === 'trending' || this.showingTrending;
     if (this.sortBy === 'distance_asc' as any) {
+      if (refetch) this.fetchProducts();
       this.requestUserLocation();
+    } else if (refetch) {
+      this.fetchProducts();
     } else {
       this.sortProducts();
     }
@@ -270,8 +301,13 @@ export class ProductListComponent implements OnInit {
   get filteredProducts(): Product[] {
     let filtered = this.products;
 
-    // Search filter
-    if (this.searchQuery.trim()) {
+    // Search filter: the server's typo-tolerant matches, best first, once they arrive
+    if (this.searchQuery.trim() && this.searchRanks) {
+      const ranks = this.searchRanks;
+      filtered = filtered
+        .filter(product => ranks.has(product.id))
+        .sort((a, b) => ranks.get(a.id)! - ranks.get(b.id)!);
+    } else if (this.searchQuery.trim()) {
       const query = this.searchQuery.toLowerCase();
       filtered = filtered.filter(product =>
         product.title.toLowerCase().includes(query) ||
@@ -300,6 +336,7 @@ export class ProductListComponent implements OnInit {
 
   clearSearch() {
     this.searchQuery = '';
+    this.onSearchInput('');
   }
 
   clearPriceFilter() {
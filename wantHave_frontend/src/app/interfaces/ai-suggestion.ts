@@ -7,3 +7,12 @@ export interface AISuggestion {
     price_max: number;
     error?: string;
 }
+
+export interface AutofillJob {
+    id: string;
+    status: 'queued' | 'running' | 'done' | 'failed';
+    status_url?: string;
+    result?: AISuggestion;
+    error?: string;
+    retry_after?: number;
+}
@@ -23,4 +23,27 @@ export interface Product {
   latitude?: number | null;
   longitude?: number | null;
   city?: string | null;
+  is_watched?: boolean;
+  engagement?: ProductEngagement;  // Only on the detail endpoint
+  possible_duplicates?: DuplicateListing[];  // Only in the create response
+}
+
+// an available listing whose photo looks the same as a newly created one
+export interface DuplicateListing {
+  id: number;
+  title: string;
+  seller_id: number;
+  distance: number;  // differing perceptual hash bits, 0 for the same photo
+}
+
+export interface ProductEngagement {
+  views: number;
+  impressions: number;
+  clicks: number;
+}
+
+export interface Suggestion {
+  text: string;
+  kind: 'title' | 'category';
+  category_id?: number;
 }
@@ -1,4 +1,4 @@
-import { UserSummary } from './product';
+import { ProductEngagement, UserSummary } from './product';
 
 export interface UserProfile {
   id: number;
@@ -14,5 +14,6 @@ export interface UserProfile {
   address: string;
   active_listings_count: number;
   sold_items_count: number;
+  listing_engagement?: ProductEngagement;
   member_since: string | null;
 }
\ No newline at end of file
@@ -1,7 +1,7 @@
 import { HttpClient } from '@angular/common/http';
 import { inject, Injectable } from '@angular/core';
-import { Observable } from 'rxjs';
-import { AISuggestion } from '../interfaces/ai-suggestion';
+import { Observable, first, map, switchMap, timer } from 'rxjs';
+import { AISuggestion, AutofillJob } from '../interfaces/ai-suggestion';
 
 @Injectable({
     providedIn: 'root',
@@ -9,15 +9,31 @@ import { AISuggestion } from '../interfaces/ai-suggestion';
 export class AiService {
     private http = inject(HttpClient);
     private readonly baseUrl = '/api/market/products/';
+    private readonly pollIntervalMs = 1500;
 
     /**
      * Analyze a product image using AI and get suggestions for listing fields.
+     * Submits a background job and polls its status until the result is ready.
      * @param file The image file to analyze
      * @returns Observable with AI suggestions for title, description, category, and price
      */
     analyzeImage(file: File): Observable<AISuggestion> {
         const formData = new FormData();
         formData.append('image', file);
-        return this.http.post<AISuggestion>(`${this.baseUrl}autofill/`, formData);
+        return this.http.post<AutofillJob>(`${this.baseUrl}autofill/jobs/`, formData).pipe(
+            switchMap((job) =>
+                timer(0, this.pollIntervalMs).pipe(
+                    switchMap(() => this.http.get<AutofillJob>(`${this.baseUrl}autofill/jobs/${job.id}/`)),
+                    first((current) => current.status === 'done' || current.status === 'failed'),
+                ),
+            ),
+            map((job) => {
+                if (job.status === 'failed' || !job.result) {
+                    // same shape as an HTTP error so callers can read err.error.error
+                    throw { error: { error: job.error ?? 'AI analysis failed' } };
+                }
+                return job.result;
+            }),
+        );
     }
 }
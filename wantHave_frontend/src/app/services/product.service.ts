@@ -1,7 +1,7 @@
 import { HttpClient, HttpParams } from '@angular/common/http';
 import { inject, Injectable } from '@angular/core';
 import { Observable } from 'rxjs';
-import { Product } from '../interfaces/product';
+import { Product, Suggestion } from '../interfaces/product';
 
 // service for interacting with product-related backend API endpoints
 @Injectable({
@@ -11,12 +11,20 @@ export class ProductService {
   private http = inject(HttpClient);
   private readonly baseUrl = '/api/market/products/';
 
-  // fetches the list of all products, optionally filtered by category
-  list(categoryId?: number | null): Observable<Product[]> {
+  // fetches the list of all products, optionally filtered by category;
+  // ordering 'trending' returns only the top trending products, in score order;
+  // search returns typo-tolerant title and description matches, best first
+  list(categoryId?: number | null, ordering?: 'trending', search?: string): Observable<Product[]> {
     let params = new HttpParams();
     if (categoryId) {
       params = params.set('category', categoryId.toString());
     }
+    if (ordering) {
+      params = params.set('ordering', ordering);
+    }
+    if (search) {
+      params = params.set('search', search);
+    }
     return this.http.get<Product[]>(this.baseUrl, { params });
   }
 
@@ -25,6 +33,22 @@ export class ProductService {
     return this.http.get<Product>(`${this.baseUrl}${id}/detail/`);
   }
 
+  // counts a click-through from a product list
+  recordClick(id: number): Observable<void> {
+    return this.http.post<void>(`${this.baseUrl}${id}/click/`, {});
+  }
+
+  // autocomplete for the search box: listing titles and category names, most popular first
+  suggest(prefix: string, limit = 8): Observable<Suggestion[]> {
+    const params = new HttpParams().set('prefix', prefix).set('limit', limit.toString());
+    return this.http.get<Suggestion[]>(`${this.baseUrl}suggest/`, { params });
+  }
+
+  // precomputed similar available listings, most similar first
+  similar(id: number): Observable<Product[]> {
+    return this.http.get<Product[]>(`${this.baseUrl}${id}/similar/`);
+  }
+
   // buys a product
   buy(id: number): Observable<Product> {
     return this.http.post<Product>(`${this.baseUrl}${id}/buy/`, {});